@@ -0,0 +1,144 @@
+import logging
+import time
+from collections import deque
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """Upstream ถูกตัดวงจรอยู่ (ไม่ยิง request)"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker ของ upstream หนึ่งตัว (closed -> open -> half_open -> closed)
+
+    - closed: ยิงได้ตามปกติ; ดูผล window ล่าสุด ถ้า error rate >= error_rate
+      หรือ p95 latency >= slow_p95 (เมื่อมีอย่างน้อย min_calls) -> open
+    - open: ไม่ยิงเลย open_seconds วินาที แล้วเข้า half_open
+    - half_open: ปล่อย probe ทีละ half_open_probes ตัว สำเร็จ -> closed (ล้าง window), พัง -> open ใหม่
+    - timeout(): adaptive timeout = p95 ของ latency ที่สำเร็จ x multiplier (อยู่ในช่วง min_timeout..max_timeout)
+    """
+
+    def __init__(self, window=50, min_calls=10, error_rate=0.5, slow_p95=8.0, open_seconds=30,
+                 half_open_probes=1, min_timeout=2.0, max_timeout=12.0, multiplier=2.0, clock=time.monotonic):
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_p95 = slow_p95
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.multiplier = multiplier
+        self.clock = clock
+
+        self.calls = deque(maxlen=window)  # (ok, latency) ok=None = ถูกยกเลิกกลางทาง
+        self.latencies = deque(maxlen=window)  # latency ของ call ที่สำเร็จ (ใช้คิด timeout)
+        self._state = "closed"
+        self.opened_at = None
+        self.opened_count = 0
+        self.probes = 0
+
+    @property
+    def state(self):
+        # ครบเวลา open แล้วเข้า half_open เอง (ไม่ต้องมี timer)
+        if self._state == "open" and self.clock() - self.opened_at >= self.open_seconds:
+            self._state = "half_open"
+            self.probes = 0
+        return self._state
+
+    def available(self):
+        """เช็คเฉยๆ ว่าตอนนี้ควรลองยิงไหม (ไม่จอง probe)"""
+        state = self.state
+        return state == "closed" or (state == "half_open" and self.probes < self.half_open_probes)
+
+    def allow(self):
+        """ขออนุญาตยิง 1 ครั้ง (half_open จะจอง probe ไว้จนกว่าจะ record / release)"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and self.probes < self.half_open_probes:
+            self.probes += 1
+            return True
+        return False
+
+    def release(self):
+        """call ถูกยกเลิกกลางทาง (ไม่นับว่าสำเร็จหรือพัง) คืน probe ที่จองไว้"""
+        if self._state == "half_open" and self.probes:
+            self.probes -= 1
+
+    def record_cancelled(self, latency):
+        """
+        call ถูกยกเลิกกลางทาง (เช่น เกิน budget แล้วไม่ warm ต่อ): ไม่รู้ผล แต่รู้ว่าช้าอย่างน้อย latency
+        นับเข้า window เป็น latency (ไม่ใช่ error) ให้ slow_p95 เห็น; half_open แค่คืน probe
+        """
+        if self._state == "half_open":
+            self.release()
+            return
+        self.calls.append((None, latency))
+        self._evaluate()
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        if self._state == "half_open":
+            self._close()
+            return
+        self.calls.append((True, latency))
+        self._evaluate()
+
+    def record_failure(self, latency=None):
+        if self._state == "half_open":
+            self._open()
+            return
+        self.calls.append((False, latency))
+        self._evaluate()
+
+    def timeout(self):
+        if len(self.latencies) < self.min_calls:
+            return self.max_timeout
+        p95 = float(np.percentile(self.latencies, 95))
+        return min(self.max_timeout, max(self.min_timeout, p95 * self.multiplier))
+
+    def stats(self):
+        errors, p95 = self._window_stats()
+        state = self.state
+        return {
+            "state": state,
+            "calls_in_window": len(self.calls),
+            "error_rate": round(errors, 4),
+            "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+            "timeout_s": round(self.timeout(), 2),
+            "opened_count": self.opened_count,
+            "retry_in_s": round(self.opened_at + self.open_seconds - self.clock(), 1) if state == "open" else None,
+        }
+
+    def _window_stats(self):
+        if not self.calls:
+            return 0.0, None
+        errors = sum(ok is False for ok, _ in self.calls) / len(self.calls)
+        latencies = [latency for _, latency in self.calls if latency is not None]
+        p95 = float(np.percentile(latencies, 95)) if latencies else None
+        return errors, p95
+
+    def _evaluate(self):
+        if self._state != "closed" or len(self.calls) < self.min_calls:
+            return
+        errors, p95 = self._window_stats()
+        if errors >= self.error_rate or (p95 is not None and p95 >= self.slow_p95):
+            self._open()
+
+    def _open(self):
+        log.warning("🚧 Circuit opened for %ss", self.open_seconds)
+        self._state = "open"
+        self.opened_at = self.clock()
+        self.opened_count += 1
+        self.probes = 0
+
+    def _close(self):
+        log.info("✅ Circuit closed")
+        self._state = "closed"
+        self.calls.clear()
+        self.probes = 0
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    LRU cache ขนาดจำกัด + TTL (entry หมดอายุหลัง ttl วินาที)
+
+    - memory tier: OrderedDict เก็บ max_entries ตัวล่าสุด
+    - disk tier (ถ้าให้ disk_dir): ไฟล์ JSON ต่อ key รอดข้าม restart / cold start
+      memory miss แล้วเจอบน disk จะดึงขึ้น memory ให้
+    - cost = เวลาที่ต้องจ่ายถ้าไม่มี cache (เช่น latency ของ LLM call) ใช้คำนวณ saved latency ตอน hit
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, disk_dir=None, max_disk_entries=10000, clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.max_disk_entries = max_disk_entries
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (expires_at, value, cost)
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.saved_seconds = 0.0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """คืน value หรือ None (ไม่มี / หมดอายุ)"""
+        now = self.clock()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[2]
+                return entry[1]
+
+        entry = self._disk_get(key, now)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._put(key, entry)
+            self.hits += 1
+            self.disk_hits += 1
+            self.saved_seconds += entry[2]
+            return entry[1]
+
+    def set(self, key, value, cost=0.0):
+        entry = (self.clock() + self.ttl, value, cost)
+        with self.lock:
+            self._put(key, entry)
+        self._disk_set(key, entry)
+
+    def discard(self, key):
+        """ลบ key ทั้งสอง tier (เช่น value ที่ cache ไว้ใช้ไม่ได้แล้ว)"""
+        with self.lock:
+            self.entries.pop(key, None)
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """ล้างทั้งสอง tier (เช่น ข้อมูลที่ cache ไว้ผูกกับ catalog ชุดเก่าทั้งก้อน)"""
+        with self.lock:
+            self.entries.clear()
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except FileNotFoundError:
+                        pass
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "saved_latency_s": round(self.saved_seconds, 3),
+        }
+
+    def _put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # ---------- disk tier ----------
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode()).hexdigest() + ".json")
+
+    def _disk_get(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record.get("key") != key or record["expires_at"] <= now:
+            return None
+        return record["expires_at"], record["value"], record.get("cost", 0.0)
+
+    def _disk_set(self, key, entry):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        record = {"key": key, "expires_at": entry[0], "value": entry[1], "cost": entry[2]}
+        try:
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+            self._prune_disk()
+        except OSError as e:
+            log.warning("⚠️ Cache disk write failed: %s", e)
+
+    def _prune_disk(self):
+        """ไฟล์เกิน max_disk_entries -> ลบตัวที่เขียนนานที่สุดทิ้ง"""
+        names = [n for n in os.listdir(self.disk_dir) if n.endswith(".json")]
+        if len(names) <= self.max_disk_entries:
+            return
+        paths = sorted((os.path.join(self.disk_dir, n) for n in names), key=os.path.getmtime)
+        for path in paths[:len(paths) - self.max_disk_entries]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
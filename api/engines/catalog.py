@@ -0,0 +1,208 @@
+import numpy as np
+from collections import defaultdict
+from scipy import sparse
+
+
+class FoodCatalog:
+    """
+    Struct-of-arrays view ของเมนูทั้งหมด สร้างครั้งเดียวตอน train
+    row i ของทุก array คือเมนูตัวเดียวกัน (ลำดับเดียวกับ list ที่ส่งเข้ามา)
+    """
+
+    def __init__(self, all_foods, tag_matrix=None):
+        self.ids = [str(f['id']) for f in all_foods]
+        self.id_to_row = {}
+        for row, food_id in enumerate(self.ids):
+            # id ซ้ำ: ยึด row แรกเหมือน list.index() เดิม
+            self.id_to_row.setdefault(food_id, row)
+
+        self.names = [f.get('name', '') for f in all_foods]
+        self.tag_lists = [list(f.get('tags', [])) for f in all_foods]
+        self.prices = np.array([f.get('price', 0) or 0 for f in all_foods], dtype=float)
+        self.popularity = np.array([f.get('popularity', 0) or 0 for f in all_foods], dtype=float)
+
+        # Price index: rows เรียงตามราคา ใช้ bisect หา rows ในงบได้ทันที
+        self.price_order = np.argsort(self.prices, kind='stable')
+        self.sorted_prices = self.prices[self.price_order]
+
+        # Categories เก็บเป็น integer code
+        self.category_names = []
+        self.category_index = {}
+        codes = []
+        for f in all_foods:
+            category = f.get('category', 'unknown')
+            code = self.category_index.get(category)
+            if code is None:
+                code = len(self.category_names)
+                self.category_index[category] = code
+                self.category_names.append(category)
+            codes.append(code)
+        self.category_codes = np.array(codes, dtype=np.int32)
+
+        # Inverted index: tag -> sorted array ของ rows ที่มี tag นั้น
+        postings = defaultdict(list)
+        for row, tags in enumerate(self.tag_lists):
+            for tag in set(tags):
+                postings[tag].append(row)
+        self.tag_postings = {tag: np.array(rows, dtype=np.intp) for tag, rows in postings.items()}
+
+        self.tags = None
+        self.row_norms = np.zeros(len(self.ids))
+        if tag_matrix is not None:
+            self.set_tag_matrix(tag_matrix)
+
+    @classmethod
+    def from_arrays(cls, arrays, category_names, vocab):
+        """
+        สร้าง catalog จาก arrays ที่ save ไว้ (เช่น np.load(..., mmap_mode='r'))
+        numeric arrays / CSR / postings ใช้ buffer เดิมตรงๆ ไม่ copy; ส่วนที่เป็น Python object
+        (ids, names, tag lists) สร้างจาก arrays อีกที
+        """
+        catalog = cls.__new__(cls)
+        catalog.ids = arrays['ids'].tolist()
+        catalog.id_to_row = {}
+        for row, food_id in enumerate(catalog.ids):
+            catalog.id_to_row.setdefault(food_id, row)
+        catalog.names = arrays['names'].tolist()
+
+        vocab = list(vocab)
+        # tolist ก่อน: slice ทีละ row บน memmap ช้ากว่า list หลายเท่า
+        indptr, cols = arrays['item_tags_indptr'].tolist(), arrays['item_tags_cols'].tolist()
+        catalog.tag_lists = [[vocab[c] for c in cols[indptr[row]:indptr[row + 1]]] for row in range(len(catalog.ids))]
+
+        for field in ('prices', 'popularity', 'price_order', 'sorted_prices', 'category_codes', 'row_norms'):
+            setattr(catalog, field, arrays[field])
+        catalog.category_names = list(category_names)
+        catalog.category_index = {name: code for code, name in enumerate(catalog.category_names)}
+
+        n_rows, n_cols = len(catalog.ids), len(vocab)
+        catalog.tags = sparse.csr_matrix(
+            (arrays['tags_data'], arrays['tags_indices'], arrays['tags_indptr']), shape=(n_rows, n_cols)
+        )
+        p_indptr, p_rows = arrays['postings_indptr'], arrays['postings_rows']
+        catalog.tag_postings = {
+            tag: p_rows[p_indptr[col]:p_indptr[col + 1]]
+            for col, tag in enumerate(vocab)
+            if p_indptr[col + 1] > p_indptr[col]
+        }
+        return catalog
+
+    def to_arrays(self, vocab):
+        """Arrays สำหรับ save ลง disk (คู่กับ from_arrays)"""
+        col_of = {tag: col for col, tag in enumerate(vocab)}
+        item_tags_indptr = np.zeros(len(self.ids) + 1, dtype=np.int64)
+        item_tags_cols = []
+        for row, tags in enumerate(self.tag_lists):
+            item_tags_cols.extend(col_of[t] for t in tags if t in col_of)
+            item_tags_indptr[row + 1] = len(item_tags_cols)
+
+        tags = self.tags if self.tags is not None else sparse.csr_matrix((len(self.ids), len(vocab)))
+        postings = tags.tocsc()
+        postings.sort_indices()
+        return {
+            'ids': np.array(self.ids, dtype=str),
+            'names': np.array(self.names, dtype=str),
+            'item_tags_indptr': item_tags_indptr,
+            'item_tags_cols': np.array(item_tags_cols, dtype=np.int32),
+            'prices': self.prices,
+            'popularity': self.popularity,
+            'price_order': self.price_order,
+            'sorted_prices': self.sorted_prices,
+            'category_codes': self.category_codes,
+            'row_norms': self.row_norms,
+            'tags_data': tags.data,
+            'tags_indices': tags.indices,
+            'tags_indptr': tags.indptr,
+            'postings_indptr': postings.indptr,
+            'postings_rows': postings.indices.astype(np.intp),
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set_tag_matrix(self, tag_matrix):
+        """เก็บ tag matrix แบบ CSR พร้อม norm ของแต่ละ row"""
+        self.tags = sparse.csr_matrix(tag_matrix, dtype=float)
+        self.row_norms = np.sqrt(np.asarray(self.tags.multiply(self.tags).sum(axis=1)).ravel())
+
+    def rows_for(self, food_ids):
+        """Map ids -> rows (ตัด id ที่ไม่รู้จักทิ้ง) คืนค่าเป็น array ตามลำดับที่ส่งเข้ามา"""
+        rows = [self.id_to_row[i] for i in food_ids if i in self.id_to_row]
+        return np.asarray(rows, dtype=np.intp)
+
+    def item(self, row):
+        """ประกอบ food dict กลับจาก arrays (ใช้กับ shortlist เล็กๆ เท่านั้น)"""
+        return {
+            'id': self.ids[row],
+            'name': self.names[row],
+            'tags': self.tag_lists[row],
+            'price': float(self.prices[row]),
+        }
+
+    def _in_postings(self, tag, rows):
+        """Membership test ของ rows ใน postings ของ tag (binary search บน array ที่เรียงแล้ว)"""
+        postings = self.tag_postings.get(tag)
+        if postings is None or len(postings) == 0:
+            return np.zeros(len(rows), dtype=bool)
+        idx = np.searchsorted(postings, rows)
+        idx[idx == len(postings)] = 0
+        return postings[idx] == rows
+
+    def tag_overlap(self, rows, tags):
+        """จำนวน tags (ไม่นับซ้ำ) ที่แต่ละ row มี"""
+        rows = np.asarray(rows, dtype=np.intp)
+        overlap = np.zeros(len(rows), dtype=np.int32)
+        for tag in set(tags or []):
+            overlap += self._in_postings(tag, rows)
+        return overlap
+
+    def budget_mask(self, price_min, price_max):
+        """Boolean mask ของ rows ที่ price_min <= price <= price_max"""
+        lo = np.searchsorted(self.sorted_prices, price_min, side='left')
+        hi = np.searchsorted(self.sorted_prices, price_max, side='right')
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[self.price_order[lo:hi]] = True
+        return mask
+
+    def category_codes_for(self, categories):
+        """Map category names -> codes (category ที่ไม่มีใน catalog จะถูกตัดทิ้ง)"""
+        return np.array(
+            [self.category_index[c] for c in set(categories) if c in self.category_index],
+            dtype=np.int32,
+        )
+
+
+class TagEncoder:
+    """
+    Multi-hot encoder ของ tags (ใช้แทน MultiLabelBinarizer)
+    ต่างตรงที่ต่อ tag ใหม่เป็น column ท้ายสุดได้ โดย column เดิมไม่ขยับ -> delta update ไม่ต้อง fit ใหม่ทั้งหมด
+    """
+
+    def __init__(self, classes=(), sparse_output=True):
+        self.classes_ = np.array(list(classes), dtype=object)
+        self.index = {tag: col for col, tag in enumerate(self.classes_)}
+        self.sparse_output = sparse_output
+
+    def fit_transform(self, tag_lists):
+        self.__init__(sorted({tag for tags in tag_lists for tag in tags}), self.sparse_output)
+        return self.transform(tag_lists)
+
+    def transform(self, tag_lists, sparse_output=None):
+        """Encode list of tag lists (tag ที่ไม่รู้จักจะถูกข้าม)"""
+        indptr = [0]
+        indices = []
+        for tags in tag_lists:
+            indices.extend(sorted({self.index[t] for t in tags if t in self.index}))
+            indptr.append(len(indices))
+        matrix = sparse.csr_matrix(
+            (np.ones(len(indices)), np.asarray(indices, dtype=np.int32), np.asarray(indptr, dtype=np.int32)),
+            shape=(len(tag_lists), len(self.classes_)),
+        )
+        if sparse_output is None:
+            sparse_output = self.sparse_output
+        return matrix if sparse_output else matrix.toarray()
+
+    def extended(self, tag_lists):
+        """Encoder ตัวใหม่ที่มี tags ใหม่ต่อท้าย (ตัวเดิมไม่ถูกแก้ เพราะ snapshot เก่าอาจยังใช้อยู่)"""
+        new_tags = [t for t in dict.fromkeys(t for tags in tag_lists for t in tags) if t not in self.index]
+        return TagEncoder(list(self.classes_) + new_tags, self.sparse_output)
@@ -1,109 +1,155 @@
+import copy
+import logging
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
-from sklearn.preprocessing import MultiLabelBinarizer
+from scipy import sparse
 from collections import Counter
 
+from api.engines.catalog import FoodCatalog, TagEncoder
+from api.engines.neighbors import make_neighbor_index
+from api.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# predict_batch: งบ RAM ของ score matrix (chunk x n_items float64) ต่อ chunk -> catalog ยิ่งใหญ่ chunk ยิ่งเล็ก
+BATCH_SCORE_BYTES = 64 * 1024 * 1024
+
 class KNNEngine:
-    def __init__(self):
+    def __init__(self, sparse=True, index="brute"):
         # ใช้ Cosine Similarity สำหรับเปรียบเทียบ Tags
-        self.model = NearestNeighbors(metric='cosine', algorithm='brute', n_neighbors=100)
-        self.encoder = MultiLabelBinarizer()
-        self.food_ids = [] 
+        # index: 'brute' (exact) | 'lsh' (approximate) หรือ instance จาก api.engines.neighbors
+        self.model = make_neighbor_index(index)
+        # sparse=True: เก็บ food vectors / user vector เป็น CSR ตลอดทาง (vocab ใหญ่ๆ ไม่เปลือง RAM)
+        self.sparse = sparse
+        self.encoder = TagEncoder(sparse_output=sparse)
         self.is_trained = False
         self.food_vectors = None
-        self.food_metadata = {}  # เก็บข้อมูลเพิ่มเติม
+        self.catalog = FoodCatalog([])  # ids, prices, categories, tag matrix แบบ struct-of-arrays
+        self.popularity_bonus = np.zeros(0)
         
     def train(self, all_foods):
         """
         Train KNN model with enhanced feature extraction
         """
         if not all_foods:
-            print("⚠️ Warning: No food data to train KNN")
+            log.warning("⚠️ Warning: No food data to train KNN")
             self.is_trained = False
             return
         
-        # 1. เก็บ IDs และ metadata
-        self.food_ids = [str(f['id']) for f in all_foods]
-        self.food_metadata = {
-            str(f['id']): {
-                'tags': f.get('tags', []),
-                'category': f.get('category', 'unknown'),
-                'popularity': f.get('popularity', 0),
-                'name': f.get('name', '')
-            } for f in all_foods
-        }
+        # 1. สร้าง catalog (ids, prices, popularity, categories) ครั้งเดียว
+        catalog = FoodCatalog(all_foods)
         
         # 2. Extract tags
         all_tags = [f.get('tags', []) for f in all_foods]
         
         if not any(all_tags):  # ถ้าไม่มี tags เลย
-            print("⚠️ No tags found in data")
+            self.catalog = catalog
+            log.warning("⚠️ No tags found in data")
             return
         
         # 3. Create vectors
-        self.food_vectors = self.encoder.fit_transform(all_tags)
+        encoder = TagEncoder(sparse_output=self.sparse)
+        self._fit(catalog, encoder, encoder.fit_transform(all_tags))
+        
+        log.info("✅ KNN Trained: %d items, %d unique tags", len(all_foods), len(self.encoder.classes_))
+    
+    def _fit(self, catalog, encoder, food_vectors):
+        self.catalog = catalog
+        self.encoder = encoder
+        popularity = catalog.popularity
+        self.popularity_bonus = np.where(popularity > 0, np.minimum(popularity / 1000, 0.05), 0.0)
+        
+        self.food_vectors = food_vectors
+        if catalog.tags is None:
+            catalog.set_tag_matrix(food_vectors)
+        if self.sparse:
+            self.food_vectors = catalog.tags  # ใช้ CSR ก้อนเดียวกับ catalog ไม่ต้องเก็บซ้ำ
         
         # 4. Train model
         self.model.fit(self.food_vectors)
         self.is_trained = True
+    
+    @classmethod
+    def from_catalog(cls, catalog, encoder, sparse=True, index="brute"):
+        """Engine จาก catalog ที่มี tag matrix อยู่แล้ว (เช่นโหลดจาก snapshot บน disk) ไม่ต้อง encode ใหม่"""
+        engine = cls(sparse=sparse, index=index)
+        if len(catalog) and len(encoder.classes_):
+            engine._fit(catalog, encoder, catalog.tags if sparse else catalog.tags.toarray())
+        else:
+            engine.catalog = catalog
+        return engine
+    
+    def with_delta(self, all_foods, reuse_rows):
+        """
+        สร้าง engine ตัวใหม่จาก engine นี้ + รายการเมนูชุดใหม่ (engine นี้ไม่ถูกแก้)
+        reuse_rows[i] = row เดิมที่ vector ใช้ต่อได้ หรือ -1 ถ้าเป็นเมนูใหม่/ถูกแก้
+        encode เฉพาะ rows ที่ -1 ส่วน tag ใหม่ต่อท้ายเป็น column ใหม่ (ไม่ fit ใหม่ทั้งก้อน)
+        """
+        engine = KNNEngine(sparse=self.sparse, index=copy.copy(self.model))
+        if not self.is_trained:
+            engine.train(all_foods)
+            return engine
+        
+        reuse_rows = np.asarray(reuse_rows, dtype=np.intp)
+        keep = np.flatnonzero(reuse_rows >= 0)
+        changed = np.flatnonzero(reuse_rows < 0)
+        changed_tags = [all_foods[i].get('tags', []) for i in changed]
+        encoder = self.encoder.extended(changed_tags)
+        n_cols = len(encoder.classes_)
+        
+        old = self.catalog.tags[reuse_rows[keep]]
+        old = sparse.csr_matrix((old.data, old.indices, old.indptr), shape=(len(keep), n_cols))
+        stacked = sparse.vstack([old, encoder.transform(changed_tags, sparse_output=True)]).tocsr()
+        
+        # stacked row j คือ row ใหม่ที่ concat[j] -> จัดเรียงกลับตามลำดับ all_foods
+        order = np.empty(len(all_foods), dtype=np.intp)
+        order[np.concatenate([keep, changed])] = np.arange(len(all_foods))
+        vectors = stacked[order]
         
-        print(f"✅ KNN Trained: {len(all_foods)} items, {len(self.encoder.classes_)} unique tags")
+        engine._fit(FoodCatalog(all_foods), encoder, vectors if self.sparse else vectors.toarray())
+        log.info("✅ KNN Delta: %d rows encoded, %d new tags", len(changed), n_cols - len(self.encoder.classes_))
+        return engine
         
     # 🌟 แกะ 1: เพิ่มตัวแปร filter_tags เข้ามาในฟังก์ชัน predict
-    def predict(self, candidates, eat_now_objs, liked_objs, disliked_objs, filter_tags=None, boost_recent=False):
+    def predict(self, candidates, eat_now_objs, liked_objs, disliked_objs, filter_tags=None, boost_recent=False,
+                history_vector=None):
         """
         Enhanced prediction with multiple strategies
+        candidates: list of food dicts หรือ np.ndarray ของ catalog rows
+        history_vector: ผลรวม tag vectors ของ history ที่คำนวณไว้แล้ว (UserProfile.vector) ไม่ต้อง encode history ใหม่
         """
         if not self.is_trained:
-            print("❌ KNN not trained yet!")
+            log.error("❌ KNN not trained yet!")
             return []
         
         # 1. สร้าง User Profile Vector (ส่ง filter_tags เข้าไปคำนวณด้วย)
-        user_vector = self._build_user_vector(
-            eat_now_objs, 
-            liked_objs, 
-            disliked_objs,
-            filter_tags, # <-- ส่งค่าไปตรงนี้
-            boost_recent
-        )
-        
-        # 2. หา Candidates ที่เหมาะสม
-        candidate_ids_set = {str(c['id']) for c in candidates}
-        
-        # 3. คำนวณ similarity scores
-        scored_candidates = []
-        
-        for candidate in candidates:
-            cand_id = str(candidate['id'])
-            
-            try:
-                idx = self.food_ids.index(cand_id)
-                food_vector = self.food_vectors[idx]
-                
-                # คำนวณ cosine similarity
-                similarity = self._cosine_similarity(user_vector, food_vector)
-                
-                # เพิ่มโบนัสจาก metadata
-                bonus = self._calculate_bonus(
-                    cand_id, 
-                    eat_now_objs, 
-                    liked_objs
-                )
-                
-                final_score = similarity + bonus
-                scored_candidates.append((cand_id, final_score))
-                
-            except ValueError:
-                continue
+        with metrics.span("user_vector"):
+            user_vector = self._build_user_vector(
+                eat_now_objs, 
+                liked_objs, 
+                disliked_objs,
+                filter_tags, # <-- ส่งค่าไปตรงนี้
+                boost_recent,
+                history_vector,
+            )
         
-        # 4. เรียงตาม score
-        scored_candidates.sort(key=lambda x: x[1], reverse=True)
+        with metrics.span("scoring"):
+            # 2. หา Candidates ที่เหมาะสม (map id -> row ทีเดียว หรือรับ row indices มาตรงๆ)
+            rows = self._candidate_rows(candidates)
+            
+            # 3. คำนวณ similarity + bonus ทั้งก้อนเป็น vector
+            scores = self._cosine_scores(user_vector, rows) + self._calculate_bonus(rows, eat_now_objs)
+            # ปัด fp noise ทิ้ง: คะแนนที่เท่ากันจริงจะเสมอกันและเรียงตามลำดับ candidates เสมอ
+            scores = np.round(scores, 12)
+            
+            # 4. เลือก top-15 แบบ partial sort
+            top = self._top_k(scores, 15)
         
         # 5. ใช้ KNN ช่วยเพิ่มความหลากหลาย
-        knn_recommendations = self._get_knn_neighbors(user_vector, candidate_ids_set)
+        with metrics.span("knn_neighbors"):
+            knn_recommendations = self._get_knn_neighbors(user_vector, rows)
         
         # 6. ผสมผลลัพธ์: 70% จาก scoring, 30% จาก KNN
-        top_scored = [item[0] for item in scored_candidates[:15]]
+        top_scored = [self.catalog.ids[rows[i]] for i in top]
         
         final_results = []
         seen = set()
@@ -120,105 +166,224 @@ class KNNEngine:
                 final_results.append(food_id)
                 seen.add(food_id)
         
-        print(f"🎯 KNN Recommendations (Total={len(final_results)} items)")
+        log.debug("🎯 KNN Recommendations (Total=%d items)", len(final_results))
         return final_results
     
+    def predict_batch(self, candidates, eat_now_objs, liked_objs, disliked_objs, filter_tags=None, k=10,
+                      chunk_size=None):
+        """
+        Scoring ของ user หลายคนพร้อมกัน (ผลเท่ากับ predict ทีละคน)
+        ทุก argument เป็น list ต่อ user: candidates[u] = array ของ catalog rows, *_objs[u] = list of food dicts
+        - user vectors ของทั้ง chunk เป็น CSR matrix เดียว (history weights x tag matrix + filter)
+        - scores = user matrix x tag matrix.T ครั้งเดียวต่อ chunk แล้วเลือก top-k จาก candidates ของแต่ละ user
+        chunk_size=None: ให้ score matrix ของ chunk อยู่ใน BATCH_SCORE_BYTES
+        คืน list ของ ids (ไม่เกิน k ตัว) ต่อ user
+        """
+        n_users = len(candidates)
+        if not self.is_trained:
+            log.error("❌ KNN not trained yet!")
+            return [[] for _ in range(n_users)]
+        filter_tags = filter_tags if filter_tags is not None else [None] * n_users
+        if chunk_size is None:
+            chunk_size = max(1, BATCH_SCORE_BYTES // (8 * max(1, len(self.catalog))))
+
+        results = []
+        for start in range(0, n_users, chunk_size):
+            chunk = slice(start, min(start + chunk_size, n_users))
+            with metrics.span("batch_scoring"):
+                user_matrix = self._build_user_matrix(
+                    eat_now_objs[chunk], liked_objs[chunk], disliked_objs[chunk], filter_tags[chunk]
+                )
+                results.extend(self._top_k_batch(
+                    user_matrix, candidates[chunk], eat_now_objs[chunk], k
+                ))
+        return results
+
+    def _build_user_matrix(self, eat_now_objs, liked_objs, disliked_objs, filter_tags):
+        """
+        User vectors ของหลาย user เป็น CSR (n_users x n_tags) ที่ normalize แล้ว
+        น้ำหนักเดียวกับ _build_user_vector: EAT 6, LIKE 2, DISLIKE -7, filter 200
+        """
+        n_users = len(eat_now_objs)
+        users, rows, weights = [], [], []
+        for weight, objs_per_user in ((6.0, eat_now_objs), (2.0, liked_objs), (-7.0, disliked_objs)):
+            for user, objs in enumerate(objs_per_user):
+                history_rows = self.catalog.rows_for(str(f['id']) for f in objs or [])
+                users.extend([user] * len(history_rows))
+                rows.extend(history_rows.tolist())
+                weights.extend([weight] * len(history_rows))
+        # user x item weights (COO รวม weight ที่ซ้ำกันให้เอง) แล้วคูณ tag matrix ทีเดียว
+        history = sparse.csr_matrix((weights, (users, rows)), shape=(n_users, len(self.catalog)))
+        user_matrix = history @ self.catalog.tags
+
+        filters = self.encoder.transform([tags or [] for tags in filter_tags], sparse_output=True)
+        user_matrix = sparse.csr_matrix(user_matrix + filters * 200.0)
+
+        norms = np.sqrt(np.asarray(user_matrix.multiply(user_matrix).sum(axis=1)).ravel())
+        inv = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        return sparse.csr_matrix(sparse.diags(inv) @ user_matrix)
+
+    def _top_k_batch(self, user_matrix, candidates, eat_now_objs, k):
+        """
+        Cosine + bonus ของทั้ง chunk แล้วเลือก top-k ต่อ user (เสมอกันใช้ row น้อยก่อน เหมือน _top_k)
+        dense matrix มีแค่ scores ก้อนเดียว: หาร norm / บวก bonus ทีละแถวแบบ in-place ไม่มี denom / mask เต็มความกว้าง
+        """
+        user_norms = np.sqrt(np.asarray(user_matrix.multiply(user_matrix).sum(axis=1)).ravel())
+        scores = (self.catalog.tags @ user_matrix.T).T.toarray(order="C")
+
+        results = []
+        for user, rows in enumerate(candidates):
+            user_scores = scores[user]
+            # คำนวณแบบเดียวกับ _cosine_scores (dot / (row norm * user norm)) -> ผลตรงกับ predict ทีละคนทุก bit
+            denom = self.catalog.row_norms * user_norms[user]
+            np.divide(user_scores, denom, out=user_scores, where=denom > 0)
+            user_scores += self.popularity_bonus
+            if eat_now_objs[user]:
+                eat_now_codes = self.catalog.category_codes_for(obj.get('category', '') for obj in eat_now_objs[user])
+                user_scores += np.isin(self.catalog.category_codes, eat_now_codes) * 0.1
+
+            # rows ไม่ซ้ำ เรียงจากน้อยไปมาก (np.unique ช้ากว่า sort ของ rows ที่ส่วนใหญ่เรียงมาแล้วหลายเท่า)
+            pool = np.sort(np.asarray(rows, dtype=np.intp))
+            if len(pool) > 1:
+                pool = pool[np.concatenate(([True], pool[1:] != pool[:-1]))]
+            pool_scores = np.round(user_scores[pool], 12)
+            if len(pool) > k:
+                kth = -np.partition(-pool_scores, k - 1)[k - 1]
+                keep = pool_scores >= kth
+                pool, pool_scores = pool[keep], pool_scores[keep]
+            order = np.lexsort((pool, -pool_scores))
+            results.append([self.catalog.ids[row] for row in pool[order][:k]])
+        return results
+
     # 🌟 แกะ 2: รับค่า filter_tags เข้ามา
-    def _build_user_vector(self, eat_now_objs, liked_objs, disliked_objs, filter_tags, boost_recent):
+    def _build_user_vector(self, eat_now_objs, liked_objs, disliked_objs, filter_tags, boost_recent, history_vector=None):
         """
         สร้าง vector ที่แทนความชอบของ User พร้อมชั่งน้ำหนัก Filter ปัจจุบัน
+        (sparse mode จะได้ CSR ขนาด 1 x n_tags, dense mode จะได้ 1-D array)
         """
-        user_vector = np.zeros(self.food_vectors.shape[1])
-        
         def add_weighted_tags(objs, weight, apply_boost=False):
             if not objs:
-                return np.zeros(self.food_vectors.shape[1])
+                return None
             
             tags_list = [f.get('tags', []) for f in objs]
-            if not tags_list:
-                return np.zeros(self.food_vectors.shape[1])
             
             try:
                 vecs = self.encoder.transform(tags_list)
             except:
-                return np.zeros(self.food_vectors.shape[1])
+                return None
             
-            if apply_boost and len(objs) > 0:
-                weights = np.linspace(1.0, 1.5, len(vecs))[::-1]
-                weighted_vecs = vecs * weights.reshape(-1, 1)
-                combined = np.sum(weighted_vecs, axis=0)
+            if apply_boost:
+                row_weights = np.linspace(1.0, 1.5, len(objs))[::-1]
             else:
-                combined = np.sum(vecs, axis=0)
+                row_weights = np.ones(len(objs))
             
-            return combined * weight
+            return self._weighted_row_sum(vecs, row_weights) * weight
         
-        v_eat = add_weighted_tags(eat_now_objs, 6.0, boost_recent)
-        v_like = add_weighted_tags(liked_objs, 2.0, boost_recent)
-        v_hate = add_weighted_tags(disliked_objs, -7.0, False)
+        if history_vector is not None and not boost_recent:
+            # ใช้ผลรวมที่ cache ไว้ (น้ำหนักเดียวกัน) แทน v_eat + v_like + v_hate
+            v_eat = history_vector if self.sparse else np.asarray(history_vector.toarray()).ravel()
+            v_like = v_hate = None
+        else:
+            v_eat = add_weighted_tags(eat_now_objs, 6.0, boost_recent)
+            v_like = add_weighted_tags(liked_objs, 2.0, boost_recent)
+            v_hate = add_weighted_tags(disliked_objs, -7.0, False)
         
         # 🌟 แกะ 3: พลังของตัวกรอง (The Filter Overrider)
         # ถ้ายูสเซอร์ระบุ Tags ตอนนี้ แปลว่า "ต้องเอาอันนี้แหละ!" 
         # เราจึงคูณน้ำหนักไปเลย +15.0 เพื่อให้ชนะประวัติในอดีตทั้งหมด
-        v_filter = np.zeros(self.food_vectors.shape[1])
+        v_filter = None
         if filter_tags:
             try:
                 # encoder.transform ต้องการ list of lists
                 vecs = self.encoder.transform([filter_tags])
-                v_filter = np.sum(vecs, axis=0) * 200.0  # น้ำหนักระดับเทพเจ้า
-                print(f"🔍 KNN Context: Heavy focus on tags {filter_tags}")
+                v_filter = self._weighted_row_sum(vecs, np.ones(1)) * 200.0  # น้ำหนักระดับเทพเจ้า
+                log.debug("🔍 KNN Context: Heavy focus on tags %s", filter_tags)
             except Exception as e:
                 pass
         
-        user_vector = v_eat + v_like + v_hate + v_filter
+        parts = [v for v in (v_eat, v_like, v_hate, v_filter) if v is not None]
+        user_vector = sum(parts[1:], parts[0]) if parts else self._zero_vector()
         
         # Normalize vector
-        norm = np.linalg.norm(user_vector)
+        norm = self._vector_norm(user_vector)
         if norm > 0:
             user_vector = user_vector / norm
         
         return user_vector
     
-    def _cosine_similarity(self, vec1, vec2):
-        if hasattr(vec2, 'toarray'):
-            vec2 = vec2.toarray().flatten()
-        
-        dot_product = np.dot(vec1, vec2)
-        norm1 = np.linalg.norm(vec1)
-        norm2 = np.linalg.norm(vec2)
+    def _weighted_row_sum(self, vecs, row_weights):
+        """ผลรวมถ่วงน้ำหนักของแต่ละ row (sparse mode ไม่ densify)"""
+        if sparse.issparse(vecs):
+            return sparse.csr_matrix(row_weights.reshape(1, -1)) @ vecs
+        return row_weights @ vecs
+    
+    def _zero_vector(self):
+        n_tags = self.food_vectors.shape[1]
+        if self.sparse:
+            return sparse.csr_matrix((1, n_tags))
+        return np.zeros(n_tags)
+    
+    def _vector_norm(self, vector):
+        if sparse.issparse(vector):
+            return float(np.sqrt(vector.multiply(vector).sum()))
+        return float(np.linalg.norm(vector))
+    
+    def _candidate_rows(self, candidates):
+        """
+        Candidates เป็นได้ทั้ง list of dicts หรือ array ของ catalog rows
+        (id ที่ไม่อยู่ใน catalog จะถูกตัดทิ้ง)
+        """
+        if isinstance(candidates, np.ndarray):
+            return candidates.astype(np.intp, copy=False)
+        return self.catalog.rows_for(str(c['id']) for c in candidates)
+    
+    def _cosine_scores(self, user_vector, rows):
+        """
+        Cosine similarity ของ user กับทุก candidate ด้วย matrix-vector product ครั้งเดียว
+        """
+        user_norm = self._vector_norm(user_vector)
+        if user_norm == 0 or len(rows) == 0:
+            return np.zeros(len(rows))
         
-        if norm1 == 0 or norm2 == 0:
-            return 0.0
-        return dot_product / (norm1 * norm2)
+        if sparse.issparse(user_vector):
+            dots = (self.food_vectors[rows] @ user_vector.T).toarray()
+        else:
+            dots = self.food_vectors[rows] @ user_vector
+        dots = np.asarray(dots, dtype=float).ravel()
+        denom = self.catalog.row_norms[rows] * user_norm
+        scores = np.zeros(len(rows))
+        np.divide(dots, denom, out=scores, where=denom > 0)
+        return scores
     
-    def _calculate_bonus(self, food_id, eat_now_objs, liked_objs):
-        bonus = 0.0
-        metadata = self.food_metadata.get(food_id, {})
+    def _calculate_bonus(self, rows, eat_now_objs):
+        bonus = self.popularity_bonus[rows].copy()
         if eat_now_objs:
-            eat_now_categories = [obj.get('category', '') for obj in eat_now_objs]
-            if metadata.get('category') in eat_now_categories:
-                bonus += 0.1
-        
-        popularity = metadata.get('popularity', 0)
-        if popularity > 0:
-            bonus += min(popularity / 1000, 0.05)
+            eat_now_codes = self.catalog.category_codes_for(obj.get('category', '') for obj in eat_now_objs)
+            bonus += np.isin(self.catalog.category_codes[rows], eat_now_codes) * 0.1
         return bonus
     
-    def _get_knn_neighbors(self, user_vector, candidate_ids_set):
+    def _top_k(self, scores, k):
+        """
+        Partial sort: คืน index ของ k อันดับแรก เรียงแบบ stable (score มาก -> น้อย, เสมอกันใช้ลำดับเดิม)
+        """
+        n = len(scores)
+        if n > k:
+            kth = np.partition(scores, n - k)[n - k]
+            pool = np.flatnonzero(scores >= kth)
+        else:
+            pool = np.arange(n)
+        order = np.lexsort((pool, -scores[pool]))
+        return pool[order][:k]
+    
+    def _get_knn_neighbors(self, user_vector, candidate_rows):
+        """
+        ค้นเพื่อนบ้านเฉพาะใน candidate rows (งบแคบแค่ไหนก็ยังได้ผลจาก candidates จริง)
+        """
         try:
-            n_neighbors = min(30, len(self.food_ids))
-            distances, indices = self.model.kneighbors(
-                [user_vector], 
-                n_neighbors=n_neighbors
-            )
-            
-            recommended = []
-            for idx in indices[0]:
-                food_id = self.food_ids[idx]
-                if food_id in candidate_ids_set:
-                    recommended.append(food_id)
-                    if len(recommended) >= 15:
-                        break
-            return recommended
+            if len(candidate_rows) == 0:
+                return []
+            rows = self.model.search(user_vector, k=15, subset=np.unique(candidate_rows))
+            return [self.catalog.ids[row] for row in rows]
         except Exception as e:
             return []
     
@@ -227,7 +392,7 @@ class KNNEngine:
             return {"trained": False}
         return {
             "trained": True,
-            "total_foods": len(self.food_ids),
+            "total_foods": len(self.catalog),
             "unique_tags": len(self.encoder.classes_),
             "top_tags": list(self.encoder.classes_[:10])
         }
\ No newline at end of file
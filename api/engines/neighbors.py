@@ -0,0 +1,149 @@
+import numpy as np
+from scipy import sparse
+
+
+def _normalize_rows(vectors):
+    """L2-normalize ทุก row ของ CSR (row ที่เป็นศูนย์คงเป็นศูนย์)"""
+    vectors = sparse.csr_matrix(vectors, dtype=float)
+    norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+    inv = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    return sparse.diags(inv) @ vectors
+
+
+def _dot(matrix, query):
+    """matrix (CSR) x query (CSR 1 x n หรือ dense 1-D) -> dense 1-D"""
+    if sparse.issparse(query):
+        return (matrix @ query.T).toarray().ravel()
+    return np.asarray(matrix @ np.asarray(query, dtype=float).ravel()).ravel()
+
+
+def _top_rows(rows, scores, k):
+    """Top-k rows เรียง score มาก -> น้อย (เสมอกันใช้ row น้อยก่อน)"""
+    if len(rows) > k:
+        part = np.argpartition(-scores, k - 1)[:k]
+        rows, scores = rows[part], scores[part]
+    order = np.lexsort((rows, -scores))
+    return rows[order]
+
+
+class BruteForceIndex:
+    """
+    Exact cosine search (แทน NearestNeighbors(metric='cosine', algorithm='brute'))
+    """
+    name = "brute"
+
+    def __init__(self):
+        self.vectors = None
+
+    def fit(self, vectors):
+        self.vectors = _normalize_rows(vectors)
+        return self
+
+    def __len__(self):
+        return 0 if self.vectors is None else self.vectors.shape[0]
+
+    def score(self, query, rows):
+        """cosine similarity ของ query กับ rows ที่ระบุ"""
+        return _dot(self.vectors[np.asarray(rows, dtype=np.intp)], query)
+
+    def search(self, query, k, subset=None):
+        """คืน row ของ k เพื่อนบ้านที่ใกล้ที่สุด (subset = ค้นเฉพาะ rows ที่ให้มา)"""
+        if subset is None:
+            rows = np.arange(len(self))
+            scores = _dot(self.vectors, query)
+        else:
+            rows = np.asarray(subset, dtype=np.intp)
+            scores = _dot(self.vectors[rows], query)
+        return _top_rows(rows, scores, k)
+
+
+class LSHIndex(BruteForceIndex):
+    """
+    Approximate cosine search ด้วย random-projection LSH (sign of random hyperplanes)
+
+    - n_tables ตาราง, ตารางละ n_bits bits; probe bucket ของ query + bucket ที่ต่างกัน 1 bit
+    - rerank candidates ด้วย cosine จริง
+    - ถ้าจำนวน rows ที่ต้องค้น (ทั้ง catalog หรือ subset) ไม่เกิน exact_below จะค้นแบบ exact เลย
+      (sparse dot ขนาดนี้ถูกกว่า probe bucket และ recall 100%)
+    """
+    name = "lsh"
+
+    def __init__(self, n_tables=16, n_bits=12, multi_probe=True, exact_below=65536, seed=0):
+        super().__init__()
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.multi_probe = multi_probe
+        self.exact_below = exact_below
+        self.seed = seed
+        self.planes = []
+        self.sorted_keys = []
+        self.sorted_rows = []
+
+    def fit(self, vectors):
+        super().fit(vectors)
+        rng = np.random.default_rng(self.seed)
+        n_features = self.vectors.shape[1]
+        self.planes, self.sorted_keys, self.sorted_rows = [], [], []
+        for _ in range(self.n_tables):
+            planes = rng.standard_normal((n_features, self.n_bits))
+            keys = self._hash(self.vectors @ planes)
+            order = np.argsort(keys, kind="stable")
+            self.planes.append(planes)
+            self.sorted_keys.append(keys[order])
+            self.sorted_rows.append(order.astype(np.intp))
+        return self
+
+    def _hash(self, projected):
+        bits = np.asarray(projected) > 0
+        return bits.astype(np.int64) @ (np.int64(1) << np.arange(self.n_bits, dtype=np.int64))
+
+    def _probe_keys(self, key):
+        if not self.multi_probe:
+            return np.array([key], dtype=np.int64)
+        flips = np.int64(1) << np.arange(self.n_bits, dtype=np.int64)
+        return np.concatenate(([key], key ^ flips))
+
+    def _candidates(self, query):
+        if not sparse.issparse(query):
+            query = np.asarray(query, dtype=float).reshape(1, -1)
+        found = []
+        for planes, keys, rows in zip(self.planes, self.sorted_keys, self.sorted_rows):
+            probe = self._probe_keys(int(self._hash(query @ planes)[0]))
+            lo = np.searchsorted(keys, probe, side="left")
+            hi = np.searchsorted(keys, probe, side="right")
+            found.extend(rows[a:b] for a, b in zip(lo, hi) if b > a)
+        if not found:
+            return np.zeros(0, dtype=np.intp)
+        return np.unique(np.concatenate(found))
+
+    def search(self, query, k, subset=None):
+        n_searched = len(self) if subset is None else len(subset)
+        if n_searched <= self.exact_below:
+            return super().search(query, k, subset)
+
+        rows = self._candidates(query)
+        if subset is not None:
+            mask = np.zeros(len(self), dtype=bool)
+            mask[np.asarray(subset, dtype=np.intp)] = True
+            rows = rows[mask[rows]]
+
+        # bucket ว่างเกินไป -> ยอมค้นแบบ exact ดีกว่าได้ผลไม่ครบ
+        if len(rows) < k:
+            return super().search(query, k, subset)
+
+        return _top_rows(rows, _dot(self.vectors[rows], query), k)
+
+
+NEIGHBOR_INDEXES = {
+    BruteForceIndex.name: BruteForceIndex,
+    LSHIndex.name: LSHIndex,
+}
+
+
+def make_neighbor_index(index):
+    """รับชื่อ backend ('brute' | 'lsh') หรือ instance ที่สร้างไว้แล้ว"""
+    if isinstance(index, str):
+        if index not in NEIGHBOR_INDEXES:
+            raise ValueError(f"Unknown neighbor index '{index}' (choose from {sorted(NEIGHBOR_INDEXES)})")
+        return NEIGHBOR_INDEXES[index]()
+    return index
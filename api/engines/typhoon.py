@@ -1,90 +1,425 @@
-import requests
 import json
 import asyncio
+import hashlib
+import importlib.util
+import logging
 import random
+import re
+import time
+import httpx
+import numpy as np
 from typing import List
 
+from api.engines.breaker import CircuitOpenError
+from api.metrics import metrics
+
+log = logging.getLogger(__name__)
+
+# HTTP/2 ต้องมี package h2 (pip install httpx[http2]); ไม่มีก็ใช้ HTTP/1.1 keep-alive
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+SYSTEM_PROMPT = "You are a recommendation API. You must output ONLY a valid JSON array of strings. No explanations."
+COMPACT_SYSTEM_PROMPT = "Output ONLY a JSON array of item numbers."
+# max_tokens ขั้นต่ำ: compact mode คาดคำตอบแค่ ~15 tokens แต่ model มักมีคำเกริ่น / ```json / ขึ้นบรรทัดใหม่
+MIN_ANSWER_TOKENS = 128
+# item ที่จบแล้วใน stream: "string" หรือเลขที่ตามด้วย , / ]
+STREAM_ITEM = re.compile(r'"([^"]*)"|(\d+)(?=\s*[,\]])')
+
+
+def estimate_tokens(text):
+    """
+    ประมาณจำนวน tokens แบบไม่ต้องมี tokenizer: ASCII ~4 ตัวอักษร/token, ตัวอื่น (เช่นภาษาไทย) ~2 ตัวอักษร/token
+    ใช้จัด prompt ให้อยู่ใน budget เท่านั้น ไม่ใช่ตัวเลขที่ API คิดเงินจริง
+    """
+    ascii_chars = sum(ch < "\x80" for ch in text)
+    return -(-ascii_chars // 4) + -(-(len(text) - ascii_chars) // 2)
+
+
+class TyphoonError(Exception):
+    """
+    Typhoon ตอบไม่ได้: reason = "status" (ไม่ใช่ 200) / "too_few_ids" (ids ไม่ถึง 3) / "timeout" / "exception"
+    caller ใช้ KNN แทน (ไม่นับเป็นชัยชนะของ Typhoon และไม่เก็บลง response cache)
+    """
+
+    def __init__(self, reason, detail):
+        super().__init__(f"{reason}: {detail}")
+        self.reason = reason
+        metrics.inc("typhoon_failures_total", reason=reason)
+
+
+class TyphoonAnswer(list):
+    """ids จาก Typhoon; partial=True = stream ถูกตัดที่ deadline (ผลบางส่วน ไม่ควร cache)"""
+
+    def __init__(self, ids=(), partial=False):
+        super().__init__(ids)
+        self.partial = partial
+
+
 class TyphoonEngine:
-    def __init__(self, api_key):
+    model = "typhoon-v2.5-30b-a3b-instruct"
+
+    def __init__(self, api_key, url="https://api.opentyphoon.ai/v1/chat/completions",
+                 max_concurrency=16, timeout=12, http2=None, cache=None, breaker=None,
+                 compact=True, prompt_token_budget=700, stream=False):
         self.api_key = api_key
-        self.url = "https://api.opentyphoon.ai/v1/chat/completions"
+        self.url = url
+        self.cache = cache  # TTLCache ของคำตอบ (None = ไม่ cache)
+        self.breaker = breaker  # CircuitBreaker ของ upstream (None = ยิงเสมอ, timeout คงที่)
+        # compact: prompt สั้น ใช้เลขลำดับแทน id และตัด options ให้อยู่ใน prompt_token_budget
+        self.compact = compact
+        self.prompt_token_budget = prompt_token_budget
+        self.stream = stream  # SSE: แกะ ids ระหว่างทาง + ปิด stream เมื่อครบ
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.http2 = HTTP2_AVAILABLE if http2 is None else http2
+        self.client = None
+        self._limit = None
+        self._loop = None
+
+        # Single-flight: request key -> task ของ call ที่กำลังวิ่ง (ตัวที่มาทีหลังรอผลจาก task เดียวกัน)
+        self._in_flight = {}
+        self.upstream_calls = 0
+        self.coalesced = 0
+
+    async def start(self):
+        """
+        เปิด async client ที่ใช้ connection ซ้ำ (keep-alive / HTTP/2) เรียกจาก app lifespan
+        max_concurrency = จำนวน calls ที่วิ่งพร้อมกันได้ (ที่เกินจะรอคิว ไม่กิน thread)
+        default 16: pool ของ httpcore ไล่ทุก connection ทุกครั้งที่มี request เข้า/ออก
+        ถ้าปล่อยให้ in-flight เยอะเกินจะเปลือง CPU จน throughput ตก (ดู benchmarks/bench_typhoon_pool.py)
+        """
+        loop = asyncio.get_running_loop()
+        if self.client is not None and self._loop is loop:
+            return self
+        if self.client is not None:
+            self._close_stale_client()
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency),
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+        )
+        self._limit = asyncio.Semaphore(self.max_concurrency)
+        self._loop = loop
+        return self
+
+    def _close_stale_client(self):
+        """
+        Client ของ event loop เดิม (connections ผูกกับ loop นั้น ใช้ข้าม loop ไม่ได้)
+        loop เดิมยังวิ่งอยู่ (thread อื่น) -> ปิดบน loop ของมันเอง; loop ปิดไปแล้ว -> aclose ไม่ได้ ทิ้งไปเลย
+        """
+        client, loop = self.client, self._loop
+        self.client = self._limit = self._loop = None
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        else:
+            log.debug("🧹 Dropping Typhoon client of a closed event loop")
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+        self.client = self._limit = self._loop = None
+
+    async def _call(self, payload, read):
+        """
+        ยิง upstream 1 ครั้งภายใต้ concurrency limit + circuit breaker (+ adaptive timeout)
+        read(response) = coroutine ที่อ่าน body (ทั้งก้อนหรือแบบ stream) คืน (response, ผลของ read)
+        timeout ครอบทั้ง call (ส่ง + อ่าน body/stream จนจบ) ไม่ใช่แค่ connect/read ทีละครั้งแบบของ httpx
+        """
+        # ไม่มี lifespan (เช่น serverless) หรือถูกเรียกจาก event loop อื่น -> เปิด client ให้เอง
+        if self.client is None or self._loop is not asyncio.get_running_loop():
+            await self.start()
+        async with self._limit:
+            breaker = self.breaker
+            # เช็คหลังได้คิวแล้ว: ระหว่างรอ วงจรอาจถูกตัดไปแล้ว
+            if breaker is not None and not breaker.allow():
+                raise CircuitOpenError("Typhoon circuit is open")
+            timeout = breaker.timeout() if breaker is not None else self.timeout
+            started = time.perf_counter()
+
+            async def exchange():
+                request = self.client.build_request("POST", self.url, json=payload, timeout=timeout)
+                response = await self.client.send(request, stream=True)
+                try:
+                    return response, await read(response)
+                finally:
+                    await response.aclose()
+
+            try:
+                # stream ที่ทยอยส่ง token มาเรื่อยๆ ไม่โดน timeout ของ httpx (นับต่อ read) -> ต้องมี deadline รวม
+                response, result = await asyncio.wait_for(exchange(), timeout)
+            except asyncio.CancelledError:
+                # เช่น DeadlineExecutor cancel ตอนเกิน budget (TYPHOON_WARM_LATE=0): ยังต้องนับ latency ที่รอไป
+                if breaker is not None:
+                    breaker.record_cancelled(time.perf_counter() - started)
+                raise
+            except Exception:
+                if breaker is not None:
+                    breaker.record_failure(time.perf_counter() - started)
+                raise
+            if breaker is not None:
+                if response.status_code == 200:
+                    breaker.record_success(time.perf_counter() - started)
+                else:
+                    breaker.record_failure(time.perf_counter() - started)
+            return response, result
+
+    async def _post(self, payload):
+        """POST แล้วอ่าน body ทั้งก้อน"""
+        async def read_all(response):
+            await response.aread()
+
+        response, _ = await self._call(payload, read_all)
+        return response
+
+    async def _stream_ids(self, payload, options, aliases=None, deadline_at=None):
+        """
+        Streaming (SSE) mode: แกะ ids จาก tokens ที่ทยอยมา
+        - ได้ ids ที่ถูกต้องครบ 10 ตัว -> ปิด stream ทันที ไม่ต้องรอส่วนที่เหลือ
+        - ถึง deadline_at (loop time) แล้วมีอย่างน้อย 3 ids -> ใช้ผลบางส่วนเลย; ยังไม่ถึง 3 ก็อ่านต่อจนจบ
+        คืน (response, ids, complete) complete=False = ตัดจบก่อน stream จะจบเอง
+        """
+        valid_id_set = {str(f['id']) for f in options}
+        state = {"text": "", "ids": [], "done": False}
+
+        async def read_stream(response):
+            if response.status_code != 200:
+                await response.aread()
+                return
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    # chunk เสีย: ถือว่า stream จบตรงนี้ ใช้ข้อความที่ได้มาแล้ว
+                    log.warning("⚠️ Malformed Typhoon stream chunk, ending stream: %s", data[:100])
+                    break
+                # chunk ที่ไม่มี choices (เช่น usage chunk ท้าย stream) ข้ามไป
+                choices = chunk.get("choices") if isinstance(chunk, dict) else None
+                if not choices:
+                    continue
+                delta = (choices[0].get("delta") or {}).get("content") or ""
+                state["text"] += delta
+                state["ids"] = self._streamed_ids(state["text"], valid_id_set, aliases)
+                if len(state["ids"]) >= 10:
+                    return
+            state["done"] = True
+
+        async def read(response):
+            reader = asyncio.ensure_future(read_stream(response))
+            try:
+                if deadline_at is not None:
+                    remaining = deadline_at - asyncio.get_running_loop().time()
+                    await asyncio.wait({reader}, timeout=max(0.0, remaining))
+                    if not reader.done() and len(state["ids"]) >= 3:
+                        log.info("⏱️ Typhoon stream hit the deadline, using %d partial IDs", len(state["ids"]))
+                        return
+                await reader
+            finally:
+                if not reader.done():
+                    reader.cancel()
+                    await asyncio.gather(reader, return_exceptions=True)
+
+        response, _ = await self._call(dict(payload, stream=True), read)
+        if response.status_code == 200 and state["done"]:
+            # stream จบเอง: parse ข้อความเต็มด้วย parser ตัวหลัก (รองรับรูปแบบแปลกๆ ได้ครบกว่า)
+            return response, self._parse_ai_response(state["text"], options, aliases), True
+        return response, state["ids"], len(state["ids"]) >= 10
+
+    def _streamed_ids(self, text, valid_id_set, aliases=None):
+        """ids ที่ปิดครบแล้วในข้อความที่ได้มาถึงตอนนี้ ("..." หรือตัวเลขที่ตามด้วย , หรือ ])"""
+        ids = []
+        for quoted, number in STREAM_ITEM.findall(text):
+            str_id = (quoted or number).strip()
+            if aliases is not None:
+                str_id = aliases.get(str_id, str_id)
+            if str_id in valid_id_set and str_id not in ids:
+                ids.append(str_id)
+        return ids
+
+    def is_available(self):
+        """Upstream พร้อมใช้ไหม (วงจรไม่ได้ถูกตัด) ใช้เลือก strategy ก่อนเริ่ม"""
+        return self.breaker is None or self.breaker.available()
     
-    async def predict(self, candidates, eat_now_names, liked_names, disliked_names, favorite_tags=None):
+    async def predict(self, candidates, eat_now_names, liked_names, disliked_names, favorite_tags=None, catalog=None,
+                      deadline=None):
         """
         AI-powered recommendation with context awareness
+        candidates: list of food dicts หรือ np.ndarray ของ rows ใน catalog (ต้องส่ง catalog มาด้วย)
+        deadline: วินาที (stream mode) ถึงเวลานี้แล้วมี ids อย่างน้อย 3 ตัวจะตอบด้วยผลบางส่วน
+        คืน TyphoonAnswer (list ของ ids, .partial = ตัดจบที่ deadline)
         """
+        request_key = self._request_key(candidates, eat_now_names, liked_names, disliked_names, favorite_tags, catalog)
+
+        # 0. Cache: input หน้าตาเดียวกัน (tags + history + candidates ชุดเดิม) ไม่ต้องจ่ายค่า LLM ซ้ำ
+        if self.cache is not None:
+            cached_ids = self._cached_recommendation(request_key, candidates, catalog)
+            if cached_ids:
+                return TyphoonAnswer(cached_ids)
+
+        # Single-flight: input เดียวกันที่กำลังถามอยู่ -> รอผลของ call นั้น (ได้ทั้งคำตอบ LLM หรือ TyphoonError ของมัน)
+        # shield: request ต้นทางถูก cancel (client หลุด) ตัวที่รออยู่ยังได้ผลตามปกติ
+        flight = self._in_flight.get(request_key)
+        if flight is not None and flight["task"].get_loop() is asyncio.get_running_loop():
+            self.coalesced += 1
+            log.debug("🔗 Joining in-flight Typhoon call")
+        else:
+            deadline_at = asyncio.get_running_loop().time() + deadline if deadline else None
+            task = asyncio.ensure_future(self._ask_typhoon(
+                request_key, candidates, eat_now_names, liked_names, disliked_names, favorite_tags, catalog,
+                deadline_at,
+            ))
+            flight = self._in_flight[request_key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda done: self._forget_in_flight(request_key, done))
+
+        flight["waiters"] += 1
+        try:
+            answer = await asyncio.shield(flight["task"])
+            return TyphoonAnswer(answer, partial=answer.partial)
+        except asyncio.CancelledError:
+            # ไม่เหลือใครรอแล้ว -> ยกเลิก upstream call ด้วย
+            if flight["waiters"] == 1:
+                flight["task"].cancel()
+            raise
+        finally:
+            flight["waiters"] -= 1
+
+    def _forget_in_flight(self, request_key, task):
+        flight = self._in_flight.get(request_key)
+        if flight is not None and flight["task"] is task:
+            del self._in_flight[request_key]
+
+    def stats(self):
+        return {
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
+
+    async def _ask_typhoon(self, cache_key, candidates, eat_now_names, liked_names, disliked_names,
+                           favorite_tags=None, catalog=None, deadline_at=None):
+        """Sample -> prompt -> LLM call -> parse (raise TyphoonError เมื่อ API ผิดพลาด)"""
         # 1. Smart sampling - คัดมา 20 เมนูให้ AI เลือก จะได้มีตัวเลือกเยอะพอ
-        shortlist = self._smart_sample(candidates, favorite_tags, size=20)
+        # สุ่มด้วย seed จาก cache key: input เดิมได้ shortlist เดิมทุกครั้ง (คำตอบที่ cache ไว้ไม่แกว่ง)
+        rng = random.Random(cache_key)
+        shortlist = self._smart_sample(candidates, favorite_tags, size=20, catalog=catalog, rng=rng)
         
         # 2. สร้าง Prompt ที่ AI ดิ้นหลุดไม่ได้
-        prompt = self._build_smart_prompt(
-            shortlist, 
-            eat_now_names, 
-            liked_names, 
-            disliked_names,
-            favorite_tags
-        )
+        aliases = None
+        options = shortlist
+        if self.compact:
+            prompt, options, aliases = self._build_compact_prompt(
+                shortlist, eat_now_names, liked_names, disliked_names, favorite_tags
+            )
+        else:
+            prompt = self._build_smart_prompt(
+                shortlist, 
+                eat_now_names, 
+                liked_names, 
+                disliked_names,
+                favorite_tags
+            )
         
         # 3. Call API with optimized settings
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        payload = self._build_payload(prompt, options, aliases)
         
-        payload = {
-            "model": "typhoon-v2.5-30b-a3b-instruct",
-            "messages": [
-                {
-                    "role": "system", 
-                    "content": "You are a recommendation API. You must output ONLY a valid JSON array of strings. No explanations."
-                },
-                {
-                    "role": "user", 
-                    "content": prompt
-                }
-            ],
-            # ปรับลด Temperature ลงเพื่อให้ AI ตอบเป็น JSON เป๊ะๆ ไม่สร้างสรรค์คำพูดเกินไป
-            "temperature": 0.3, 
-            "max_tokens": 2048,
-            "top_p": 0.85
-        }
-        
-        # 4. Execute request
-        loop = asyncio.get_running_loop()
+        # 4. Execute request (pooled async client, ไม่ใช้ thread)
         try:
-            response = await loop.run_in_executor(
-                None, 
-                lambda: requests.post(self.url, headers=headers, json=payload, timeout=12)
-            )
+            started = time.perf_counter()
+            self.upstream_calls += 1
+            with metrics.span("typhoon_call"):
+                if self.stream:
+                    response, result_ids, complete = await self._stream_ids(payload, options, aliases, deadline_at)
+                else:
+                    response = await self._post(payload)
+                    complete = True
             
             if response.status_code != 200:
-                print(f"❌ Typhoon API Error: {response.status_code}")
-                print(f"🔍 Error Detail: {response.text}")
-                return self._fallback_recommendation(shortlist, favorite_tags)
+                log.warning("❌ Typhoon API Error: %s", response.status_code,
+                            extra={"fields": {"detail": response.text[:500]}})
+                raise TyphoonError("status", response.status_code)
             
             # 5. Parse response
-            content = response.json()['choices'][0]['message']['content']
-            print(f"🤖 Typhoon Raw Response: {content[:150]}...")
-            
-            result_ids = self._parse_ai_response(content, shortlist)
+            if not self.stream:
+                content = response.json()['choices'][0]['message']['content']
+                log.debug("🤖 Typhoon Raw Response: %s...", content[:150])
+                result_ids = self._parse_ai_response(content, options, aliases)
             
             # 6. Validate and return
             if len(result_ids) < 3:
-                print("⚠️ Typhoon returned too few valid IDs, triggering fallback...")
-                return self._fallback_recommendation(shortlist, favorite_tags)
+                log.warning("⚠️ Typhoon returned too few valid IDs")
+                raise TyphoonError("too_few_ids", len(result_ids))
             
-            return result_ids[:10]
+            # ผลบางส่วน (ตัดที่ deadline) ไม่เก็บลง cache
+            if self.cache is not None and complete:
+                self.cache.set(cache_key, result_ids[:10], cost=time.perf_counter() - started)
+            return TyphoonAnswer(result_ids[:10], partial=not complete)
             
+        except (CircuitOpenError, TyphoonError):
+            # ให้ caller ไปใช้ KNN แทน
+            raise
         except Exception as e:
-            print(f"❌ Typhoon Prediction Exception: {e}")
-            return self._fallback_recommendation(shortlist, favorite_tags)
+            log.warning("❌ Typhoon Prediction Exception: %r", e)
+            timeouts = (TimeoutError, asyncio.TimeoutError, httpx.TimeoutException)
+            reason = "timeout" if isinstance(e, timeouts) else "exception"
+            raise TyphoonError(reason, repr(e)) from e
     
-    def _smart_sample(self, candidates, favorite_tags, size=20):
+    def _request_key(self, candidates, eat_now_names, liked_names, disliked_names, favorite_tags, catalog=None):
+        """
+        Key ของ cache / single-flight จาก input ที่ normalize แล้ว: tags เรียงแล้ว, ชื่อใน history เป็น set, fingerprint ของ candidates
+        (candidates ชุดเดียวกันไม่ว่าจะเรียงแบบไหนได้ fingerprint เดียวกัน)
+        """
+        ids = sorted(self._candidate_ids(candidates, catalog))
+        fingerprint = hashlib.sha1("\n".join(ids).encode()).hexdigest()
+        return json.dumps([
+            self.model,
+            sorted(set(favorite_tags or [])),
+            sorted(set(eat_now_names)),
+            sorted(set(liked_names)),
+            sorted(set(disliked_names)),
+            fingerprint,
+        ], ensure_ascii=False)
+
+    def _cached_recommendation(self, cache_key, candidates, catalog=None):
+        """
+        คำตอบจาก cache ที่ผ่านการตรวจกับ catalog ปัจจุบันแล้ว (None = miss)
+        เมนูที่ถูกลบ/ไม่อยู่ใน candidates แล้วจะถูกตัดทิ้ง; เหลือน้อยกว่า 3 ถือว่าใช้ไม่ได้
+        """
+        cached_ids = self.cache.get(cache_key)
+        if not cached_ids:
+            return None
+        current = [{'id': food_id} for food_id in self._candidate_ids(candidates, catalog)]
+        valid_ids = self._parse_ai_response(json.dumps(cached_ids), current)
+        if len(valid_ids) < 3:
+            self.cache.discard(cache_key)
+            return None
+        log.debug("⚡ Typhoon cache hit (%d IDs)", len(valid_ids))
+        return valid_ids[:10]
+
+    def _candidate_ids(self, candidates, catalog=None):
+        if catalog is not None and isinstance(candidates, np.ndarray):
+            return [catalog.ids[row] for row in candidates]
+        return [str(f['id']) for f in candidates]
+
+    def _smart_sample(self, candidates, favorite_tags, size=20, catalog=None, rng=random):
         """
         เลือก candidates แบบฉลาด เน้นอันที่ตรง Tag ไปให้ AI ดู
+        rng: random.Random ที่ seed ไว้ (default = module random)
         """
+        if catalog is not None and isinstance(candidates, np.ndarray):
+            rows = self._sample_rows(candidates, favorite_tags, size, catalog, rng)
+            return [catalog.item(row) for row in rows]
+        
         if not favorite_tags or len(candidates) <= size:
-            return random.sample(candidates, min(size, len(candidates)))
+            return rng.sample(candidates, min(size, len(candidates)))
         
         matching = []
         others = []
@@ -96,14 +431,28 @@ class TyphoonEngine:
             else:
                 others.append(c)
         
+        return self._split_sample(matching, others, size, rng)
+    
+    def _sample_rows(self, rows, favorite_tags, size, catalog, rng=random):
+        """
+        เหมือน _smart_sample แต่ทำบน catalog rows: แยกกลุ่มตรง tag ด้วย inverted index (postings)
+        """
+        if not favorite_tags or len(rows) <= size:
+            return rng.sample(list(rows), min(size, len(rows)))
+        
+        matched = catalog.tag_overlap(rows, favorite_tags) > 0
+        return self._split_sample(list(rows[matched]), list(rows[~matched]), size, rng)
+    
+    def _split_sample(self, matching, others, size, rng=random):
+        """สุ่ม 70% จากกลุ่มที่ตรง tag + 30% จากกลุ่มอื่น"""
         target_matching = int(size * 0.7)
         target_others = size - target_matching
         
         selected = []
         if matching:
-            selected.extend(random.sample(matching, min(target_matching, len(matching))))
+            selected.extend(rng.sample(matching, min(target_matching, len(matching))))
         if others and len(selected) < size:
-            selected.extend(random.sample(others, min(target_others, len(others))))
+            selected.extend(rng.sample(others, min(target_others, len(others))))
         
         return selected
     
@@ -145,9 +494,66 @@ CORRECT FORMAT EXAMPLE:
 """
         return prompt
     
-    def _parse_ai_response(self, content, shortlist):
+    def _build_compact_prompt(self, foods, eat_now, liked, disliked, favorite_tags):
+        """
+        Prompt แบบประหยัด tokens: options ใช้เลขลำดับ (1, 2, ...) แทน id ยาวๆ, คำสั่งสั้น
+        ใส่ options ตามลำดับจนเต็ม prompt_token_budget (อย่างน้อย 10 ตัว)
+        คืน (prompt, options ที่ใส่จริง, alias -> id)
+        """
+        context_parts = []
+        if eat_now: context_parts.append(f"Loved: {', '.join(eat_now[:3])}")
+        if liked: context_parts.append(f"Liked: {', '.join(liked[:3])}")
+        if disliked: context_parts.append(f"Disliked: {', '.join(disliked[:3])}")
+        if favorite_tags: context_parts.append(f"Tags: {', '.join(favorite_tags)}")
+        context = "; ".join(context_parts) if context_parts else "new user"
+
+        head = (
+            "Pick up to 10 items for this user. Reply with ONLY a JSON array of item numbers, e.g. [3,1,7].\n"
+            f"User: {context}\nItems:"
+        )
+        used = estimate_tokens(COMPACT_SYSTEM_PROMPT) + estimate_tokens(head)
+        lines, options, aliases = [], [], {}
+        for f in foods:
+            alias = str(len(options) + 1)
+            line = f"{alias}. {f['name']} [{','.join(f.get('tags', [])[:3])}]"
+            cost = estimate_tokens(line) + 1  # +1 = newline
+            if used + cost > self.prompt_token_budget and len(options) >= 10:
+                break
+            used += cost
+            lines.append(line)
+            options.append(f)
+            aliases[alias] = str(f['id'])
+
+        return head + "\n" + "\n".join(lines), options, aliases
+
+    def _build_payload(self, prompt, options, aliases=None):
+        """Request body; max_tokens ตั้งจากขนาดคำตอบที่คาดไว้ (array ของ 10 keys) แทน 2048"""
+        keys = list(aliases) if aliases is not None else [str(f['id']) for f in options]
+        expected = estimate_tokens(json.dumps(keys[:10]))
+        return {
+            "model": self.model,
+            "messages": [
+                {
+                    "role": "system", 
+                    "content": COMPACT_SYSTEM_PROMPT if aliases is not None else SYSTEM_PROMPT
+                },
+                {
+                    "role": "user", 
+                    "content": prompt
+                }
+            ],
+            # ปรับลด Temperature ลงเพื่อให้ AI ตอบเป็น JSON เป๊ะๆ ไม่สร้างสรรค์คำพูดเกินไป
+            "temperature": 0.3, 
+            # x3 + 16: เผื่อ tokenizer จริงตัดตัวเลข/เครื่องหมายละเอียดกว่าที่ประมาณไว้
+            # ไม่ต่ำกว่า MIN_ANSWER_TOKENS: ถ้าคำตอบโดนตัดกลาง array จะเหลือ ids ไม่ถึง 3 แล้วพังทั้ง call
+            "max_tokens": max(MIN_ANSWER_TOKENS, 3 * expected + 16),
+            "top_p": 0.85
+        }
+
+    def _parse_ai_response(self, content, shortlist, aliases=None):
         """
         Bulletproof Parser: ไม่มีทางพังแม้อ่าน JSON ไม่ออก
+        aliases: เลขลำดับ -> id (compact prompt) แปลงกลับเป็น id ก่อนตรวจ
         """
         # 1. ทำความสะอาดข้อความขยะ
         clean = content.strip().replace("```json", "").replace("```", "").strip()
@@ -163,7 +569,7 @@ CORRECT FORMAT EXAMPLE:
         try:
             raw_ids = json.loads(clean)
         except json.JSONDecodeError:
-            print("⚠️ Standard JSON parsing failed. Using robust string extractor...")
+            log.debug("⚠️ Standard JSON parsing failed. Using robust string extractor...")
             # 4. แผนสำรอง: สับสายอักขระ (String manipulation)
             clean_str = clean.replace("[", "").replace("]", "").replace('"', "").replace("'", "")
             raw_ids = [item.strip() for item in clean_str.split(",") if item.strip()]
@@ -174,26 +580,11 @@ CORRECT FORMAT EXAMPLE:
         
         for item in raw_ids:
             str_id = str(item).strip() # บังคับเป็น String เท่านั้น ลบช่องว่าง
+            if aliases is not None:
+                str_id = aliases.get(str_id, str_id)
             if str_id in valid_id_set:
                 if str_id not in valid_ids: # กันซ้ำ
                     valid_ids.append(str_id)
         
-        print(f"✅ Extracted {len(valid_ids)} valid IDs from Typhoon")
+        log.debug("✅ Extracted %d valid IDs from Typhoon", len(valid_ids))
         return valid_ids
-    
-    def _fallback_recommendation(self, shortlist, favorite_tags):
-        """
-        Fallback สบายใจ หายห่วง
-        """
-        print("🔄 Using fallback logic")
-        if not favorite_tags:
-            return [f['id'] for f in random.sample(shortlist, min(10, len(shortlist)))]
-        
-        scored = []
-        for food in shortlist:
-            food_tags = set(food.get('tags', []))
-            score = len(food_tags.intersection(set(favorite_tags)))
-            scored.append((food['id'], score))
-        
-        scored.sort(key=lambda x: x[1], reverse=True)
-        return [item[0] for item in scored[:10]]
\ No newline at end of file
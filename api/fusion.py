@@ -0,0 +1,25 @@
+def reciprocal_rank_fusion(ranked_lists, weights=None, k=60, limit=None):
+    """
+    รวมหลาย ranked lists เป็น list เดียวด้วย weighted Reciprocal Rank Fusion
+    score(id) = sum(weight / (k + rank)) โดย rank เริ่มที่ 1; ถ้าคะแนนเท่ากันใช้ลำดับที่เจอก่อน
+    """
+    weights = weights or [1.0] * len(ranked_lists)
+    scores = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, item in enumerate(dict.fromkeys(ranked), start=1):
+            scores[item] = scores.get(item, 0.0) + weight / (k + rank)
+    fused = sorted(scores, key=scores.get, reverse=True)  # sorted เป็น stable sort
+    return fused[:limit] if limit else fused
+
+
+def hybrid_weights(history_count, start, end, start_weight, end_weight):
+    """
+    Weight ของ Typhoon ตามจำนวน history: start_weight ที่ history = start ลดแบบเส้นตรงไปถึง end_weight ที่ history = end
+    คืน (knn_weight, typhoon_weight)
+    """
+    if end <= start:
+        progress = 1.0
+    else:
+        progress = min(1.0, max(0.0, (history_count - start) / (end - start)))
+    typhoon_weight = start_weight + (end_weight - start_weight) * progress
+    return 1.0 - typhoon_weight, typhoon_weight
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class StrategyStats:
+    """
+    สถิติต่อ strategy: จำนวนครั้งที่วิ่ง / ชนะ (คำตอบถูกส่งให้ user) / มาช้าเกิน budget / error
+    และ latency ของ window ล่าสุด (p50 / p99)
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.strategies = {}
+
+    def _entry(self, name):
+        if name not in self.strategies:
+            self.strategies[name] = {
+                "runs": 0, "wins": 0, "late": 0, "errors": 0,
+                "latencies": deque(maxlen=self.window),
+            }
+        return self.strategies[name]
+
+    def record(self, name, latency=None, won=False, late=False, error=False):
+        entry = self._entry(name)
+        entry["runs"] += 1
+        entry["wins"] += won
+        entry["late"] += late
+        entry["errors"] += error
+        if latency is not None:
+            entry["latencies"].append(latency)
+
+    def snapshot(self):
+        result = {}
+        for name, entry in self.strategies.items():
+            latencies = np.array(entry["latencies"]) * 1000
+            p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (None, None)
+            result[name] = {
+                "runs": entry["runs"],
+                "wins": entry["wins"],
+                "win_rate": round(entry["wins"] / entry["runs"], 4) if entry["runs"] else 0.0,
+                "late": entry["late"],
+                "errors": entry["errors"],
+                "p50_ms": None if p50 is None else round(float(p50), 1),
+                "p99_ms": None if p99 is None else round(float(p99), 1),
+            }
+        return result
+
+
+class DeadlineExecutor:
+    """
+    Hedging: เริ่ม primary (async เช่น Typhoon) กับ backup (sync เช่น KNN ใน thread) พร้อมกัน
+    - primary ตอบทันใน budget วินาที -> ใช้ของ primary
+    - เกิน budget / error -> ใช้ของ backup
+    - keep_late=True: primary ที่มาช้ายังวิ่งต่อจนจบ (เช่นเอาไป warm cache) ไม่งั้น cancel ทิ้ง
+    budget=None = รอ primary จนจบ (backup ใช้เฉพาะตอน primary error)
+    """
+
+    def __init__(self, budget=1.5, keep_late=True, stats=None):
+        self.budget = budget
+        self.keep_late = keep_late
+        self.stats = stats or StrategyStats()
+        self._background = set()  # primary ที่มาช้า (เก็บ reference กัน task โดน GC)
+
+    async def run(self, primary_name, primary, backup_name, backup):
+        """primary: coroutine, backup: callable (sync) -> คืน (ชื่อ strategy ที่ชนะ, ผลลัพธ์)"""
+        started = time.perf_counter()
+        primary_task = asyncio.ensure_future(primary)
+        backup_task = asyncio.ensure_future(self._timed(backup, started))
+
+        await asyncio.wait({primary_task}, timeout=self.budget)
+        if primary_task.done():
+            if primary_task.exception() is None:
+                self.stats.record(primary_name, time.perf_counter() - started, won=True)
+                # backup วิ่งใน thread (cancel ไม่ได้) ปล่อยให้จบเองแล้วค่อยนับ
+                backup_task.add_done_callback(lambda done: self._record_backup(backup_name, done, won=False))
+                return primary_name, primary_task.result()
+            log.warning("❌ %s failed: %s. Using %s.", primary_name, primary_task.exception(), backup_name)
+            self.stats.record(primary_name, error=True)
+        else:
+            log.info("⏱️ %s missed the %ss budget. Using %s.", primary_name, self.budget, backup_name)
+            self._finish_late(primary_name, primary_task, started)
+
+        try:
+            result, _ = await backup_task
+        except Exception:
+            self._record_backup(backup_name, backup_task, won=False)
+            if primary_task.cancelled() or (primary_task.done() and primary_task.exception()):
+                raise
+            # backup พัง แต่ primary ยังวิ่งอยู่ (keep_late) -> รอ primary แทน
+            return primary_name, await primary_task
+        self._record_backup(backup_name, backup_task, won=True)
+        return backup_name, result
+
+    async def _timed(self, backup, started):
+        result = await asyncio.to_thread(backup)
+        return result, time.perf_counter() - started
+
+    def _record_backup(self, name, task, won):
+        if task.cancelled() or task.exception() is not None:
+            self.stats.record(name, error=True)
+        else:
+            self.stats.record(name, task.result()[1], won=won)
+
+    def _finish_late(self, name, task, started):
+        if not self.keep_late:
+            task.cancel()
+            self.stats.record(name, late=True)
+            return
+
+        def on_done(done):
+            self._background.discard(done)
+            error = done.cancelled() or done.exception() is not None
+            self.stats.record(name, None if error else time.perf_counter() - started, late=True, error=error)
+
+        self._background.add(task)
+        task.add_done_callback(on_done)
@@ -1,22 +1,57 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import os
-import requests
 import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+import numpy as np
 from collections import Counter
+from contextlib import asynccontextmanager
 
 # ─── Relative imports for Vercel ───
 # ─── Relative imports for Vercel ───
-from api.engines.knn import KNNEngine
+from api.engines.breaker import CircuitBreaker
+from api.engines.cache import TTLCache
 from api.engines.typhoon import TyphoonEngine
+from api.fusion import hybrid_weights, reciprocal_rank_fusion
+from api.hedging import DeadlineExecutor
+from api.log import configure_logging
+from api.metrics import metrics
+from api.profiles import ProfileCache, UserProfile
+from api.snapshot import CatalogSnapshot, build_snapshot, load_snapshot, save_snapshot
+from api.sync import CatalogSync, SyncResult
+
+configure_logging()
+# ชื่อคงที่ใต้ logger "api" (Vercel อาจ import ไฟล์นี้เป็น module "index")
+log = logging.getLogger("api.index")
 
 # ================= APP =================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # โหลด catalog + refresh เป็นระยะใน background ไม่ต้องรอ request แรก
+    refresher = asyncio.create_task(catalog_refresher(CATALOG_REFRESH_SECONDS))
+    # Typhoon client: connection pool อยู่ตลอดอายุ app
+    if typhoon_bot:
+        await typhoon_bot.start()
+    try:
+        yield
+    finally:
+        refresher.cancel()
+        if typhoon_bot:
+            await typhoon_bot.aclose()
+
+
 app = FastAPI(
     title="AI Food Recommendation Service",
     docs_url="/api/docs",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -30,16 +65,77 @@ app.add_middleware(
 # ================= CONFIG =================
 MAIN_API_URL = os.getenv("MAIN_API_URL")
 TYPHOON_API_KEY = os.getenv("TYPHOON_API_KEY")
+# Chat completions endpoint (ชี้ไปที่ stub ตอน load test: python -m benchmarks.stubs typhoon)
+TYPHOON_API_URL = os.getenv("TYPHOON_API_URL", "https://api.opentyphoon.ai/v1/chat/completions")
+TYPHOON_MAX_CONCURRENCY = int(os.getenv("TYPHOON_MAX_CONCURRENCY", "16"))
+# Compact prompt (เลขลำดับแทน id + จำกัด tokens ของ prompt); 0 = prompt แบบเดิม
+TYPHOON_COMPACT_PROMPT = os.getenv("TYPHOON_COMPACT_PROMPT", "1") == "1"
+TYPHOON_PROMPT_TOKENS = int(os.getenv("TYPHOON_PROMPT_TOKENS", "700"))
+# Streaming (SSE): ได้ 10 ids แล้วปิด stream ทันที, ใกล้หมด budget ใช้ผลบางส่วน (>= 3 ids) ได้
+TYPHOON_STREAM = os.getenv("TYPHOON_STREAM", "1") == "1"
+# Cache คำตอบของ Typhoon (LRU + TTL); ตั้ง DIR เพื่อเก็บลง disk ด้วย
+TYPHOON_CACHE_SIZE = int(os.getenv("TYPHOON_CACHE_SIZE", "1024"))
+TYPHOON_CACHE_TTL = float(os.getenv("TYPHOON_CACHE_TTL", "3600"))
+TYPHOON_CACHE_DIR = os.getenv("TYPHOON_CACHE_DIR", "")
+# Latency budget ของ Typhoon (วินาที, 0 = รอจนจบ) และจะปล่อยคำตอบที่มาช้าให้วิ่งต่อไป warm cache ไหม
+TYPHOON_BUDGET_SECONDS = float(os.getenv("TYPHOON_BUDGET_SECONDS", "1.5"))
+TYPHOON_WARM_LATE = os.getenv("TYPHOON_WARM_LATE", "1") == "1"
+# stream ตัดผลบางส่วนก่อนหมด budget นิดนึง เผื่อเวลา parse / ส่งคืน (ให้ชนะ KNN ทัน)
+TYPHOON_STREAM_DEADLINE = max(TYPHOON_BUDGET_SECONDS - 0.1, 0.0) if TYPHOON_BUDGET_SECONDS else None
+# Circuit breaker: error rate / p95 latency (วินาที) ที่จะตัดวงจร และเวลาที่ตัดไว้ก่อนลองใหม่
+TYPHOON_BREAKER_ERROR_RATE = float(os.getenv("TYPHOON_BREAKER_ERROR_RATE", "0.5"))
+TYPHOON_BREAKER_SLOW_P95 = float(os.getenv("TYPHOON_BREAKER_SLOW_P95", "8"))
+TYPHOON_BREAKER_OPEN_SECONDS = float(os.getenv("TYPHOON_BREAKER_OPEN_SECONDS", "30"))
+
+# Cache ของ user profile (vector + tag counts) ตาม history prefix; 0 = คำนวณใหม่ทุก request
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "4096"))
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "1800"))
+# Cache ของ response ทั้งก้อน (poll ซ้ำด้วย filter + history เดิม); ล้างทุกครั้งที่ catalog เปลี่ยน
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+# จำนวน user สูงสุดต่อ /api/recommend/batch
+BATCH_MAX_USERS = int(os.getenv("BATCH_MAX_USERS", "1000"))
 
 KNN_THRESHOLD = 5
 HYBRID_MODE_THRESHOLD = 12
+# Hybrid (RRF): weight ของ Typhoon ที่ history = KNN_THRESHOLD และที่ history = HYBRID_MODE_THRESHOLD (ไล่ระดับเส้นตรง)
+HYBRID_TYPHOON_WEIGHT_START = float(os.getenv("HYBRID_TYPHOON_WEIGHT_START", "0.6"))
+HYBRID_TYPHOON_WEIGHT_END = float(os.getenv("HYBRID_TYPHOON_WEIGHT_END", "0.3"))
+HYBRID_RRF_K = int(os.getenv("HYBRID_RRF_K", "60"))
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "300"))
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "500"))
+CATALOG_FULL_SYNC_EVERY = int(os.getenv("CATALOG_FULL_SYNC_EVERY", "12"))
+# Snapshot บน disk: โหลดตอน import (cold start ไม่ต้องยิง network / train) และเขียนทับหลัง refresh ถ้าเปิด WRITE
+CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "")
+CATALOG_SNAPSHOT_WRITE = os.getenv("CATALOG_SNAPSHOT_WRITE", "0") == "1"
 
 # ================= STATE =================
-knn_bot = KNNEngine()
-typhoon_bot = TyphoonEngine(api_key=TYPHOON_API_KEY) if TYPHOON_API_KEY else None
-
+response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL) if RESPONSE_CACHE_SIZE > 0 else None
+profile_cache = ProfileCache(PROFILE_CACHE_SIZE, PROFILE_CACHE_TTL) if PROFILE_CACHE_SIZE > 0 else None
+typhoon_cache = TTLCache(TYPHOON_CACHE_SIZE, TYPHOON_CACHE_TTL, disk_dir=TYPHOON_CACHE_DIR or None) if TYPHOON_CACHE_SIZE > 0 else None
+strategy_executor = DeadlineExecutor(budget=TYPHOON_BUDGET_SECONDS or None, keep_late=TYPHOON_WARM_LATE)
+typhoon_breaker = CircuitBreaker(
+    error_rate=TYPHOON_BREAKER_ERROR_RATE,
+    slow_p95=TYPHOON_BREAKER_SLOW_P95,
+    open_seconds=TYPHOON_BREAKER_OPEN_SECONDS,
+)
+typhoon_bot = TyphoonEngine(
+    api_key=TYPHOON_API_KEY, url=TYPHOON_API_URL, max_concurrency=TYPHOON_MAX_CONCURRENCY, cache=typhoon_cache, breaker=typhoon_breaker,
+    compact=TYPHOON_COMPACT_PROMPT, prompt_token_budget=TYPHOON_PROMPT_TOKENS, stream=TYPHOON_STREAM,
+) if TYPHOON_API_KEY else None
+
+# Snapshot ปัจจุบัน (สลับทั้งก้อนตอน refresh); None = ยังไม่เคยโหลดสำเร็จ
+SNAPSHOT: Optional[CatalogSnapshot] = None
+EMPTY_SNAPSHOT = build_snapshot([])
+_refresh_lock = asyncio.Lock()
+_refresh_count = 0
+
+# Mirrors ของ SNAPSHOT สำหรับโค้ด/สคริปต์เดิมที่ import ตัวแปรเหล่านี้ตรงๆ
+knn_bot = EMPTY_SNAPSHOT.knn
 is_trained = False
 FOOD_CACHE: list = []
+ITEM_BY_ID: dict = {}
+ITEM_TAGS: dict = {}
 
 
 # ================= MODELS =================
@@ -87,84 +183,198 @@ class RecommendRequest(BaseModel):
     }
 
 
+class BatchRecommendRequest(BaseModel):
+    requests: List[RecommendRequest]
+
+
 # ================= HELPERS =================
 def fetch_and_train():
-    """Fetch items from Next Server, fallback to mock data."""
-    global FOOD_CACHE, is_trained, knn_bot
+    """Fetch items from Next Server and swap in a freshly trained snapshot."""
+    items = fetch_catalog()
+    if items:
+        load_catalog(items)
+
 
+def make_catalog_sync() -> Optional[CatalogSync]:
+    if not MAIN_API_URL:
+        return None
+
+    # Add Vercel protection bypass
+    bypass_token = os.getenv("VERCEL_BYPASS_TOKEN", "")
+    cookies = {}
+    headers = {}
+    if bypass_token:
+        cookies["x-vercel-protection-bypass"] = bypass_token
+        headers["x-vercel-protection-bypass"] = bypass_token
+        # Also use authorization bearer just in case NextAuth or Vercel needs it for the API
+        headers["Authorization"] = f"Bearer {bypass_token}"
+
+    return CatalogSync(MAIN_API_URL, page_size=CATALOG_PAGE_SIZE, headers=headers, cookies=cookies)
+
+
+catalog_sync = make_catalog_sync()
+
+
+def sync_catalog(delta: bool = False) -> Optional[SyncResult]:
+    """One sync round against Next Server (None on failure)."""
     try:
-        if not MAIN_API_URL:
+        if catalog_sync is None:
             raise Exception("MAIN_API_URL not set")
 
-        # Add Vercel protection bypass cookie
-        # Add Vercel protection bypass
-        bypass_token = os.getenv("VERCEL_BYPASS_TOKEN", "")
-        cookies = {}
-        headers = {}
-        if bypass_token:
-            cookies["x-vercel-protection-bypass"] = bypass_token
-            headers["x-vercel-protection-bypass"] = bypass_token
-            # Also use authorization bearer just in case NextAuth or Vercel needs it for the API
-            headers["Authorization"] = f"Bearer {bypass_token}"
-
-        url = f"{MAIN_API_URL}/api/items/data?limit=1000"
-        res = requests.get(url, headers=headers, cookies=cookies, timeout=10)
-
-        if res.status_code == 200:
-            body = res.json()
-            raw_data = body.get("data", [])
-            cleaned = []
-            for item in raw_data:
-                # Handle possible Next.js / Prisma nested format
-                food_obj = item.get("Food") or item.get("food") or {}
-                
-                # Extract Name
-                name = item.get("name") or food_obj.get("name") or "Unknown"
-                
-                # Extract Price
-                price = item.get("price") or item.get("priceMin") or food_obj.get("price") or 0
-                
-                # Extract Tags
-                raw_tags = item.get("tags") or food_obj.get("tags") or []
-                tags = []
-                for t in raw_tags:
-                    if isinstance(t, dict):
-                        # Nested Prisma tags e.g. {"tag": {"name": "ไทย"}} or {"name": "ไทย"}
-                        if "tag" in t and isinstance(t["tag"], dict):
-                            tags.append(t["tag"].get("name", ""))
-                        else:
-                            tags.append(t.get("name", ""))
-                    elif isinstance(t, str):
-                        tags.append(t)
-                
-                cleaned.append({
-                    "id": str(item["id"]),
-                    "name": name,
-                    "tags": [tag for tag in tags if tag],
-                    "price": float(price),
-                })
-            FOOD_CACHE = cleaned
-            print(f"✅ Loaded {len(FOOD_CACHE)} items from API")
-        else:
-            raise Exception(f"API returned {res.status_code}")
+        result = catalog_sync.fetch(delta=delta)
+        log.info("✅ Catalog sync (%s): %d items, %d removed", result.kind, len(result.items), len(result.removed_ids))
+        return result
 
     except Exception as e:
-        print(f"❌ Failed to fetch data from API: {e}")
+        log.error("❌ Failed to fetch data from API: %s", e)
         # Not falling back to mock data
-        pass
-    if FOOD_CACHE:
-        knn_bot.train(FOOD_CACHE)
-        is_trained = True
+        return None
+
+
+def fetch_catalog() -> Optional[list]:
+    """Fetch and clean every item from Next Server (None on failure)."""
+    try:
+        if catalog_sync is None:
+            raise Exception("MAIN_API_URL not set")
+
+        items = catalog_sync.fetch(conditional=False).items
+        log.info("✅ Loaded %d items from API", len(items))
+        return items
+
+    except Exception as e:
+        log.error("❌ Failed to fetch data from API: %s", e)
+        return None
+
+
+def load_catalog(items: list):
+    """Train a new snapshot from items and swap it in."""
+    swap_snapshot(build_snapshot(items, next_snapshot_version()))
+
+
+def next_snapshot_version() -> int:
+    return (SNAPSHOT.version if SNAPSHOT else 0) + 1
+
+
+def swap_snapshot(snapshot: CatalogSnapshot):
+    """Atomic swap: request ใหม่จะเห็น snapshot ใหม่ ส่วน request เก่ายังถือก้อนเดิมอยู่"""
+    global SNAPSHOT, FOOD_CACHE, ITEM_BY_ID, ITEM_TAGS, knn_bot, is_trained
+
+    SNAPSHOT = snapshot
+    FOOD_CACHE = snapshot.items
+    ITEM_BY_ID = snapshot.item_by_id
+    ITEM_TAGS = snapshot.item_tags
+    knn_bot = snapshot.knn
+    is_trained = snapshot.is_trained
+    # response ที่ cache ไว้ผูกกับ catalog ชุดเก่า (key มี version อยู่แล้ว ล้างทิ้งเพื่อคืน memory)
+    if response_cache is not None:
+        response_cache.clear()
+
+
+async def refresh_catalog() -> bool:
+    """Sync + train off the event loop, then swap. Returns True if a new snapshot went live."""
+    global _refresh_count
 
+    async with _refresh_lock:
+        # delta เมื่อมี snapshot แล้ว; full resync ทุก CATALOG_FULL_SYNC_EVERY รอบ กันข้อมูลเพี้ยนสะสม
+        full_sync = SNAPSHOT is None or not SNAPSHOT.is_trained or _refresh_count % CATALOG_FULL_SYNC_EVERY == 0
+        _refresh_count += 1
+        if SNAPSHOT is None:
+            items = await asyncio.to_thread(fetch_catalog)
+            result = SyncResult("full", items) if items else None
+        else:
+            result = await asyncio.to_thread(sync_catalog, not full_sync)
+
+        if result is None or result.kind == "unchanged":
+            return False
+        if result.kind == "delta":
+            if not result.items and not result.removed_ids:
+                return False
+            snapshot = await asyncio.to_thread(
+                SNAPSHOT.with_delta, result.items, result.removed_ids, next_snapshot_version()
+            )
+        elif result.items:
+            snapshot = await asyncio.to_thread(build_snapshot, result.items, next_snapshot_version())
+        else:
+            return False
+
+        swap_snapshot(snapshot)
+        log.info("🔄 Catalog snapshot v%d is live (%d items, %s)", snapshot.version, len(snapshot.items), result.kind)
+        if CATALOG_SNAPSHOT_PATH and CATALOG_SNAPSHOT_WRITE:
+            await asyncio.to_thread(persist_snapshot, snapshot)
+        return True
+
+
+def persist_snapshot(snapshot: CatalogSnapshot):
+    try:
+        sync_state = catalog_sync.state() if catalog_sync else None
+        save_snapshot(snapshot, CATALOG_SNAPSHOT_PATH, sync_state)
+        log.info("💾 Saved snapshot v%d to %s", snapshot.version, CATALOG_SNAPSHOT_PATH)
+    except Exception as e:
+        log.error("❌ Failed to save snapshot: %s", e)
+
+
+def load_disk_snapshot():
+    """Cold start: ใช้ snapshot บน disk ถ้ามี (mmap + items แบบ lazy) แล้วค่อยให้ refresher sync ต่อจากนั้น"""
+    if not CATALOG_SNAPSHOT_PATH:
+        return
+    try:
+        snapshot, manifest = load_snapshot(CATALOG_SNAPSHOT_PATH)
+    except Exception as e:
+        log.error("❌ Failed to load snapshot from %s: %s", CATALOG_SNAPSHOT_PATH, e)
+        return
+    if snapshot is None:
+        return
+    swap_snapshot(snapshot)
+    if catalog_sync and manifest.get("sync"):
+        catalog_sync.restore(manifest["sync"])
+    log.info("💾 Loaded snapshot v%d from disk (%d items)", snapshot.version, len(snapshot.items))
+
+
+async def catalog_refresher(interval: float):
+    """Background task: โหลดทันทีตอน start แล้ว refresh ทุก interval วินาที"""
+    while True:
+        try:
+            await refresh_catalog()
+        except Exception as e:
+            log.error("❌ Catalog refresh failed: %s", e)
+        await asyncio.sleep(interval)
+
+
+async def current_snapshot() -> CatalogSnapshot:
+    """Snapshot สำหรับ request นี้ (ถ้ายังไม่เคยโหลด เช่น serverless ที่ไม่มี lifespan ก็โหลดเลย)"""
+    if SNAPSHOT is None:
+        log.info("⏳ No catalog snapshot yet, loading...")
+        if not _refresh_lock.locked():
+            await refresh_catalog()
+        else:
+            async with _refresh_lock:
+                pass
+    return SNAPSHOT or EMPTY_SNAPSHOT
+
+
+load_disk_snapshot()
+
+
+def user_profile(history: List[HistoryItem], snapshot: CatalogSnapshot) -> UserProfile:
+    """Profile ของ history นี้ (จาก cache ถ้าเปิดไว้: history เดิม / ต่อท้ายไม่กี่ตัว ไม่ต้องคำนวณใหม่ทั้งหมด)"""
+    if profile_cache is None:
+        return UserProfile.build(history, snapshot)
+    return profile_cache.get(history, snapshot)
 
-def analyze_user_preferences(history: List[HistoryItem]) -> dict:
+
+def analyze_user_preferences(history: List[HistoryItem], snapshot: Optional[CatalogSnapshot] = None,
+                             profile: Optional[UserProfile] = None) -> dict:
     """Analyze user taste from history."""
+    if profile is not None:
+        return {"favorite_tags": profile.favorite_tags(), "engagement_level": len(history)}
+
+    item_tags = (snapshot or SNAPSHOT or EMPTY_SNAPSHOT).item_tags
     tag_frequency = Counter()
     for record in history:
-        food = next((f for f in FOOD_CACHE if f["id"] == record.itemId), None)
-        if food:
+        tags = item_tags.get(record.itemId)
+        if tags is not None:
             weight = 3 if record.status == "EAT" else (1 if record.status == "LIKE" else -5)
-            for tag in food.get("tags", []):
+            for tag in tags:
                 tag_frequency[tag] += weight
 
     return {
@@ -173,93 +383,71 @@ def analyze_user_preferences(history: List[HistoryItem]) -> dict:
     }
 
 
-# ================= ENDPOINTS =================
-@app.post("/api/recommend")
-async def recommend(req: RecommendRequest):
-    """
-    AI recommends menu items (Soft Filtering with Fallbacks).
-    Returns: { itemIds: string[] }
-    """
-    print("\n" + "="*40)
-    print("📨 NEW REQUEST RECEIVED (SOFT FILTERS)")
-    print("="*40)
-
-    if not is_trained:
-        print("⏳ Training model first...")
-        fetch_and_train()
-
-    print(f"📦 Total in DB (Cache): {len(FOOD_CACHE)}")
-
-    # แยกของเป็น 2 กอง: ของที่คนยังไม่เคยกิน
-    eat_ids = [h.itemId for h in req.history if h.status == "EAT"]
-    like_ids = [h.itemId for h in req.history if h.status == "LIKE"]
-    dislike_ids = [h.itemId for h in req.history if h.status == "DISLIKE"]
-    seen_ids = set(eat_ids + like_ids + dislike_ids)
-
-    # กองที่ 1: ของที่ยังไม่เคยเห็น และ "อยู่ในงบ" (Preferred)
-    candidates_in_budget = []
-    # กองที่ 2: ของที่ยังไม่เคยเห็น แต่ "อยู่นอกงบ" (Backup)
-    candidates_out_budget = []
-
-    for f in FOOD_CACHE:
-        if f["id"] in seen_ids:
-            continue # ข้ามของที่เคยกินแล้ว
-            
-        price = f.get("price", 0)
-        # ตรวจสอบว่าอยู่ในงบไหม
-        if (req.filter.priceMin or 0) <= price <= (req.filter.priceMax or 999999):
-            candidates_in_budget.append(f)
-        else:
-            candidates_out_budget.append(f)
+metrics.describe("recommend_request_seconds", "End-to-end /api/recommend latency")
+metrics.describe("recommend_requests_total", "Requests per strategy and response cache outcome")
+metrics.describe("recommend_padding_total", "Responses padded to 10 items, by source of the padding")
+metrics.describe("typhoon_failures_total", "Typhoon calls that failed (status / too_few_ids / timeout / exception)")
 
-    print(f"💰 In-budget candidates: {len(candidates_in_budget)}")
-    print(f"💸 Out-of-budget candidates: {len(candidates_out_budget)}")
 
-    def get_objs(ids):
-        return [f for f in FOOD_CACHE if f["id"] in ids]
+def record_request(strategy: str, cache: str, started: float, request_id: str = None, stages: dict = None, **fields):
+    """Metrics ของ request + JSON summary หนึ่งบรรทัด (request id, strategy, จำนวน candidates, เวลาของแต่ละ stage)"""
+    elapsed = time.perf_counter() - started
+    metrics.inc("recommend_requests_total", strategy=strategy, cache=cache)
+    metrics.observe("recommend_request_seconds", elapsed, strategy=strategy)
+    if log.isEnabledFor(logging.INFO):
+        log.info("recommend", extra={"fields": {
+            "request_id": request_id,
+            "strategy": strategy,
+            "cache": cache,
+            **fields,
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in (stages or {}).items()},
+            "total_ms": round(elapsed * 1000, 3),
+        }})
 
-    eat_objs = get_objs(eat_ids)
-    like_objs = get_objs(like_ids)
-    dislike_objs = get_objs(dislike_ids)
 
-    user_prefs = analyze_user_preferences(req.history)
-    combined_tags = list(set(user_prefs["favorite_tags"] + req.filter.tags))
-    history_count = len(eat_ids) + len(like_ids)
-    
-    result_ids = []
-    
-    # โยน "ของที่อยู่ในงบ" ให้ AI วิเคราะห์เป็นหลักก่อน
-    target_candidates = candidates_in_budget if candidates_in_budget else candidates_out_budget
+def choose_strategy(history_count: int) -> str:
+    """Strategy ของ request นี้ จากจำนวน history + สถานะของ Typhoon (เป็นส่วนหนึ่งของ response cache key ด้วย)"""
+    if history_count < KNN_THRESHOLD and typhoon_bot:
+        return "typhoon" if typhoon_bot.is_available() else "knn_circuit_open"
+    if history_count < HYBRID_MODE_THRESHOLD and typhoon_bot and typhoon_bot.is_available():
+        return "hybrid"
+    return "knn"
 
-    if target_candidates:
-        if history_count < KNN_THRESHOLD and typhoon_bot:
-            print("🌪️ Strategy: Typhoon AI")
-            try:
-                result_ids = await typhoon_bot.predict(
-                    target_candidates[:50],
-                    [f["name"] for f in eat_objs],
-                    [f["name"] for f in like_objs],
-                    [f["name"] for f in dislike_objs],
-                    combined_tags,
-                )
-            except Exception as e:
-                print(f"❌ Typhoon Error: {e}. Falling back to KNN.")
-                # แก้ที่ 1
-                result_ids = knn_bot.predict(target_candidates, eat_objs, like_objs, dislike_objs, filter_tags=req.filter.tags)
 
-        elif history_count < HYBRID_MODE_THRESHOLD and typhoon_bot:
-            print("🔮 Strategy: Hybrid")
-            # แก้ที่ 2
-            result_ids = knn_bot.predict(target_candidates, eat_objs, like_objs, dislike_objs, filter_tags=req.filter.tags)[:7]
+def response_key(req: RecommendRequest, version: int, strategy: str) -> str:
+    """Canonical key ของ response: filter (tags เรียงแล้ว) + history เรียงแล้ว + snapshot version + strategy"""
+    return hashlib.sha1(json.dumps([
+        version,
+        strategy,
+        sorted(set(req.filter.tags)),
+        req.filter.priceMin or 0,
+        req.filter.priceMax or 999999,
+        sorted([h.itemId, h.status] for h in req.history),
+    ], ensure_ascii=False).encode()).hexdigest()
 
-        else:
-            print("🧮 Strategy: KNN Expert")
-            # แก้ที่ 3
-            result_ids = knn_bot.predict(target_candidates, eat_objs, like_objs, dislike_objs, filter_tags=req.filter.tags)
 
-    # ==========================================
-    # 4. FORCE 10 ITEMS LOGIC (ระบบตัวสำรอง)
-    # ==========================================
+def split_candidates(catalog, seen_rows, filter: Filter):
+    """Rows ที่ยังไม่เคยเห็น แยกเป็น (ในงบ, นอกงบ) เรียงตามลำดับใน cache"""
+    # ของที่เคยเห็นแล้ว -> ตัดออกด้วย mask
+    available = np.ones(len(catalog), dtype=bool)
+    available[seen_rows] = False
+
+    # ตรวจสอบว่าอยู่ในงบไหม ด้วย price index (bisect บน array ที่เรียงราคาไว้แล้ว)
+    in_budget = catalog.budget_mask(filter.priceMin or 0, filter.priceMax or 999999)
+
+    # กองที่ 1: ของที่ยังไม่เคยเห็น และ "อยู่ในงบ" (Preferred) / กองที่ 2: "อยู่นอกงบ" (Backup)
+    return np.flatnonzero(in_budget & available), np.flatnonzero(~in_budget & available)
+
+
+def history_objs(snapshot: CatalogSnapshot, ids) -> list:
+    """ใช้ id -> row ของ catalog แทนการไล่ทั้ง cache (เรียงตามลำดับใน cache + ตัดตัวซ้ำ)"""
+    rows = np.unique(snapshot.catalog.rows_for(ids))
+    return [snapshot.items[row] for row in rows]
+
+
+def fill_to_ten(result_ids, snapshot: CatalogSnapshot, rows_in_budget, rows_out_budget) -> list:
+    """FORCE 10 ITEMS LOGIC (ระบบตัวสำรอง)"""
+    catalog = snapshot.catalog
     final_ids = []
 
     for rid in result_ids:
@@ -268,30 +456,296 @@ async def recommend(req: RecommendRequest):
 
     # Fallback 1: เติมด้วยของที่ "อยู่ในงบ" ให้เต็ม
     if len(final_ids) < 10:
-        for c in candidates_in_budget:
-            if c["id"] not in final_ids:
-                final_ids.append(c["id"])
+        metrics.inc("recommend_padding_total", source="in_budget")
+        for row in rows_in_budget:
+            food_id = catalog.ids[row]
+            if food_id not in final_ids:
+                final_ids.append(food_id)
             if len(final_ids) >= 10: break
 
     # Fallback 2: ถ้าในงบหมดแล้ว ก็ต้องเอาของที่ "เกินงบ" มาโชว์
     if len(final_ids) < 10:
-        print("⚠️ Not enough in-budget items. Padding with out-of-budget...")
-        for c in candidates_out_budget:
-            if c["id"] not in final_ids:
-                final_ids.append(c["id"])
+        log.debug("⚠️ Not enough in-budget items. Padding with out-of-budget...")
+        metrics.inc("recommend_padding_total", source="out_of_budget")
+        for row in rows_out_budget:
+            food_id = catalog.ids[row]
+            if food_id not in final_ids:
+                final_ids.append(food_id)
             if len(final_ids) >= 10: break
 
     # Fallback 3: ถ้ายกมาหมดโลกแล้วยังไม่ครบ 10 ยอมเอาของที่เคยกินแล้วมาวนซ้ำ
     if len(final_ids) < 10:
-        print("🚨 Desperate Mode. Padding with Seen items...")
-        for f in FOOD_CACHE:
+        log.debug("🚨 Desperate Mode. Padding with Seen items...")
+        metrics.inc("recommend_padding_total", source="seen")
+        for f in snapshot.items:
             if f["id"] not in final_ids:
                 final_ids.append(f["id"])
             if len(final_ids) >= 10: break
 
-    final_ids = final_ids[:10]
+    return final_ids[:10]
+
+
+def recommend_many(snapshot: CatalogSnapshot, requests: List[RecommendRequest]) -> List[list]:
+    """KNN ของหลาย user: เตรียม candidates / history ต่อ user แล้ว score ทั้งก้อนด้วย predict_batch"""
+    prepared = []
+    for req in requests:
+        eat_ids = [h.itemId for h in req.history if h.status == "EAT"]
+        like_ids = [h.itemId for h in req.history if h.status == "LIKE"]
+        dislike_ids = [h.itemId for h in req.history if h.status == "DISLIKE"]
+        rows_in_budget, rows_out_budget = split_candidates(
+            snapshot.catalog, snapshot.catalog.rows_for(set(eat_ids + like_ids + dislike_ids)), req.filter
+        )
+        prepared.append((
+            rows_in_budget, rows_out_budget,
+            history_objs(snapshot, eat_ids), history_objs(snapshot, like_ids), history_objs(snapshot, dislike_ids),
+        ))
+
+    result_ids = snapshot.knn.predict_batch(
+        [p[0] if len(p[0]) else p[1] for p in prepared],
+        [p[2] for p in prepared],
+        [p[3] for p in prepared],
+        [p[4] for p in prepared],
+        [req.filter.tags for req in requests],
+    )
+    return [fill_to_ten(ids, snapshot, p[0], p[1]) for ids, p in zip(result_ids, prepared)]
+
+
+# ================= ENDPOINTS =================
+@app.post("/api/recommend")
+async def recommend(req: RecommendRequest, x_request_id: Optional[str] = Header(None)):
+    """
+    AI recommends menu items (Soft Filtering with Fallbacks).
+    Returns: { itemIds: string[] }
+    """
+    started = time.perf_counter()
+    request_id = x_request_id or uuid.uuid4().hex[:16]
+    stages = metrics.request_stages()
+    # หยิบ snapshot ครั้งเดียว ใช้ทั้ง request (refresh ระหว่างทางไม่กระทบ)
+    with metrics.span("catalog_load"):
+        snapshot = await current_snapshot()
+    knn = snapshot.knn
+
+    log.debug("📦 Total in DB (Cache): %d (snapshot v%d)", len(snapshot.items), snapshot.version)
+
+    history_count = sum(h.status in ("EAT", "LIKE") for h in req.history)
+    strategy = choose_strategy(history_count)
+
+    # poll ซ้ำด้วย filter + history เดิม (บน catalog version เดิม) -> ตอบจาก cache เลย
+    cache_key = response_key(req, snapshot.version, strategy)
+    cached_ids = response_cache.get(cache_key) if response_cache is not None else None
+    if cached_ids is not None:
+        record_request(strategy, "hit", started, request_id, stages,
+                       snapshot_version=snapshot.version, history=len(req.history), returned=len(cached_ids))
+        return {"itemIds": list(cached_ids)}
+
+    # Profile ของ history: rows ที่เคยเห็นแยกตาม status, vector ของ history, คะแนน tags
+    with metrics.span("history_resolution"):
+        profile = user_profile(req.history, snapshot)
+        eat_objs = profile.objs("EAT", snapshot)
+        like_objs = profile.objs("LIKE", snapshot)
+        dislike_objs = profile.objs("DISLIKE", snapshot)
+    catalog = snapshot.catalog
+
+    with metrics.span("budget_partition"):
+        rows_in_budget, rows_out_budget = split_candidates(catalog, profile.seen_rows(), req.filter)
+
+    with metrics.span("analyze_preferences"):
+        user_prefs = analyze_user_preferences(req.history, snapshot, profile)
+    combined_tags = list(set(user_prefs["favorite_tags"] + req.filter.tags))
+
+    result_ids = []
+    # คำตอบที่ได้จาก strategy ตัวสำรอง (Typhoon ช้า / พัง) ไม่เก็บ: poll รอบหน้าจะได้ลองใหม่
+    cacheable = True
     
-    print(f"🚀 FINISHED! Returning {len(final_ids)} items.")
-    print("="*40 + "\n")
+    # โยน "ของที่อยู่ในงบ" ให้ AI วิเคราะห์เป็นหลักก่อน
+    target_candidates = rows_in_budget if len(rows_in_budget) else rows_out_budget
+
+    if len(target_candidates):
+        if strategy == "knn_circuit_open":
+            log.debug("🚧 Typhoon circuit is open. Strategy: KNN")
+            result_ids = knn.predict(target_candidates, eat_objs, like_objs, dislike_objs,
+                                     filter_tags=req.filter.tags, history_vector=profile.vector)
+
+        elif strategy == "typhoon":
+            log.debug("🌪️ Strategy: Typhoon AI")
+            # Typhoon แข่งกับ KNN: Typhoon ตอบทันใน TYPHOON_BUDGET_SECONDS ใช้ของ Typhoon ไม่งั้น (หรือ error) ใช้ KNN
+            winner, result_ids = await strategy_executor.run(
+                "typhoon",
+                typhoon_bot.predict(
+                    target_candidates[:50],
+                    [f["name"] for f in eat_objs],
+                    [f["name"] for f in like_objs],
+                    [f["name"] for f in dislike_objs],
+                    combined_tags,
+                    catalog=catalog,
+                    deadline=TYPHOON_STREAM_DEADLINE,
+                ),
+                "knn",
+                # แก้ที่ 1
+                lambda: knn.predict(target_candidates, eat_objs, like_objs, dislike_objs,
+                                    filter_tags=req.filter.tags, history_vector=profile.vector),
+            )
+            log.debug("🏁 Answer from %s", winner)
+            # Typhoon พัง (TyphoonError) / ช้า -> winner = knn: คำตอบสำรองไม่เก็บ ให้ poll รอบหน้าลอง Typhoon ใหม่
+            cacheable = winner == "typhoon"
+            if winner == "typhoon" and result_ids.partial:
+                # stream ถูกตัดที่ deadline: ไม่ cache และเติมที่เหลือด้วยลำดับของ KNN (ไม่ใช่ rows ในงบที่ไม่ได้จัดอันดับ)
+                cacheable = False
+                knn_ids = await asyncio.to_thread(knn.predict, target_candidates, eat_objs, like_objs, dislike_objs,
+                                                  filter_tags=req.filter.tags, history_vector=profile.vector)
+                seen = set(result_ids)
+                result_ids = list(result_ids) + [i for i in knn_ids if i not in seen]
+
+        elif strategy == "hybrid":
+            log.debug("🔮 Strategy: Hybrid")
+            # KNN (thread) กับ Typhoon วิ่งพร้อมกัน -> latency = ตัวที่ช้ากว่า ไม่ใช่ผลรวม
+            # แก้ที่ 2
+            knn_ids, typhoon_ids = await asyncio.gather(
+                asyncio.to_thread(knn.predict, target_candidates, eat_objs, like_objs, dislike_objs,
+                                  filter_tags=req.filter.tags, history_vector=profile.vector),
+                typhoon_bot.predict(
+                    target_candidates[:50],
+                    [f["name"] for f in eat_objs],
+                    [f["name"] for f in like_objs],
+                    [f["name"] for f in dislike_objs],
+                    combined_tags,
+                    catalog=catalog,
+                ),
+                return_exceptions=True,
+            )
+            if isinstance(knn_ids, BaseException):
+                raise knn_ids
+            if isinstance(typhoon_ids, BaseException):
+                # Typhoon พัง (รวม TyphoonError) -> fuse แค่ KNN และไม่ cache
+                log.warning("❌ Typhoon Error: %s. Hybrid uses KNN only.", typhoon_ids)
+                typhoon_ids = []
+                cacheable = False
+
+            # history ยิ่งเยอะ ยิ่งเชื่อ KNN มากขึ้น
+            knn_weight, typhoon_weight = hybrid_weights(
+                history_count, KNN_THRESHOLD, HYBRID_MODE_THRESHOLD,
+                HYBRID_TYPHOON_WEIGHT_START, HYBRID_TYPHOON_WEIGHT_END,
+            )
+            result_ids = reciprocal_rank_fusion([knn_ids, typhoon_ids], [knn_weight, typhoon_weight], k=HYBRID_RRF_K)
+            log.debug("🔀 Fused %d KNN + %d Typhoon ids (weights %.2f/%.2f)",
+                      len(knn_ids), len(typhoon_ids), knn_weight, typhoon_weight)
+
+        else:
+            log.debug("🧮 Strategy: KNN Expert")
+            # แก้ที่ 3
+            result_ids = knn.predict(target_candidates, eat_objs, like_objs, dislike_objs,
+                                     filter_tags=req.filter.tags, history_vector=profile.vector)
+
+    # ==========================================
+    # 4. FORCE 10 ITEMS LOGIC (ระบบตัวสำรอง)
+    # ==========================================
+    with metrics.span("padding"):
+        final_ids = fill_to_ten(result_ids, snapshot, rows_in_budget, rows_out_budget)
+    if response_cache is not None and cacheable:
+        response_cache.set(cache_key, final_ids, cost=time.perf_counter() - started)
+    record_request(strategy, "miss" if response_cache is not None else "off", started, request_id, stages,
+                   snapshot_version=snapshot.version, history=len(req.history),
+                   candidates_in_budget=len(rows_in_budget), candidates_out_of_budget=len(rows_out_budget),
+                   results=len(result_ids), returned=len(final_ids))
+
+    return {"itemIds": final_ids}
+
+
+@app.post("/api/recommend/batch")
+async def recommend_batch(batch: BatchRecommendRequest):
+    """
+    Recommend ให้หลาย user ในครั้งเดียว (เช่น Next.js pre-compute feed) ด้วย KNN อย่างเดียว ไม่ถาม Typhoon
+    Returns: { results: [{ itemIds: string[] }] } ตามลำดับของ requests
+    """
+    if len(batch.requests) > BATCH_MAX_USERS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_USERS} requests per batch")
+
+    snapshot = await current_snapshot()
+    started = time.perf_counter()
+    # matrix ops ทั้งก้อนรันใน thread ไม่บล็อก event loop
+    results = await asyncio.to_thread(recommend_many, snapshot, batch.requests)
+    log.info("📦 Batch: %d users in %.0f ms (snapshot v%d)",
+             len(results), (time.perf_counter() - started) * 1000, snapshot.version)
+    return {"results": [{"itemIds": ids} for ids in results]}
+
+
+def collect_service_metrics() -> list:
+    """ค่าจาก stats() ของ snapshot / caches / strategies / Typhoon อ่านตอน scrape (name, type, help, labels, value)"""
+    snapshot = SNAPSHOT or EMPTY_SNAPSHOT
+    samples = [
+        ("catalog_items", "gauge", "Items in the live catalog snapshot", {}, len(snapshot.items)),
+        ("catalog_snapshot_version", "gauge", "Version of the live catalog snapshot", {}, snapshot.version),
+    ]
+
+    caches = [("response", response_cache.stats() if response_cache else None),
+              ("typhoon", typhoon_cache.stats() if typhoon_bot and typhoon_cache else None)]
+    if profile_cache:
+        stats = profile_cache.stats()
+        caches.append(("profile", dict(stats, hits=stats["hits"] + stats["extended"], misses=stats["rebuilds"],
+                                       hit_rate=stats["reuse_rate"])))
+    for cache, stats in caches:
+        if stats is None:
+            continue
+        labels = {"cache": cache}
+        samples += [
+            ("cache_entries", "gauge", "Entries held in memory", labels, stats["entries"]),
+            ("cache_hits_total", "counter", "Cache hits", labels, stats["hits"]),
+            ("cache_misses_total", "counter", "Cache misses", labels, stats["misses"]),
+            ("cache_evictions_total", "counter", "LRU evictions", labels, stats["evictions"]),
+            ("cache_hit_rate", "gauge", "Hits / lookups since start", labels, stats["hit_rate"]),
+        ]
+
+    for name, stats in strategy_executor.stats.snapshot().items():
+        labels = {"strategy": name}
+        samples += [
+            ("strategy_runs_total", "counter", "Times a strategy was started in a race", labels, stats["runs"]),
+            ("strategy_wins_total", "counter", "Times a strategy's answer was returned", labels, stats["wins"]),
+            ("strategy_late_total", "counter", "Answers that missed the latency budget", labels, stats["late"]),
+            ("strategy_errors_total", "counter", "Strategy failures", labels, stats["errors"]),
+        ]
+
+    if typhoon_bot:
+        stats = typhoon_bot.stats()
+        samples += [
+            ("typhoon_upstream_calls_total", "counter", "Typhoon API calls sent", {}, stats["upstream_calls"]),
+            ("typhoon_coalesced_total", "counter", "Calls that joined an in-flight Typhoon call", {},
+             stats["coalesced"]),
+        ]
+        if typhoon_bot.breaker:
+            breaker = typhoon_bot.breaker.stats()
+            samples += [
+                ("typhoon_breaker_state", "gauge", "1 for the current circuit breaker state", {"state": state},
+                 int(breaker["state"] == state))
+                for state in ("closed", "open", "half_open")
+            ]
+            samples.append(("typhoon_timeout_seconds", "gauge", "Current adaptive Typhoon timeout", {},
+                            breaker["timeout_s"]))
+    return samples
 
-    return {"itemIds": final_ids}
\ No newline at end of file
+
+metrics.add_collector(collect_service_metrics)
+
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus text format: stage latencies, strategy / fallback counts, cache hit rates"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/health")
+async def health():
+    snapshot = SNAPSHOT or EMPTY_SNAPSHOT
+    return {
+        "status": "ok",
+        "items_loaded": len(snapshot.items),
+        "is_trained": snapshot.is_trained,
+        "typhoon_enabled": typhoon_bot is not None,
+        "snapshot_version": snapshot.version,
+        "snapshot_age_s": round(snapshot.age_seconds(), 1) if SNAPSHOT else None,
+        "typhoon": typhoon_bot.stats() if typhoon_bot else None,
+        "typhoon_breaker": typhoon_bot.breaker.stats() if typhoon_bot and typhoon_bot.breaker else None,
+        "strategies": strategy_executor.stats.snapshot(),
+        "typhoon_cache": typhoon_cache.stats() if typhoon_bot and typhoon_cache else None,
+        "profile_cache": profile_cache.stats() if profile_cache else None,
+        "response_cache": response_cache.stats() if response_cache else None,
+    }
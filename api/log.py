@@ -0,0 +1,72 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+# ระดับ log ของ package api (DEBUG = log รายละเอียดทุก request แบบเดิม)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json = หนึ่ง record ต่อบรรทัดสำหรับ log ingestion, text = ข้อความอย่างเดียว (local dev)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+
+class JsonFormatter(logging.Formatter):
+    """ts / level / logger / msg + fields ที่ส่งมาทาง extra={"fields": {...}}"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, "fields", None)
+        message = record.getMessage()
+        return f"{message} {json.dumps(fields, ensure_ascii=False, default=str)}" if fields else message
+
+
+class StdoutHandler(logging.StreamHandler):
+    """เขียนลง sys.stdout ตัวปัจจุบันเสมอ (test / benchmark สลับ stdout ได้)"""
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+_listener = None
+
+
+def configure_logging(level=None, fmt=None):
+    """
+    ตั้ง logger "api" ครั้งเดียวต่อ process: QueueHandler -> thread ของ QueueListener เป็นคน format JSON / เขียน stdout
+    request ไม่ต้องรอ I/O; เรียกซ้ำได้ (เปลี่ยนแค่ level)
+    """
+    global _listener
+    logger = logging.getLogger("api")
+    logger.setLevel(level or LOG_LEVEL)
+    if _listener is not None:
+        return logger
+
+    output = StdoutHandler()
+    output.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == "json" else TextFormatter())
+    records = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(records))
+    logger.propagate = False  # ไม่ให้ซ้ำกับ handler ของ root / uvicorn
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
@@ -0,0 +1,213 @@
+import contextvars
+import logging
+import threading
+import time
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# วินาที: 100µs - 10s ครอบคลุมตั้งแต่ mask / scoring จนถึง LLM call
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# stage -> วินาที ของ request ปัจจุบัน (ตามไปถึง to_thread / create_task เพราะ context ถูก copy แต่ dict เป็นตัวเดียวกัน)
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+class Histogram:
+    """
+    Histogram แบบ bucket คงที่ ที่ hot path ถูกมาก
+    observe() แค่ append ลง list (atomic ใต้ GIL ไม่ต้อง lock) แล้วค่อยรวมเข้า buckets ทีละก้อน
+    ตอน list ยาวถึง fold_at หรือตอน scrape
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, fold_at=4096):
+        self.buckets = tuple(buckets)
+        self.fold_at = fold_at
+        self.pending = []
+        self.counts = np.zeros(len(self.buckets) + 1, dtype=np.int64)  # ช่องสุดท้าย = +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        self.pending.append(value)
+        if len(self.pending) >= self.fold_at:
+            self.fold()
+
+    def fold(self):
+        """รวม pending เข้า buckets (ตัดเฉพาะ n ตัวแรก ค่าที่ append เข้ามาระหว่างนี้ไม่หาย)"""
+        with self.lock:
+            n = len(self.pending)
+            if not n:
+                return
+            values = np.array(self.pending[:n], dtype=float)
+            del self.pending[:n]
+            index = np.searchsorted(self.buckets, values, side="left")  # le รวมค่าที่เท่ากับขอบ
+            self.counts += np.bincount(index, minlength=len(self.counts))
+            self.sum += float(values.sum())
+            self.count += n
+
+    def cumulative(self):
+        """[(le, จำนวนที่ <= le)] รวม +Inf"""
+        self.fold()
+        return list(zip(self.buckets + (float("inf"),), np.cumsum(self.counts).tolist()))
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class Span:
+    """with metrics.span("stage"): ... -> เวลาของ block ลง histogram ของ stage นั้น"""
+
+    __slots__ = ("histogram", "stage", "stages", "started")
+
+    def __init__(self, histogram, stage, stages):
+        self.histogram = histogram
+        self.stage = stage
+        self.stages = stages
+        self.started = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.started
+        self.histogram.observe(elapsed)
+        if self.stages is not None:
+            self.stages[self.stage] = self.stages.get(self.stage, 0.0) + elapsed
+        return False
+
+
+class Metrics:
+    """
+    Registry ของ histograms / counters + collectors (ค่าที่อ่านจาก stats() ตอน scrape) -> Prometheus text format
+
+    - span(stage): เวลาของแต่ละ stage ลง recommend_stage_seconds{stage=...} (+ dict ของ request_stages() ถ้าเริ่มไว้)
+    - observe(name, value, **labels) / inc(name, **labels): histogram / counter ทั่วไป
+    - add_collector(fn): fn() คืน [(name, type, help, labels, value)] ใช้กับค่าที่มี stats() อยู่แล้ว (cache, breaker)
+    """
+
+    def __init__(self):
+        self.series = {}  # (name, labels ตามลำดับที่ส่งมา) -> Histogram / Counter
+        self.stages = {}  # stage -> Histogram ของ span() (ไม่ต้องสร้าง labels dict ทุกครั้ง)
+        self.help = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+
+    def histogram(self, name, **labels):
+        return self._series(Histogram, name, labels)
+
+    def counter(self, name, **labels):
+        return self._series(Counter, name, labels)
+
+    def span(self, stage):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = self._series(Histogram, "recommend_stage_seconds", {"stage": stage})
+        return Span(histogram, stage, _request_stages.get())
+
+    def request_stages(self):
+        """เริ่มเก็บเวลาของแต่ละ stage ของ request นี้ (ใน task / context ปัจจุบัน) คืน dict ที่ span() จะเติมให้"""
+        stages = {}
+        _request_stages.set(stages)
+        return stages
+
+    def observe(self, name, value, **labels):
+        self._series(Histogram, name, labels).observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        self._series(Counter, name, labels).inc(amount)
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def reset(self):
+        """ล้างค่าที่เก็บไว้ (collectors ยังอยู่)"""
+        with self.lock:
+            self.series.clear()
+            self.stages.clear()
+
+    def _series(self, kind, name, labels):
+        # fast path: key ตามลำดับ labels ที่ call site ส่งมา (ไม่ต้อง sort ทุกครั้ง)
+        key = (name, tuple(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            canonical = (name, tuple(sorted(labels.items())))
+            with self.lock:
+                series = self.series.get(canonical)
+                if series is None:
+                    series = self.series[canonical] = kind()
+                self.series[key] = series
+        return series
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        families = {}  # name -> (type, [lines])
+
+        def family(name, kind):
+            if name not in families:
+                families[name] = (kind, [])
+            return families[name][1]
+
+        with self.lock:
+            # เฉพาะ key ที่ labels เรียงแล้ว (key ลำดับอื่นชี้ไป object เดียวกัน)
+            series = sorted((key, s) for key, s in self.series.items() if list(key[1]) == sorted(key[1]))
+        for (name, labels), s in series:
+            if isinstance(s, Histogram):
+                lines = family(name, "histogram")
+                for le, count in s.cumulative():
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(le)),))} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(s.sum)}")
+                lines.append(f"{name}_count{_labels(labels)} {s.count}")
+            else:
+                family(name, "counter").append(f"{name}{_labels(labels)} {_number(s.value)}")
+
+        for collector in self.collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                log.warning("⚠️ Metrics collector failed: %s", e)
+                continue
+            for name, kind, help_text, labels, value in samples:
+                self.help.setdefault(name, help_text)
+                if value is not None:
+                    family(name, kind).append(f"{name}{_labels(tuple(sorted(labels.items())))} {_number(value)}")
+
+        out = []
+        for name, (kind, lines) in families.items():
+            if name in self.help:
+                out.append(f"# HELP {name} {self.help[name]}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# registry เดียวของ process (engines / endpoints ใช้ตัวเดียวกัน)
+metrics = Metrics()
+metrics.describe("recommend_stage_seconds", "Latency of each /api/recommend stage")
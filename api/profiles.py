@@ -0,0 +1,136 @@
+import hashlib
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+from api.engines.cache import TTLCache
+
+# น้ำหนักเดียวกับ KNNEngine._build_user_vector (vector) และ analyze_user_preferences (tag_frequency)
+VECTOR_WEIGHTS = {"EAT": 6.0, "LIKE": 2.0, "DISLIKE": -7.0}
+TAG_WEIGHTS = {"EAT": 3, "LIKE": 1}  # status อื่น = -5
+
+
+class UserProfile:
+    """
+    สถานะที่คำนวณจาก history หนึ่งชุด (ของ snapshot หนึ่ง) ต่อยอดทีละ item ได้ ไม่ต้องคำนวณใหม่ทั้ง history
+    - rows: rows ใน catalog ของแต่ละ status (ตัดตัวซ้ำ / id ที่ไม่รู้จักทิ้ง)
+    - vector: ผลรวมถ่วงน้ำหนักของ tag vectors ยังไม่ normalize (CSR 1 x n_tags) ส่งให้ KNNEngine.predict(history_vector=)
+    - tag_frequency: คะแนน tag ของ analyze_user_preferences
+    """
+
+    def __init__(self, n_tags=0):
+        self.rows = {status: set() for status in VECTOR_WEIGHTS}
+        self.vector = sparse.csr_matrix((1, n_tags))
+        self.tag_frequency = Counter()
+        self.length = 0
+
+    @classmethod
+    def build(cls, history, snapshot):
+        """Profile จาก history ทั้งชุด"""
+        tags = snapshot.catalog.tags
+        return cls(0 if tags is None else tags.shape[1]).extended(history, snapshot)
+
+    def extended(self, history, snapshot):
+        """Profile ใหม่ = profile นี้ + history ที่ต่อท้าย (ตัวเดิมไม่ถูกแก้ เพราะยังอยู่ใน cache)"""
+        profile = UserProfile.__new__(UserProfile)
+        profile.rows = {status: set(rows) for status, rows in self.rows.items()}
+        profile.tag_frequency = Counter(self.tag_frequency)
+        profile.length = self.length + len(history)
+
+        catalog = snapshot.catalog
+        new_rows, weights = [], []
+        for record in history:
+            tags = snapshot.item_tags.get(record.itemId)
+            if tags is not None:
+                weight = TAG_WEIGHTS.get(record.status, -5)
+                for tag in tags:
+                    profile.tag_frequency[tag] += weight
+
+            rows = profile.rows.get(record.status)
+            row = catalog.id_to_row.get(record.itemId)
+            if rows is not None and row is not None and row not in rows:
+                rows.add(row)
+                new_rows.append(row)
+                weights.append(VECTOR_WEIGHTS[record.status])
+
+        profile.vector = self.vector
+        if new_rows and catalog.tags is not None:
+            added = sparse.csr_matrix(np.array(weights).reshape(1, -1)) @ catalog.tags[new_rows]
+            profile.vector = sparse.csr_matrix(self.vector + added)
+        return profile
+
+    def objs(self, status, snapshot):
+        """Food dicts ของ status นี้ เรียงตามลำดับใน cache (เหมือน history_objs)"""
+        return [snapshot.items[row] for row in sorted(self.rows[status])]
+
+    def seen_rows(self):
+        return np.array(sorted(set().union(*self.rows.values())), dtype=np.intp)
+
+    def favorite_tags(self, n=5):
+        return [tag for tag, score in self.tag_frequency.most_common(n) if score > 0]
+
+
+class ProfileCache:
+    """
+    LRU ของ UserProfile keyed by hash ของ history prefix (+ snapshot version)
+    - history เดิมทุกตัว -> ใช้ profile เดิมเลย
+    - history เดิม + item ต่อท้ายไม่เกิน max_append ตัว -> ต่อยอดจาก profile ของ prefix
+    - ไม่เจอ (history ใหม่ / ถูกแก้กลางทาง / snapshot เปลี่ยน) -> สร้างใหม่ทั้ง history
+    """
+
+    def __init__(self, max_entries=4096, ttl=3600, max_append=8):
+        self.cache = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.max_append = max_append
+        self.hits = 0
+        self.extended = 0
+        self.rebuilds = 0
+
+    def get(self, history, snapshot) -> UserProfile:
+        if not history:
+            return UserProfile.build(history, snapshot)
+
+        keys = self._prefix_keys(history, snapshot.version)
+        for length, key in keys:
+            profile = self.cache.get(key)
+            if profile is None:
+                continue
+            if length == len(history):
+                self.hits += 1
+                return profile
+            self.extended += 1
+            break
+        else:
+            profile = None
+            self.rebuilds += 1
+
+        if profile is None:
+            profile = UserProfile.build(history, snapshot)
+        else:
+            profile = profile.extended(history[profile.length:], snapshot)
+        self.cache.set(keys[0][1], profile)
+        return profile
+
+    def stats(self):
+        lookups = self.hits + self.extended + self.rebuilds
+        return {
+            "entries": len(self.cache),
+            "hits": self.hits,
+            "extended": self.extended,
+            "rebuilds": self.rebuilds,
+            "evictions": self.cache.evictions,
+            "reuse_rate": round((self.hits + self.extended) / lookups, 4) if lookups else 0.0,
+        }
+
+    def _prefix_keys(self, history, version):
+        """[(ความยาว prefix, key)] จาก history ทั้งชุดไล่สั้นลงทีละตัว (ไม่เกิน max_append ตัว) ด้วย hash ต่อเนื่องรอบเดียว"""
+        digest = hashlib.sha1(f"v{version}".encode())
+        first = max(1, len(history) - self.max_append)
+        # ส่วนหัวที่ไม่ต้องใช้ key ของแต่ละ prefix: hash ทีเดียวเป็นก้อนเดียว
+        digest.update("".join(f"\n{record.status}\t{record.itemId}" for record in history[:first - 1]).encode())
+        keys = []
+        for length in range(first, len(history) + 1):
+            record = history[length - 1]
+            digest.update(f"\n{record.status}\t{record.itemId}".encode())
+            keys.append((length, digest.copy().hexdigest()))
+        return keys[::-1]
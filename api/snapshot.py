@@ -0,0 +1,227 @@
+import json
+import logging
+import os
+import shutil
+import time
+from collections.abc import Mapping, Sequence
+
+import numpy as np
+
+from api.engines.catalog import FoodCatalog, TagEncoder
+from api.engines.knn import KNNEngine
+
+log = logging.getLogger(__name__)
+
+# เพิ่มเลขนี้ทุกครั้งที่ layout ของไฟล์ snapshot เปลี่ยน (ไฟล์ format เก่าจะถูกข้าม)
+SNAPSHOT_FORMAT = 1
+# ไฟล์ใน snapshot directory ที่บอกว่า version directory ไหนคือตัวปัจจุบัน (สลับด้วย os.replace = atomic)
+CURRENT_POINTER = "CURRENT"
+
+
+class CatalogItems(Sequence):
+    """
+    items ของ snapshot ที่โหลดจาก disk: ประกอบ food dict จาก catalog arrays ตอนถูกหยิบใช้
+    (ไม่สร้าง dict ทุกเมนูตอนโหลด; request ใช้แค่ history / padding ไม่กี่ตัว)
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __len__(self):
+        return len(self.catalog)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self.catalog.item(r) for r in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError("catalog row out of range")
+        return self.catalog.item(int(row))
+
+    def __iter__(self):
+        return (self.catalog.item(row) for row in range(len(self)))
+
+
+class CatalogIndex(Mapping):
+    """id -> value(row) ผ่าน id_to_row ของ catalog (คู่กับ CatalogItems แทน dict ที่สร้างทีละเมนู)"""
+
+    def __init__(self, catalog, value):
+        self.catalog = catalog
+        self.value = value
+
+    def __getitem__(self, food_id):
+        return self.value(self.catalog.id_to_row[food_id])
+
+    def __contains__(self, food_id):
+        return food_id in self.catalog.id_to_row
+
+    def __iter__(self):
+        return iter(self.catalog.id_to_row)
+
+    def __len__(self):
+        return len(self.catalog.id_to_row)
+
+
+class CatalogSnapshot:
+    """
+    ข้อมูลเมนู + KNN ที่ train แล้ว มัดรวมเป็นก้อนเดียว (ห้ามแก้หลังสร้าง)
+
+    Request หยิบ snapshot ไปครั้งเดียวแล้วใช้ตลอดทั้ง request ส่วนตัว refresher
+    train ก้อนใหม่แยกต่างหากแล้วค่อยสลับ reference ทีเดียว (atomic swap)
+    ทำให้ request ที่กำลังวิ่งอยู่เห็นข้อมูลชุดเดียวกันเสมอ
+    """
+
+    def __init__(self, items, knn, version=0):
+        self.items = items
+        self.knn = knn
+        self.catalog = knn.catalog
+        self.version = version
+        self.loaded_at = time.time()
+
+        # id -> item / id -> tags: resolve history ได้ O(1) ต่อ record
+        if isinstance(items, CatalogItems):
+            # โหลดจาก disk: lookup ผ่าน catalog ตรงๆ ไม่ต้องไล่สร้าง dict ทุกเมนู
+            catalog = self.catalog
+            self.item_by_id = CatalogIndex(catalog, catalog.item)
+            self.item_tags = CatalogIndex(catalog, lambda row: tuple(catalog.tag_lists[row]))
+            return
+        self.item_by_id = {}
+        self.item_tags = {}
+        for f in items:
+            self.item_by_id.setdefault(f["id"], f)
+            self.item_tags.setdefault(f["id"], tuple(f.get("tags", [])))
+
+    @property
+    def is_trained(self):
+        return bool(self.items)
+
+    def age_seconds(self):
+        return time.time() - self.loaded_at
+
+    def with_delta(self, upserts, removed_ids, version):
+        """
+        Snapshot ใหม่ = snapshot นี้ + เมนูที่เพิ่ม/แก้ - เมนูที่ถูกลบ
+        เมนูเดิมอยู่ row เดิม (ขยับขึ้นเมื่อมีการลบ), เมนูใหม่ต่อท้าย; encode เฉพาะ rows ที่เปลี่ยน
+        """
+        removed = set(removed_ids)
+        pending = {f["id"]: f for f in upserts}
+        items, reuse_rows = [], []
+        for row, f in enumerate(self.items):
+            if f["id"] in removed:
+                continue
+            updated = pending.pop(f["id"], None)
+            if updated is None:
+                items.append(f)
+                reuse_rows.append(row)
+            else:
+                items.append(updated)
+                reuse_rows.append(-1)
+        for f in pending.values():
+            if f["id"] not in removed:
+                items.append(f)
+                reuse_rows.append(-1)
+
+        return CatalogSnapshot(items, self.knn.with_delta(items, reuse_rows), version)
+
+
+def build_snapshot(items, version=0):
+    """Train KNN ตัวใหม่จาก items (เรียกนอก request path ได้ เช่นใน thread ของ refresher)"""
+    knn = KNNEngine()
+    if items:
+        knn.train(items)
+    return CatalogSnapshot(items, knn, version)
+
+
+def save_snapshot(snapshot, path, sync_state=None):
+    """
+    เขียน snapshot ลง path/<version directory>: arrays เป็น .npy (mmap ได้) + manifest.json
+    แล้วสลับไฟล์ CURRENT ให้ชี้ไป directory ใหม่ด้วย os.replace (atomic)
+    ระหว่างนั้น load_snapshot ยังเห็นตัวเดิมครบทุกไฟล์เสมอ; เก็บตัวก่อนหน้าไว้ 1 ตัวให้คนที่กำลังโหลดอยู่
+    """
+    knn = snapshot.knn
+    vocab = list(knn.encoder.classes_)
+    arrays = snapshot.catalog.to_arrays(vocab)
+    arrays['vocab'] = np.array(vocab, dtype=str)
+
+    os.makedirs(path, exist_ok=True)
+    previous = _current_dir_name(path)
+    version_dir = f"v{snapshot.version}-{time.time_ns()}"
+    tmp_path = os.path.join(path, f"{version_dir}.tmp")
+    os.makedirs(tmp_path)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(array), allow_pickle=False)
+
+    manifest = {
+        "format": SNAPSHOT_FORMAT,
+        "version": snapshot.version,
+        "created_at": time.time(),
+        "n_items": len(snapshot.items),
+        "n_tags": len(vocab),
+        "sparse": knn.sparse,
+        "category_names": snapshot.catalog.category_names,
+        "sync": sync_state or {},
+    }
+    with open(os.path.join(tmp_path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.rename(tmp_path, os.path.join(path, version_dir))
+
+    pointer_tmp = os.path.join(path, f"{CURRENT_POINTER}.tmp")
+    with open(pointer_tmp, "w", encoding="utf-8") as f:
+        f.write(version_dir)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(path, CURRENT_POINTER))
+
+    # ล้างของเก่า: version อื่นนอกจากตัวใหม่ / ตัวก่อนหน้า, tmp ที่ค้างจากรอบที่พัง, ไฟล์ของ layout เดิม (ไม่มี CURRENT)
+    for entry in os.listdir(path):
+        if entry in (CURRENT_POINTER, version_dir, previous):
+            continue
+        entry_path = os.path.join(path, entry)
+        if os.path.isdir(entry_path):
+            shutil.rmtree(entry_path, ignore_errors=True)
+        elif entry.endswith((".npy", ".json")):
+            os.remove(entry_path)
+    return manifest
+
+
+def _current_dir_name(path):
+    """ชื่อ version directory ที่ CURRENT ชี้อยู่ (None = ยังไม่มี / layout เดิมที่ไฟล์อยู่ใน path ตรงๆ)"""
+    try:
+        with open(os.path.join(path, CURRENT_POINTER), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_snapshot(path, mmap=True):
+    """
+    โหลด snapshot จาก directory (ไม่มี network, ไม่มี training)
+    mmap=True: numeric arrays อ่านตรงจากไฟล์ด้วย np.load(mmap_mode='r') แบบ zero-copy
+    items / item_by_id ประกอบจาก arrays ตอนถูกหยิบใช้ (ids / names / tag lists ยังต้องสร้างเป็น Python objects)
+    คืน (snapshot, manifest) หรือ (None, None) ถ้าไม่มีไฟล์/format ไม่ตรง
+    """
+    current = _current_dir_name(path)
+    if current is not None:
+        path = os.path.join(path, current)
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None, None
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != SNAPSHOT_FORMAT:
+        log.warning("⚠️ Skipping snapshot at %s: format %s != %s", path, manifest.get("format"), SNAPSHOT_FORMAT)
+        return None, None
+
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name[:-4]: np.load(os.path.join(path, name), mmap_mode=mmap_mode, allow_pickle=False)
+        for name in os.listdir(path)
+        if name.endswith(".npy")
+    }
+    vocab = arrays["vocab"].tolist()
+    catalog = FoodCatalog.from_arrays(arrays, manifest["category_names"], vocab)
+    knn = KNNEngine.from_catalog(catalog, TagEncoder(vocab, sparse_output=manifest["sparse"]), sparse=manifest["sparse"])
+    snapshot = CatalogSnapshot(CatalogItems(catalog), knn, manifest["version"])
+    snapshot.loaded_at = manifest["created_at"]
+    return snapshot, manifest
@@ -0,0 +1,151 @@
+import itertools
+import logging
+import requests
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+
+log = logging.getLogger(__name__)
+
+
+def clean_item(item: dict) -> dict:
+    """Normalize one item from Next Server into {id, name, tags, price}."""
+    # Handle possible Next.js / Prisma nested format
+    food_obj = item.get("Food") or item.get("food") or {}
+
+    # Extract Name
+    name = item.get("name") or food_obj.get("name") or "Unknown"
+
+    # Extract Price
+    price = item.get("price") or item.get("priceMin") or food_obj.get("price") or 0
+
+    # Extract Tags
+    raw_tags = item.get("tags") or food_obj.get("tags") or []
+    tags = []
+    for t in raw_tags:
+        if isinstance(t, dict):
+            # Nested Prisma tags e.g. {"tag": {"name": "ไทย"}} or {"name": "ไทย"}
+            if "tag" in t and isinstance(t["tag"], dict):
+                tags.append(t["tag"].get("name", ""))
+            else:
+                tags.append(t.get("name", ""))
+        elif isinstance(t, str):
+            tags.append(t)
+
+    return {
+        "id": str(item["id"]),
+        "name": name,
+        "tags": [tag for tag in tags if tag],
+        "price": float(price),
+    }
+
+
+class SyncResult:
+    """
+    ผลของการ sync หนึ่งรอบ
+    kind: "unchanged" (304) | "full" (รายการทั้งหมด) | "delta" (เฉพาะที่เพิ่ม/แก้ + ids ที่ถูกลบ)
+    """
+
+    def __init__(self, kind, items=None, removed_ids=None):
+        self.kind = kind
+        self.items = items or []
+        self.removed_ids = removed_ids or []
+
+
+class CatalogSync:
+    """
+    ดึง catalog จาก GET {base_url}/api/items/data แบบ:
+    - แบ่งหน้า (limit + offset หรือ nextCursor ถ้า server ส่งมา) ไม่มีเพดาน 1000 รายการ
+    - Conditional request (If-None-Match / If-Modified-Since) -> 304 = ไม่ต้อง train ใหม่
+    - Delta (updatedSince=<ISO time>) -> server ตอบ data = เฉพาะที่เปลี่ยน + deletedIds
+      ถ้า response ไม่มี key "deletedIds" จะถือว่าเป็นรายการเต็ม (server ไม่รองรับ delta)
+    """
+
+    overlap = timedelta(seconds=5)
+
+    def __init__(self, base_url, page_size=500, headers=None, cookies=None, timeout=10, session=None):
+        self.url = f"{base_url}/api/items/data"
+        self.page_size = page_size
+        self.headers = headers or {}
+        self.cookies = cookies or {}
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+        self.etag = None
+        self.last_modified = None
+        self.synced_at = None  # เวลา sync ครั้งล่าสุดที่สำเร็จ (ใช้เป็น updatedSince รอบถัดไป)
+
+    def fetch(self, delta=False, conditional=True) -> SyncResult:
+        """ดึงทุกหน้า (raise ถ้า server ตอบผิดปกติ; state จะอัปเดตเมื่อดึงครบเท่านั้น)"""
+        started_at = datetime.now(timezone.utc)
+        params = {"limit": self.page_size}
+        if delta and self.synced_at:
+            params["updatedSince"] = self.synced_at
+
+        headers = dict(self.headers)
+        if conditional and self.etag:
+            headers["If-None-Match"] = self.etag
+        if conditional and self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        items, removed_ids = [], []
+        is_delta = False
+        offset, cursor, first_ids = 0, None, set()
+        etag = last_modified = None
+        for page_no in itertools.count():
+            page_params = dict(params, cursor=cursor) if cursor else dict(params, offset=offset)
+            res = self.session.get(self.url, params=page_params, headers=headers,
+                                   cookies=self.cookies, timeout=self.timeout)
+
+            if res.status_code == 304:
+                return SyncResult("unchanged")
+            if res.status_code != 200:
+                raise Exception(f"API returned {res.status_code}")
+
+            if page_no == 0:
+                etag = res.headers.get("ETag")
+                last_modified = res.headers.get("Last-Modified")
+                started_at = self._server_time(res) or started_at
+                headers.pop("If-None-Match", None)
+                headers.pop("If-Modified-Since", None)
+
+            body = res.json()
+            page = body.get("data", [])
+            if "deletedIds" in body:
+                is_delta = True
+                removed_ids.extend(str(i) for i in body.get("deletedIds") or [])
+
+            # server ที่ไม่สน offset จะตอบหน้าเดิมซ้ำ -> หยุด กันวนไม่จบ
+            page_first = str(page[0]["id"]) if page else None
+            if page_first in first_ids:
+                log.warning("⚠️ Server ignored pagination, stopping at the repeated page")
+                break
+            first_ids.add(page_first)
+            items.extend(clean_item(item) for item in page)
+
+            cursor = body.get("nextCursor")
+            if cursor:
+                continue
+            if body.get("hasMore") is False or len(page) < self.page_size:
+                break
+            offset += len(page)
+
+        # ถอยเวลาไปนิดนึง: delta รอบหน้าอาจได้รายการซ้ำ (upsert ซ้ำได้ไม่เป็นไร) แต่จะไม่ตกหล่น
+        self.etag, self.last_modified = etag, last_modified
+        self.synced_at = (started_at - self.overlap).isoformat()
+        return SyncResult("delta" if is_delta else "full", items, removed_ids)
+
+    def state(self) -> dict:
+        """State สำหรับเก็บลง snapshot บน disk (รอบแรกหลัง cold start จะได้เป็น delta/304)"""
+        return {"etag": self.etag, "last_modified": self.last_modified, "synced_at": self.synced_at}
+
+    def restore(self, state: dict):
+        self.etag = state.get("etag")
+        self.last_modified = state.get("last_modified")
+        self.synced_at = state.get("synced_at")
+
+    def _server_time(self, res):
+        """ใช้เวลาจาก header Date ของ server (กันนาฬิกาเครื่องเราเพี้ยน)"""
+        try:
+            return parsedate_to_datetime(res.headers["Date"]).astimezone(timezone.utc)
+        except Exception:
+            return None
@@ -0,0 +1,104 @@
+"""
+Recall@k and latency of the ANN neighbour index vs exact brute force
+
+Usage:
+  python -m benchmarks.bench_ann
+  python -m benchmarks.bench_ann --sizes 1000 100000 1000000 --queries 50
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy import sparse
+
+from api.engines.catalog import TagEncoder
+from api.engines.neighbors import BruteForceIndex, LSHIndex
+from benchmarks.synthetic import make_catalog
+
+
+def make_queries(vectors, n_queries, rng):
+    """user vector ปลอม = ผลรวมของเมนู 3 อันที่เคยกิน"""
+    queries = []
+    for _ in range(n_queries):
+        rows = rng.choice(vectors.shape[0], size=3, replace=False)
+        queries.append(sparse.csr_matrix(vectors[rows].sum(axis=0)))
+    return queries
+
+
+def timed_search(index, queries, k, subsets):
+    results, latencies = [], []
+    for query, subset in zip(queries, subsets):
+        start = time.perf_counter()
+        results.append(index.search(query, k, subset=subset))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def recall(index, queries, truth, approx, k):
+    """
+    Tie-aware recall@k: ผลจาก ANN นับว่าถูกถ้า cosine >= คะแนนอันดับ k ของ brute force
+    (tag data มีคะแนนเสมอกันเยอะ นับ id ตรงๆ จะต่ำเกินจริง)
+    """
+    hits = []
+    for query, t, a in zip(queries, truth, approx):
+        if len(t) == 0:
+            continue
+        kth = index.score(query, t[:k]).min()
+        hits.append(np.sum(index.score(query, a[:k]) >= kth - 1e-9) / min(k, len(t)))
+    return float(np.mean(hits))
+
+
+def run(n_items, n_tags, n_queries, k, subset_fraction, seed=0):
+    foods = make_catalog(n_items=n_items, n_tags=n_tags, seed=seed)
+    vectors = TagEncoder().fit_transform([f["tags"] for f in foods])
+    prices = np.array([f["price"] for f in foods])
+    rng = np.random.default_rng(seed)
+    queries = make_queries(vectors, n_queries, rng)
+
+    # subset = ช่วงราคาแคบๆ (จำลอง priceMin/priceMax)
+    lo = np.quantile(prices, 0.5)
+    hi = np.quantile(prices, 0.5 + subset_fraction)
+    band = np.flatnonzero((prices >= lo) & (prices <= hi))
+
+    brute, lsh = BruteForceIndex(), LSHIndex()
+    start = time.perf_counter()
+    brute.fit(vectors)
+    brute_fit = time.perf_counter() - start
+    start = time.perf_counter()
+    lsh.fit(vectors)
+    lsh_fit = time.perf_counter() - start
+
+    rows = []
+    for label, subsets in (("full", [None] * n_queries), (f"subset {len(band)}", [band] * n_queries)):
+        truth, t_brute = timed_search(brute, queries, k, subsets)
+        approx, t_lsh = timed_search(lsh, queries, k, subsets)
+        rows.append({
+            "items": n_items,
+            "search": label,
+            "brute_fit_s": brute_fit,
+            "lsh_fit_s": lsh_fit,
+            "brute_p50_ms": float(np.percentile(t_brute, 50)) * 1000,
+            "lsh_p50_ms": float(np.percentile(t_lsh, 50)) * 1000,
+            "recall": recall(brute, queries, truth, approx, k),
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--tags", type=int, default=300)
+    parser.add_argument("--queries", type=int, default=30)
+    parser.add_argument("-k", type=int, default=15)
+    parser.add_argument("--subset-fraction", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"{'items':>9} {'search':<16}{'fit brute/lsh s':>18}{'brute p50 ms':>14}{'lsh p50 ms':>12}{'recall@k':>10}")
+    for n_items in args.sizes:
+        for r in run(n_items, args.tags, args.queries, args.k, args.subset_fraction):
+            fit = f"{r['brute_fit_s']:.2f}/{r['lsh_fit_s']:.2f}"
+            print(f"{r['items']:>9} {r['search']:<16}{fit:>18}{r['brute_p50_ms']:>14.2f}{r['lsh_p50_ms']:>12.2f}{r['recall']:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Throughput (users/s): N sequential POST /api/recommend vs one POST /api/recommend/batch
+(KNN path, in-process app + synthetic catalog, no Typhoon key)
+
+Usage:
+  python -m benchmarks.bench_batch
+  python -m benchmarks.bench_batch --items 50000 --users 100 1000
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+
+from fastapi.testclient import TestClient
+
+import api.index as service
+from api.log import configure_logging
+from benchmarks.synthetic import make_catalog
+
+
+def make_requests(foods, n_users, seed=0):
+    """Users แบบ feed pre-compute: history 5-20 รายการ, งบสุ่ม, filter tags 0-2 ตัว"""
+    rng = random.Random(seed)
+    vocab = sorted({t for f in foods for t in f["tags"]})
+    requests = []
+    for _ in range(n_users):
+        history = [{"itemId": f["id"], "status": rng.choice(["EAT", "EAT", "LIKE", "DISLIKE"])}
+                   for f in rng.sample(foods, rng.randint(5, 20))]
+        price_min = rng.choice([0, 40, 80])
+        requests.append({"filter": {"tags": rng.sample(vocab, rng.randint(0, 2)),
+                                    "priceMin": price_min, "priceMax": price_min + rng.choice([60, 150, 400])},
+                         "history": history})
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--tags", type=int, default=300)
+    parser.add_argument("--users", type=int, nargs="+", default=[10, 100, 1000])
+    args = parser.parse_args()
+    configure_logging("WARNING")  # ไม่ให้ JSON summary ต่อ request ปนกับตาราง
+
+    foods = make_catalog(n_items=args.items, n_tags=args.tags, seed=1)
+    client = TestClient(service.app)
+    service.typhoon_bot = None  # วัดเฉพาะ KNN path ทั้งสองแบบ
+    with contextlib.redirect_stdout(io.StringIO()):
+        service.load_catalog(foods)
+
+    print(f"{'users':>6}{'sequential ms':>15}{'batch ms':>10}{'seq users/s':>13}{'batch users/s':>15}{'speedup':>9}")
+    for n_users in args.users:
+        requests = make_requests(foods, n_users)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            sequential = [client.post("/api/recommend", json=r).json()["itemIds"] for r in requests]
+            sequential_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            res = client.post("/api/recommend/batch", json={"requests": requests})
+            batch_s = time.perf_counter() - start
+        assert [r["itemIds"] for r in res.json()["results"]] == sequential
+        print(f"{n_users:>6}{sequential_s * 1000:>15.0f}{batch_s * 1000:>10.0f}{n_users / sequential_s:>13.0f}"
+              f"{n_users / batch_s:>15.0f}{sequential_s / batch_s:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Cold-start time with and without the on-disk snapshot
+
+แต่ละรอบรัน Python process ใหม่ แล้ววัดเวลาตั้งแต่ import api.index จนได้ response แรกของ /api/recommend
+- network: ดึง catalog จาก local fake Next server แล้ว train
+- snapshot: โหลด .npy แบบ mmap จาก CATALOG_SNAPSHOT_PATH (ไม่มี network / training)
+
+Usage:
+  python -m benchmarks.bench_cold_start
+  python -m benchmarks.bench_cold_start --items 1000 5000 20000 --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from api.snapshot import build_snapshot, save_snapshot
+from benchmarks.stubs import FakeNextServer
+from benchmarks.synthetic import make_catalog
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import contextlib, io, json, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    from fastapi.testclient import TestClient
+    import api.index
+    imported = time.perf_counter()
+    res = TestClient(api.index.app).post("/api/recommend", json={"filter": {"tags": ["tag1"]}, "history": []})
+done = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "first_response_ms": (done - start) * 1000,
+                  "items": len(api.index.FOOD_CACHE), "status": res.status_code}))
+"""
+
+
+def run_child(env):
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--tags", type=int, default=300)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'items':>8} {'mode':<10}{'import ms':>12}{'first response ms':>20}")
+    for n_items in args.items:
+        foods = make_catalog(n_items=n_items, n_tags=args.tags)
+        server = FakeNextServer(foods)
+        with tempfile.TemporaryDirectory() as tmp:
+            snapshot_dir = os.path.join(tmp, "snapshot")
+            save_snapshot(build_snapshot(foods, version=1), snapshot_dir)
+
+            base_env = dict(os.environ, PYTHONPATH=ROOT, LOG_LEVEL="WARNING")
+            base_env.pop("TYPHOON_API_KEY", None)
+            modes = {
+                "network": dict(base_env, MAIN_API_URL=server.url, CATALOG_SNAPSHOT_PATH=""),
+                "snapshot": dict(base_env, MAIN_API_URL="", CATALOG_SNAPSHOT_PATH=snapshot_dir),
+            }
+            for mode, env in modes.items():
+                runs = [run_child(env) for _ in range(args.runs)]
+                assert all(r["items"] == n_items and r["status"] == 200 for r in runs), runs
+                import_ms = statistics.median(r["import_ms"] for r in runs)
+                first_ms = statistics.median(r["first_response_ms"] for r in runs)
+                print(f"{n_items:>8} {mode:<10}{import_ms:>12.0f}{first_ms:>20.0f}")
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+User profile cost per request: rebuild from the full history vs ProfileCache (history เดิม + 1 item ต่อท้ายทุก request)
+
+วัด 2 แบบ
+- profile: ขั้นตอนสร้าง profile อย่างเดียว (history -> objs, favorite tags, user vector)
+- request: POST /api/recommend ทั้ง request (KNN path) เปิด / ปิด profile cache
+
+Usage:
+  python -m benchmarks.bench_profiles
+  python -m benchmarks.bench_profiles --items 20000 --history 50 500 2000
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import api.index as service
+from api.log import configure_logging
+from api.profiles import ProfileCache
+from benchmarks.synthetic import make_catalog
+
+
+def make_session(foods, history_len, n_requests, seed=0):
+    """History ยาว history_len แล้วต่อท้ายทีละ 1 item ทุก request"""
+    rng = random.Random(seed)
+    history = [{"itemId": rng.choice(foods)["id"], "status": rng.choice(["EAT", "EAT", "LIKE", "DISLIKE"])}
+               for _ in range(history_len + n_requests)]
+    return [{"filter": {"tags": [], "priceMin": 0, "priceMax": 999999}, "history": history[:history_len + i]}
+            for i in range(1, n_requests + 1)]
+
+
+def rebuild_profile(snapshot, history, knn):
+    ids = {s: [h.itemId for h in history if h.status == s] for s in ("EAT", "LIKE", "DISLIKE")}
+    objs = [service.history_objs(snapshot, ids[s]) for s in ("EAT", "LIKE", "DISLIKE")]
+    service.analyze_user_preferences(history, snapshot)
+    knn._build_user_vector(*objs, [], False)
+
+
+def cached_profile(snapshot, history, knn, cache):
+    profile = cache.get(history, snapshot)
+    objs = [profile.objs(s, snapshot) for s in ("EAT", "LIKE", "DISLIKE")]
+    service.analyze_user_preferences(history, snapshot, profile)
+    knn._build_user_vector(*objs, [], False, profile.vector)
+
+
+def time_each(fn, items):
+    latencies = []
+    for item in items:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    return np.percentile(np.array(latencies) * 1000, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--history", type=int, nargs="+", default=[10, 100, 1000, 5000])
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+    configure_logging("WARNING")  # ไม่ให้ JSON summary ต่อ request ปนกับตาราง
+
+    foods = make_catalog(n_items=args.items, n_tags=300, seed=1)
+    client = TestClient(service.app)
+    service.typhoon_bot = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        service.load_catalog(foods)
+    snapshot = service.SNAPSHOT
+
+    print(f"{'history':>8}{'rebuild ms':>12}{'cached ms':>11}{'speedup':>9}"
+          f"{'request ms':>12}{'cached req ms':>15}{'speedup':>9}")
+    for history_len in args.history:
+        session = make_session(foods, history_len, args.requests)
+        histories = [[service.HistoryItem(**h) for h in payload["history"]] for payload in session]
+        cache = ProfileCache()
+        with contextlib.redirect_stdout(io.StringIO()):
+            rebuild_ms = time_each(lambda h: rebuild_profile(snapshot, h, snapshot.knn), histories)
+            cached_ms = time_each(lambda h: cached_profile(snapshot, h, snapshot.knn, cache), histories)
+
+            service.profile_cache = None
+            request_ms = time_each(lambda p: client.post("/api/recommend", json=p), session)
+            service.profile_cache = ProfileCache()
+            cached_request_ms = time_each(lambda p: client.post("/api/recommend", json=p), session)
+        print(f"{history_len:>8}{rebuild_ms:>12.2f}{cached_ms:>11.2f}{rebuild_ms / cached_ms:>8.1f}x"
+              f"{request_ms:>12.2f}{cached_request_ms:>15.2f}{request_ms / cached_request_ms:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
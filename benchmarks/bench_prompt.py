@@ -0,0 +1,93 @@
+"""
+Prompt size / latency: full prompt (cuid ids) vs compact prompt (ordinal aliases + token budget)
+vs compact + streaming (ปิด stream ทันทีที่ได้ 10 ids)
+
+ใช้ fixture ชุดเดิมทุกครั้ง (catalog id แบบ cuid + ชื่อไทย, 50 requests ที่ seed ไว้) ยิงไปที่ fake Typhoon
+ซึ่งหน่วงเวลาตามจำนวน tokens (prefill ~2k tokens/s, decode ~50 tokens/s) แล้ววัด tokens ที่ส่ง/ได้กลับ + latency
+
+Usage:
+  python -m benchmarks.bench_prompt
+  python -m benchmarks.bench_prompt --requests 100 --budget 500
+  python -m benchmarks.bench_prompt --answer-size 20   # model ที่ตอบเกินมา 20 ids
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import time
+
+import numpy as np
+
+from api.engines.catalog import FoodCatalog
+from api.engines.typhoon import TyphoonEngine, TyphoonError
+from benchmarks.stubs import FakeTyphoonServer
+from benchmarks.synthetic import make_catalog
+
+
+def make_fixtures(catalog, n_requests, seed=0):
+    """Requests แบบ cold start: candidates 50 rows, history 0-3 ชื่อ, favorite tags 0-3 ตัว"""
+    rng = random.Random(seed)
+    vocab = sorted(catalog.tag_postings)
+    fixtures = []
+    for _ in range(n_requests):
+        rows = np.array(sorted(rng.sample(range(len(catalog)), 50)), dtype=np.intp)
+        eaten = [catalog.names[r] for r in rng.sample(range(len(catalog)), rng.randint(0, 3))]
+        tags = rng.sample(vocab, rng.randint(0, 3))
+        fixtures.append((rows, eaten, tags))
+    return fixtures
+
+
+async def run_mode(engine, catalog, fixtures):
+    latencies, payload_sizes, max_tokens, valid = [], [], [], 0
+    call = engine._call
+
+    async def recording_call(payload, read):
+        payload_sizes.append(len(payload["messages"][-1]["content"]))
+        max_tokens.append(payload["max_tokens"])
+        return await call(payload, read)
+
+    engine._call = recording_call
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            for rows, eaten, tags in fixtures:
+                start = time.perf_counter()
+                try:
+                    ids = await engine.predict(rows, eaten, [], [], tags, catalog=catalog)
+                    valid += len(ids) == 10
+                except TyphoonError:
+                    pass
+                latencies.append(time.perf_counter() - start)
+        finally:
+            await engine.aclose()
+    return np.array(latencies) * 1000, payload_sizes, max_tokens, valid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--budget", type=int, default=700, help="compact prompt token budget")
+    parser.add_argument("--answer-size", type=int, default=10, help="ids ที่ fake Typhoon ตอบกลับมา")
+    args = parser.parse_args()
+
+    catalog = FoodCatalog(make_catalog(n_items=2000, n_tags=60, seed=1, realistic=True))
+    fixtures = make_fixtures(catalog, args.requests)
+
+    print(f"{'mode':<9}{'in tokens':>11}{'out tokens':>12}{'max_tokens':>12}{'prompt chars':>14}"
+          f"{'p50 ms':>9}{'p99 ms':>9}{'10 ids':>8}")
+    for mode, compact, stream in (("full", False, False), ("compact", True, False), ("stream", True, True)):
+        server = FakeTyphoonServer(latency=0.1, per_input_token=0.0005, per_output_token=0.02,
+                                   answer_size=args.answer_size)
+        engine = TyphoonEngine(api_key="bench", url=server.url, compact=compact, prompt_token_budget=args.budget,
+                               stream=stream)
+        latencies, sizes, max_tokens, valid = asyncio.run(run_mode(engine, catalog, fixtures))
+        stats = server.stats()
+        server.close()
+        n = len(fixtures)
+        p50, p99 = np.percentile(latencies, [50, 99])
+        print(f"{mode:<9}{stats['input_tokens'] / n:>11.0f}{stats['output_tokens'] / n:>12.0f}"
+              f"{np.mean(max_tokens):>12.0f}{np.mean(sizes):>14.0f}{p50:>9.0f}{p99:>9.0f}{valid:>5}/{n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Dense vs sparse KNNEngine as the tag vocabulary grows
+
+Usage:
+  python -m benchmarks.bench_sparse
+  python -m benchmarks.bench_sparse --items 5000 --vocab 100 1000 10000 50000
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+
+import numpy as np
+from scipy import sparse
+
+from api.engines.knn import KNNEngine
+from benchmarks.synthetic import make_catalog
+
+
+def matrix_bytes(matrix):
+    if sparse.issparse(matrix):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return matrix.nbytes
+
+
+def run(n_items, n_tags, sparse_mode, n_queries, seed=0):
+    foods = make_catalog(n_items=n_items, n_tags=n_tags, seed=seed)
+    rng = random.Random(seed + 1)
+    queries = [
+        (rng.sample(foods, 200), rng.sample(foods, 3), rng.sample(foods, 3), rng.sample(foods, 1),
+         rng.choice(foods)["tags"][:1])
+        for _ in range(n_queries)
+    ]
+
+    engine = KNNEngine(sparse=sparse_mode)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        engine.train(foods)
+        train_s = time.perf_counter() - start
+
+        latencies = []
+        for candidates, eat, like, dislike, filter_tags in queries:
+            start = time.perf_counter()
+            engine.predict(candidates, eat, like, dislike, filter_tags=filter_tags)
+            latencies.append(time.perf_counter() - start)
+
+    return {
+        "mode": "sparse" if sparse_mode else "dense",
+        "vocab": n_tags,
+        "train_ms": train_s * 1000,
+        "predict_p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "vectors_mb": matrix_bytes(engine.food_vectors) / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--vocab", type=int, nargs="+", default=[100, 1000, 10000, 30000])
+    parser.add_argument("--queries", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{'mode':<8}{'vocab':>8}{'train ms':>12}{'predict p50 ms':>16}{'vectors MB':>12}")
+    for n_tags in args.vocab:
+        for sparse_mode in (False, True):
+            r = run(args.items, n_tags, sparse_mode, args.queries)
+            print(f"{r['mode']:<8}{r['vocab']:>8}{r['train_ms']:>12.1f}{r['predict_p50_ms']:>16.2f}{r['vectors_mb']:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Typhoon client under concurrent load: pooled async httpx vs the old requests-in-executor path
+
+ยิง TyphoonEngine.predict พร้อมกัน N ครั้งไปที่ fake Typhoon server (process แยก, latency คงที่)
+แล้ววัด p50/p99 ต่อ call + จำนวน TCP connection ที่ server เห็น
+
+แต่ละ call ใช้ history ต่างกัน (ไม่ถูก single-flight รวม); --identical = ทุก call input เดียวกัน
+(จำลอง burst ของ user ใหม่ที่ไม่มี history) ดูว่า upstream calls / tail latency ลดลงแค่ไหน
+
+Usage:
+  python -m benchmarks.bench_typhoon_pool
+  python -m benchmarks.bench_typhoon_pool --concurrency 50 100 200 --latency 0.1
+  python -m benchmarks.bench_typhoon_pool --identical
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+import numpy as np
+import requests
+
+from api.engines.catalog import FoodCatalog
+from api.engines.typhoon import TyphoonEngine
+from benchmarks.stubs import fake_typhoon
+from benchmarks.synthetic import make_catalog
+
+
+class UncoalescedTyphoonEngine(TyphoonEngine):
+    """Pooled client แต่ไม่มี single-flight: ทุก call ยิง upstream เอง"""
+
+    async def predict(self, candidates, eat_now_names, liked_names, disliked_names, favorite_tags=None, catalog=None):
+        request_key = self._request_key(candidates, eat_now_names, liked_names, disliked_names, favorite_tags, catalog)
+        return await self._ask_typhoon(
+            request_key, candidates, eat_now_names, liked_names, disliked_names, favorite_tags, catalog
+        )
+
+
+class ExecutorTyphoonEngine(UncoalescedTyphoonEngine):
+    """แบบเดิม: requests.post (connection ใหม่ทุกครั้ง) ใน default thread pool, ไม่มี single-flight"""
+
+    async def _post(self, payload):
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, lambda: requests.post(self.url, headers=headers, json=payload, timeout=self.timeout)
+        )
+
+
+async def run_load(engine, catalog, concurrency, rounds, identical=False):
+    latencies = []
+
+    async def one_call(i):
+        eat_now = [] if identical else [f"Menu {i}"]
+        start = time.perf_counter()
+        ids = await engine.predict(np.arange(len(catalog)), eat_now, [], [], ["tag1"], catalog=catalog)
+        latencies.append(time.perf_counter() - start)
+        return ids
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        await engine.start()
+        try:
+            wall = time.perf_counter()
+            for _ in range(rounds):
+                results = await asyncio.gather(*(one_call(i) for i in range(concurrency)))
+            wall = time.perf_counter() - wall
+        finally:
+            await engine.aclose()
+    assert all(len(ids) == 10 for ids in results)
+    return np.array(latencies) * 1000, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 100, 200])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake server latency (s)")
+    parser.add_argument("--identical", action="store_true", help="every call sends the same inputs")
+    args = parser.parse_args()
+
+    catalog = FoodCatalog(make_catalog(n_items=500, n_tags=40))
+    print(f"{'concurrency':>11} {'client':<10}{'p50 ms':>9}{'p99 ms':>9}{'req/s':>9}{'connections':>13}{'upstream':>10}")
+    for concurrency in args.concurrency:
+        engines = (("executor", ExecutorTyphoonEngine), ("pooled", UncoalescedTyphoonEngine),
+                   ("coalesced", TyphoonEngine))
+        for name, engine_cls in engines:
+            with fake_typhoon(args.latency) as (url, stats):
+                engine = engine_cls(api_key="bench", url=url)
+                latencies, wall = asyncio.run(run_load(engine, catalog, concurrency, args.rounds, args.identical))
+                server_stats = stats()
+                connections = server_stats["connections"] - 1  # ไม่นับ connection ของ /stats เอง
+            p50, p99 = np.percentile(latencies, [50, 99])
+            rps = concurrency * args.rounds / wall
+            print(f"{concurrency:>11} {name:<10}{p50:>9.0f}{p99:>9.0f}{rps:>9.0f}{connections:>13}"
+                  f"{server_stats['requests']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Traffic replay / load test: ยิง request bodies ที่บันทึกไว้ (JSONL) ซ้ำไปที่ /api/recommend
+แล้วรายงาน throughput, p50/p95/p99, error rate, strategy ที่ใช้ และ fallbacks (จาก /api/metrics ก่อน-หลัง)
+
+แต่ละบรรทัดของไฟล์: body ของ /api/recommend ตรงๆ ({"filter": ..., "history": [...]}) หรือห่อใน {"body": {...}}
+บรรทัดที่ไม่ใช่ request ที่ถูกต้อง (เช่น backlog ใน requests.jsonl ของ repo นี้) ถูกข้ามและนับไว้ใน skipped
+
+Target
+- in-process (default): app ใน process นี้ผ่าน ASGI transport, catalog = synthetic (--items / --seed),
+  Typhoon = fake server ใน process แยก หน่วง --typhoon-latency วินาที (0 = ไม่ใช้ Typhoon)
+- --url: server ที่รันอยู่แล้ว เช่น
+    python -m benchmarks.stubs next 5000        # พิมพ์ URL ของ fake Next server
+    python -m benchmarks.stubs typhoon 0.8      # พิมพ์ URL ของ fake Typhoon
+    MAIN_API_URL=<next> TYPHOON_API_KEY=stub TYPHOON_API_URL=<typhoon> uvicorn api.index:app --port 8000 --workers 2
+  (หลาย workers: /api/metrics เป็นของ worker ที่ตอบ scrape ตัวเดียว breakdown จึงเป็นแค่ตัวอย่าง)
+
+Load
+- --rate R: open loop, arrivals แบบ Poisson R req/s (latency นับจากเวลาที่ request ควรถูกส่ง รวมเวลารอคิว)
+- ไม่ใส่ --rate: closed loop, --concurrency ตัวยิงต่อเนื่อง
+
+Usage:
+  python -m benchmarks.replay --generate traffic.jsonl --requests 2000
+  python -m benchmarks.replay traffic.jsonl --concurrency 32
+  python -m benchmarks.replay traffic.jsonl --rate 200 --requests 5000 --typhoon-latency 0.8 --out report.json
+  python -m benchmarks.replay traffic.jsonl --url http://127.0.0.1:8000 --max-p99-ms 500 --max-error-rate 0.01
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import random
+import re
+import sys
+import time
+from collections import Counter
+
+import httpx
+import numpy as np
+
+import api.index as service
+from api.engines.typhoon import TyphoonEngine
+from api.log import configure_logging
+from benchmarks.stubs import fake_typhoon
+from benchmarks.synthetic import make_catalog, make_history
+
+SAMPLE = re.compile(r'^([a-zA-Z_:][\w:]*)(?:\{(.*)\})? (\S+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def load_requests(path):
+    """(bodies, skipped): body ที่ผ่าน RecommendRequest แล้ว + จำนวนบรรทัดที่ข้าม"""
+    bodies, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                body = json.loads(line)
+                if isinstance(body, dict) and isinstance(body.get("body"), (dict, str)):
+                    body = body["body"] if isinstance(body["body"], dict) else json.loads(body["body"])
+                if not isinstance(body, dict) or not ("history" in body or "filter" in body):
+                    raise ValueError("not a /api/recommend body")
+                service.RecommendRequest(**body)
+            except (ValueError, TypeError):  # JSONDecodeError / pydantic ValidationError เป็น ValueError
+                skipped += 1
+                continue
+            bodies.append(body)
+    return bodies, skipped
+
+
+def generate_requests(foods, n, seed=0):
+    """Traffic ปลอม: cold start (Typhoon) 30%, hybrid 20%, KNN 50% + ช่วงราคา / tag สุ่ม"""
+    rng = random.Random(seed)
+    vocab = sorted({tag for food in foods for tag in food["tags"]})
+    bodies = []
+    for i in range(n):
+        kind = rng.random()
+        if kind < 0.3:
+            history = make_history(foods, rng.randint(0, 4), seed=seed * 1000003 + i, statuses=("EAT", "LIKE"))
+        elif kind < 0.5:
+            history = make_history(foods, rng.randint(5, 11), seed=seed * 1000003 + i, statuses=("EAT", "LIKE"))
+        else:
+            history = make_history(foods, rng.randint(15, 80), seed=seed * 1000003 + i)
+        lo = rng.choice([0, 0, 50, 100])
+        bodies.append({
+            "filter": {"tags": rng.sample(vocab, rng.randint(0, 2)), "priceMin": lo, "priceMax": lo + rng.choice([100, 200, 999999])},
+            "history": history,
+        })
+    return bodies
+
+
+def parse_metrics(text):
+    """Prometheus text -> {(name, ((label, value), ...)): value} (เฉพาะ samples ไม่เอา HELP / TYPE)"""
+    samples = {}
+    for line in text.splitlines():
+        match = SAMPLE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            samples[(name, tuple(sorted(LABEL.findall(labels or ""))))] = float(value)
+    return samples
+
+
+def breakdown(before, after):
+    """Strategy / fallback counts ระหว่าง 2 scrapes"""
+    def delta(name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        return int(after.get(key, 0) - before.get(key, 0))
+
+    def by_label(name, label):
+        counts = Counter()
+        for (sample, labels), value in after.items():
+            if sample == name:
+                counts[dict(labels).get(label)] += int(value - before.get((sample, labels), 0))
+        return {k: v for k, v in sorted(counts.items()) if v}
+
+    return {
+        "strategies": by_label("recommend_requests_total", "strategy"),
+        "response_cache": by_label("recommend_requests_total", "cache"),
+        "fallbacks": {
+            # Typhoon แพ้ budget / พัง แล้ว KNN ตอบแทน
+            "knn_backup_wins": delta("strategy_wins_total", strategy="knn"),
+            "typhoon_late": delta("strategy_late_total", strategy="typhoon"),
+            "typhoon_errors": delta("strategy_errors_total", strategy="typhoon"),
+        },
+        # Typhoon ตอบไม่ได้ แยกตามสาเหตุ (status / too_few_ids / timeout / exception)
+        "typhoon_failures": by_label("typhoon_failures_total", "reason"),
+        "padding": by_label("recommend_padding_total", "source"),
+    }
+
+
+async def replay(client, bodies, n_requests, concurrency=16, rate=None, timeout=30.0, seed=0):
+    """ยิง n_requests ตัว (วน bodies) คืน (latencies วินาที, error kinds, wall time)"""
+    latencies, errors = [], Counter()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def fire(body, scheduled):
+        async with limit:
+            try:
+                res = await client.post("/api/recommend", json=body, timeout=timeout)
+                if res.status_code != 200:
+                    errors[str(res.status_code)] += 1
+                    return
+            except httpx.HTTPError as e:
+                errors[type(e).__name__] += 1
+                return
+            latencies.append(time.perf_counter() - scheduled)
+
+    loop_bodies = itertools.islice(itertools.cycle(bodies), n_requests)
+    started = time.perf_counter()
+    if rate:
+        rng = random.Random(seed)
+        tasks, due = [], started
+        for body in loop_bodies:
+            due += rng.expovariate(rate)
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            tasks.append(asyncio.create_task(fire(body, due)))
+        await asyncio.gather(*tasks)
+    else:
+        async def worker():
+            for body in loop_bodies:  # iterator เดียวกัน: แต่ละตัวหยิบ body ถัดไป
+                await fire(body, time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+async def run(args, bodies):
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, limits=httpx.Limits(max_connections=args.concurrency))
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=service.app), base_url="http://replay")
+    async with client:
+        before = parse_metrics((await client.get("/api/metrics")).text)
+        latencies, errors, wall = await replay(client, bodies, args.requests, args.concurrency, args.rate,
+                                               args.timeout, args.seed)
+        after = parse_metrics((await client.get("/api/metrics")).text)
+    return report(latencies, errors, wall, before, after)
+
+
+def report(latencies, errors, wall, before, after):
+    completed = len(latencies)
+    total = completed + sum(errors.values())
+    ms = np.array(latencies) * 1000 if latencies else np.zeros(1)
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "requests": total,
+        "duration_s": round(wall, 3),
+        "throughput_rps": round(completed / wall, 1) if wall else 0.0,
+        "latency_ms": {"p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2),
+                       "mean": round(float(ms.mean()), 2), "max": round(float(ms.max()), 2)},
+        "errors": sum(errors.values()),
+        "error_rate": round(sum(errors.values()) / total, 4) if total else 0.0,
+        "error_kinds": dict(errors),
+        **breakdown(before, after),
+    }
+
+
+def setup_in_process(args):
+    """Catalog synthetic + Typhoon ตาม config ของ service แต่ชี้ไปที่ fake server"""
+    service.catalog_sync = None  # ไม่ออกไปหา Next server
+    service.load_catalog(make_catalog(n_items=args.items, n_tags=args.tags, seed=args.seed))
+
+
+def print_report(result, file=sys.stderr):
+    latency = result["latency_ms"]
+    print(f"requests {result['requests']}  duration {result['duration_s']}s  "
+          f"throughput {result['throughput_rps']} req/s  errors {result['errors']} ({result['error_rate']:.2%})", file=file)
+    print(f"latency ms  p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  max {latency['max']}", file=file)
+    for key in ("strategies", "response_cache", "fallbacks", "typhoon_failures", "padding", "error_kinds"):
+        if result.get(key):
+            print(f"{key:<15}" + "  ".join(f"{k}={v}" for k, v in result[key].items()), file=file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", nargs="?", default="traffic.jsonl", help="JSONL ของ request bodies")
+    parser.add_argument("--generate", metavar="PATH", help="เขียน synthetic traffic --requests ตัวลง PATH แล้วจบ")
+    parser.add_argument("--url", help="server ที่รันอยู่ (ไม่ใส่ = app ใน process นี้)")
+    parser.add_argument("--requests", type=int, default=1000, help="จำนวน requests (วนไฟล์ซ้ำถ้าไม่พอ)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, help="arrivals / วินาที (open loop)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--typhoon-latency", type=float, default=0.8, help="latency ของ fake Typhoon (in-process)")
+    parser.add_argument("--items", type=int, default=5000, help="synthetic catalog (in-process / --generate)")
+    parser.add_argument("--tags", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="เขียน report JSON ลงไฟล์")
+    parser.add_argument("--max-p99-ms", type=float, help="exit 1 ถ้า p99 เกินค่านี้")
+    parser.add_argument("--max-error-rate", type=float, help="exit 1 ถ้า error rate เกินค่านี้")
+    args = parser.parse_args()
+    configure_logging("ERROR")
+
+    if args.generate:
+        foods = make_catalog(n_items=args.items, n_tags=args.tags, seed=args.seed)
+        with open(args.generate, "w", encoding="utf-8") as f:
+            for body in generate_requests(foods, args.requests, args.seed):
+                f.write(json.dumps(body, ensure_ascii=False) + "\n")
+        print(f"Wrote {args.requests} requests to {args.generate}", file=sys.stderr)
+        return
+
+    bodies, skipped = load_requests(args.path)
+    print(f"Loaded {len(bodies)} requests from {args.path} ({skipped} lines skipped)", file=sys.stderr)
+    if not bodies:
+        sys.exit("No /api/recommend bodies to replay (create some with --generate)")
+
+    if args.url:
+        result = asyncio.run(run(args, bodies))
+    else:
+        setup_in_process(args)
+        stub = fake_typhoon(args.typhoon_latency) if args.typhoon_latency > 0 else contextlib.nullcontext((None, None))
+        with stub as (url, _):
+            service.typhoon_bot = TyphoonEngine(
+                api_key="replay", url=url, max_concurrency=service.TYPHOON_MAX_CONCURRENCY,
+                cache=service.typhoon_cache, breaker=service.typhoon_breaker, compact=service.TYPHOON_COMPACT_PROMPT,
+                prompt_token_budget=service.TYPHOON_PROMPT_TOKENS, stream=service.TYPHOON_STREAM,
+            ) if url else None
+            result = asyncio.run(run(args, bodies))
+
+    result = {"meta": {"target": args.url or "in-process", "file": args.path, "skipped_lines": skipped,
+                       "params": {k: v for k, v in vars(args).items() if k not in ("path", "out", "generate")}},
+              **result}
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
+
+    failed = []
+    if args.max_p99_ms is not None and result["latency_ms"]["p99"] > args.max_p99_ms:
+        failed.append(f"p99 {result['latency_ms']['p99']} ms > {args.max_p99_ms} ms")
+    if args.max_error_rate is not None and result["error_rate"] > args.max_error_rate:
+        failed.append(f"error rate {result['error_rate']} > {args.max_error_rate}")
+    if failed:
+        print("FAILED: " + "; ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
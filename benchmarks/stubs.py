@@ -0,0 +1,232 @@
+"""
+Local stand-in servers for tests and benchmarks (no real Next server / DB needed)
+"""
+import contextlib
+import json
+import re
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+from api.engines.typhoon import estimate_tokens
+
+
+class _BacklogHTTPServer(ThreadingHTTPServer):
+    # load test เปิด connection พร้อมกันหลายร้อย: backlog default (5) จะโดน SYN retry จน latency เพี้ยน
+    request_queue_size = 1024
+
+
+class FakeNextServer:
+    """
+    จำลอง Next server: แบ่งหน้าด้วย limit/offset, ETag, updatedSince -> delta + deletedIds
+    """
+
+    def __init__(self, items):
+        self.items = {str(i["id"]): dict(i, updated=0) for i in items}
+        self.deleted = {}
+        self.clock = 1
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append((self.path, dict(self.headers)))
+                query = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+                etag = f'"v{server.clock}"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+
+                rows = sorted(server.items.values(), key=lambda i: i["id"])
+                body = {}
+                if "updatedSince" in query:
+                    # นับเวลาเป็น clock (int); ค่าแบบอื่น เช่น ISO time = ส่งทุกอย่าง
+                    since = int(query["updatedSince"]) if query["updatedSince"].isdigit() else 0
+                    rows = [i for i in rows if i["updated"] >= since]
+                    body["deletedIds"] = [k for k, t in server.deleted.items() if t >= since]
+                limit, offset = int(query["limit"]), int(query.get("offset", 0))
+                body["data"] = rows[offset:offset + limit]
+
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def upsert(self, item):
+        self.clock += 1
+        self.items[str(item["id"])] = dict(item, updated=self.clock)
+
+    def delete(self, item_id):
+        self.clock += 1
+        self.items.pop(item_id)
+        self.deleted[item_id] = self.clock
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeTyphoonServer:
+    """
+    จำลอง Typhoon chat completions: ตอบ answer_size ตัวแรกจาก options ใน prompt
+    ("ID: <id>" -> array ของ ids, compact "<n>. ..." -> array ของเลขลำดับ); "stream": true -> ตอบแบบ SSE
+    latency = latency + per_input_token x prompt tokens + per_output_token x answer tokens (ประมาณด้วย estimate_tokens)
+    stream_tail = data payloads (string) ที่ส่งต่อท้ายคำตอบก่อน [DONE] เช่น usage chunk ที่ "choices": []
+    เก็บสถิติ: จำนวน request, จำนวน TCP connection ที่เปิด, จำนวน request ที่วิ่งพร้อมกันสูงสุด, tokens ที่รับ/ตอบ
+    """
+
+    def __init__(self, latency=0.05, status=200, per_input_token=0.0, per_output_token=0.0, answer_size=10,
+                 stream_tail=()):
+        self.latency = latency
+        self.stream_tail = list(stream_tail)
+        self.answer_size = answer_size
+        self.status = status
+        self.per_input_token = per_input_token
+        self.per_output_token = per_output_token
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.aborted_streams = 0
+        self.requests = 0
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+            disable_nagle_algorithm = True  # headers กับ body เขียนแยกกัน: กัน delayed-ACK 40ms
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with server.lock:
+                    server.connections += 1
+
+            def do_GET(self):
+                # /stats: ให้ benchmark อ่านตัวเลขได้ตอนรัน server แยก process
+                payload = json.dumps(server.stats()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                with server.lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                    prompt = body["messages"][-1]["content"]
+                    ids = re.findall(r"^ID: (\S+)", prompt, re.M)[:server.answer_size]
+                    aliases = [int(n) for n in re.findall(r"^(\d+)\. ", prompt, re.M)[:server.answer_size]]
+                    content = json.dumps(ids or aliases)
+                    input_tokens = sum(estimate_tokens(m["content"]) for m in body["messages"])
+                    with server.lock:
+                        server.input_tokens += input_tokens
+                    time.sleep(server.latency + server.per_input_token * input_tokens)
+                    if body.get("stream") and server.status == 200:
+                        self.stream(content)
+                    else:
+                        self.respond(content)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def respond(self, content):
+                output_tokens = estimate_tokens(content)
+                with server.lock:
+                    server.output_tokens += output_tokens
+                time.sleep(server.per_output_token * output_tokens)
+                payload = json.dumps({"choices": [{"message": {"content": content}}]}).encode()
+                self.send_response(server.status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def stream(self, content):
+                """SSE แบบ OpenAI: ส่งทีละ 4 ตัวอักษร (~1 token) จนจบด้วย [DONE]; client ปิดกลางทาง = aborted"""
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                try:
+                    for start in range(0, len(content), 4):
+                        piece = content[start:start + 4]
+                        time.sleep(server.per_output_token * estimate_tokens(piece))
+                        event = {"choices": [{"delta": {"content": piece}}]}
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                        with server.lock:
+                            server.output_tokens += estimate_tokens(piece)
+                    for data in server.stream_tail:
+                        self.wfile.write(f"data: {data}\n\n".encode())
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    with server.lock:
+                        server.aborted_streams += 1
+
+        self.httpd = _BacklogHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/v1/chat/completions"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stats(self):
+        with self.lock:
+            return {"requests": self.requests, "connections": self.connections, "max_in_flight": self.max_in_flight,
+                    "input_tokens": self.input_tokens, "output_tokens": self.output_tokens,
+                    "aborted_streams": self.aborted_streams}
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@contextlib.contextmanager
+def fake_typhoon(latency):
+    """Fake Typhoon server ใน process แยก (ไม่แย่ง GIL กับฝั่งที่วัด) คืน (url, stats())"""
+    proc = subprocess.Popen([sys.executable, "-m", "benchmarks.stubs", "typhoon", str(latency)],
+                            stdout=subprocess.PIPE, text=True)
+    try:
+        url = proc.stdout.readline().strip()
+        yield url, lambda: requests.get(url).json()
+    finally:
+        proc.kill()
+        proc.wait()
+
+
+if __name__ == "__main__":
+    # รันเป็น process แยก (ไม่แย่ง GIL กับฝั่ง client ตอน load test):
+    #   python -m benchmarks.stubs typhoon 0.05      -> fake Typhoon (latency วินาที)
+    #   python -m benchmarks.stubs next 5000 0       -> fake Next server กับ synthetic catalog (items, seed)
+    if sys.argv[1:2] == ["typhoon"]:
+        fake = FakeTyphoonServer(latency=float(sys.argv[2]) if len(sys.argv) > 2 else 0.05)
+    elif sys.argv[1:2] == ["next"]:
+        from benchmarks.synthetic import make_catalog
+
+        fake = FakeNextServer(make_catalog(n_items=int(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+                                           seed=int(sys.argv[3]) if len(sys.argv) > 3 else 0))
+    else:
+        sys.exit("usage: python -m benchmarks.stubs typhoon [latency_s] | next [n_items] [seed]")
+    print(fake.url, flush=True)
+    threading.Event().wait()
@@ -0,0 +1,233 @@
+"""
+Benchmark suite (offline): micro benchmarks ของ hot paths + POST /api/recommend ทั้ง request ผ่าน TestClient
+Typhoon เป็น fake server ใน process (benchmarks.stubs) ไม่ต่อ DB / Next server / Typhoon จริง
+ผลเป็น JSON (p50 / p95 / p99 ต่อ benchmark + commit + parameters) ไว้เทียบข้าม commit
+
+- knn_train: KNNEngine.train ทั้ง catalog
+- knn_predict: KNNEngine.predict ของ user หนึ่งคน (candidates = rows ในงบที่ยังไม่เคยเห็น)
+- analyze_user_preferences: คะแนน tags จาก history (ไม่ผ่าน profile cache)
+- parse_ai_response: JSON array ปกติ / parse_ai_response_messy: markdown + ข้อความปน + JSON เสีย (ทางสำรอง)
+- recommend_knn / recommend_hybrid / recommend_typhoon: /api/recommend ตาม strategy (response cache ปิด)
+
+Usage:
+  python -m benchmarks.suite --out before.json
+  python -m benchmarks.suite --out after.json --compare before.json
+  python -m benchmarks.suite --quick --only knn_predict recommend_knn
+  python -m benchmarks.suite --items 20000 --tags 1000 --tag-distribution zipf
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import api.index as service
+from api.engines.knn import KNNEngine
+from api.engines.typhoon import TyphoonEngine
+from api.log import configure_logging
+from api.snapshot import build_snapshot
+from benchmarks.stubs import FakeTyphoonServer
+from benchmarks.synthetic import make_catalog, make_history
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = ("knn_train", "knn_predict", "analyze_user_preferences", "parse_ai_response", "parse_ai_response_messy",
+              "recommend_knn", "recommend_hybrid", "recommend_typhoon")
+QUICK = {"items": 1000, "tags": 100, "users": 30, "train_repeat": 2}
+
+
+def measure(fn, inputs, warmup=3):
+    """เรียก fn ทีละ input (warmup ไม่นับ) -> สถิติ latency หน่วย ms"""
+    for item in inputs[:warmup]:
+        fn(item)
+    latencies = []
+    for item in inputs:
+        start = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - start)
+    ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "n": len(ms),
+        "mean_ms": round(float(ms.mean()), 4),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "min_ms": round(float(ms.min()), 4),
+        "ops_per_s": round(len(ms) / (ms.sum() / 1000), 1),
+    }
+
+
+def make_requests(foods, n_users, history_len, seed, statuses=("EAT", "EAT", "LIKE", "DISLIKE")):
+    """Payloads ของ /api/recommend: history ยาว history_len + filter ช่วงราคาสุ่ม (ครึ่งหนึ่งมี tag)"""
+    rng = random.Random(seed)
+    vocab = sorted({tag for food in foods for tag in food["tags"]})
+    payloads = []
+    for i in range(n_users):
+        lo = rng.randint(0, 150)
+        payloads.append({
+            "filter": {"tags": [rng.choice(vocab)] if vocab and i % 2 else [], "priceMin": lo, "priceMax": lo + 150},
+            "history": make_history(foods, history_len, seed=seed * 100003 + i, statuses=statuses),
+        })
+    return payloads
+
+
+def ai_responses(foods):
+    """คำตอบของ LLM: JSON ปกติ กับแบบมี markdown + คำอธิบาย + comma เกิน (json.loads พัง)"""
+    ids = [food["id"] for food in foods[:10]]
+    clean = json.dumps(ids)
+    messy = "Here are my picks:\n```json\n[" + ", ".join(f"'{i}'" for i in ids) + ",]\n```\nEnjoy!"
+    return clean, messy
+
+
+def run_suite(args):
+    foods = make_catalog(n_items=args.items, n_tags=args.tags, price_range=tuple(args.price_range), seed=args.seed,
+                         tag_distribution=args.tag_distribution)
+    snapshot = build_snapshot(foods, version=1)
+    knn_users = make_requests(foods, args.users, args.history, args.seed)
+    only = set(args.only or BENCHMARKS)
+    results = {}
+
+    if "knn_train" in only:
+        results["knn_train"] = measure(lambda _: KNNEngine().train(foods), list(range(args.train_repeat)), warmup=1)
+
+    if "knn_predict" in only:
+        inputs = []
+        for payload in knn_users:
+            req = service.RecommendRequest(**payload)
+            profile = service.user_profile(req.history, snapshot)
+            rows_in_budget, rows_out_budget = service.split_candidates(snapshot.catalog, profile.seen_rows(), req.filter)
+            objs = [profile.objs(status, snapshot) for status in ("EAT", "LIKE", "DISLIKE")]
+            inputs.append((rows_in_budget if len(rows_in_budget) else rows_out_budget, *objs, req.filter.tags))
+        results["knn_predict"] = measure(lambda u: snapshot.knn.predict(*u[:4], filter_tags=u[4]), inputs)
+
+    if "analyze_user_preferences" in only:
+        histories = [[service.HistoryItem(**h) for h in payload["history"]] for payload in knn_users]
+        results["analyze_user_preferences"] = measure(lambda h: service.analyze_user_preferences(h, snapshot), histories)
+
+    engine = TyphoonEngine(api_key="bench")
+    shortlist = foods[:20]
+    for name, content in zip(("parse_ai_response", "parse_ai_response_messy"), ai_responses(foods)):
+        if name in only:
+            results[name] = measure(lambda c: engine._parse_ai_response(c, shortlist), [content] * args.users * 10)
+
+    macro = [name for name in ("recommend_knn", "recommend_hybrid", "recommend_typhoon") if name in only]
+    if macro:
+        results.update(run_macro(args, foods, snapshot, knn_users, macro))
+    return results
+
+
+def run_macro(args, foods, snapshot, knn_users, names):
+    """/api/recommend ผ่าน TestClient: knn (history ยาว), hybrid (EAT/LIKE 8 ตัว), typhoon (cold start 2 ตัว)"""
+    saved = {name: getattr(service, name) for name in ("typhoon_bot", "catalog_sync", "response_cache", "SNAPSHOT")}
+    server = FakeTyphoonServer(latency=args.typhoon_latency)
+    # ไม่มี Typhoon cache / breaker: ทุก request ยิง fake server จริง วัด overhead ของ client + prompt + parse
+    service.typhoon_bot = TyphoonEngine(api_key="bench", url=server.url, compact=service.TYPHOON_COMPACT_PROMPT,
+                                        prompt_token_budget=service.TYPHOON_PROMPT_TOKENS, stream=service.TYPHOON_STREAM)
+    service.catalog_sync = None  # offline: refresher ใน lifespan ไม่ออกไปหา Next server
+    service.response_cache = None  # วัดการคำนวณจริง ไม่ใช่ cache hit
+    service.swap_snapshot(snapshot)
+
+    payloads = {
+        "recommend_knn": knn_users,
+        "recommend_hybrid": make_requests(foods, args.users, 8, args.seed + 1, statuses=("EAT", "LIKE")),
+        "recommend_typhoon": make_requests(foods, args.users, 2, args.seed + 2),
+    }
+    results = {}
+    try:
+        with TestClient(service.app) as client:
+            def post(payload):
+                res = client.post("/api/recommend", json=payload)
+                assert res.status_code == 200, res.text
+
+            for name in names:
+                results[name] = measure(post, payloads[name])
+    finally:
+        server.close()
+        # คืนค่า globals ของ service (เรียกจาก test ได้โดยไม่กระทบ test อื่น)
+        for name, value in saved.items():
+            setattr(service, name, value)
+        if saved["SNAPSHOT"] is not None:
+            service.swap_snapshot(saved["SNAPSHOT"])
+    return results
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(results, baseline, max_regression=None):
+    """ตาราง p50 เทียบ baseline (ลง stderr) คืน benchmark ที่ช้าลงเกิน max_regression (สัดส่วน เช่น 0.2 = 20%)"""
+    regressions = []
+    print(f"{'benchmark':<26}{'base p50 ms':>13}{'p50 ms':>11}{'change':>9}", file=sys.stderr)
+    for name, stats in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            print(f"{name:<26}{'-':>13}{stats['p50_ms']:>11.3f}{'new':>9}", file=sys.stderr)
+            continue
+        change = stats["p50_ms"] / base["p50_ms"] - 1 if base["p50_ms"] else 0.0
+        print(f"{name:<26}{base['p50_ms']:>13.3f}{stats['p50_ms']:>11.3f}{change:>+8.1%}", file=sys.stderr)
+        if max_regression is not None and change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--tags", type=int, default=300, help="tag vocabulary size")
+    parser.add_argument("--tag-distribution", choices=("uniform", "zipf"), default="uniform")
+    parser.add_argument("--price-range", type=int, nargs=2, default=[20, 300])
+    parser.add_argument("--users", type=int, default=200, help="requests ต่อ benchmark")
+    parser.add_argument("--history", type=int, default=30, help="ความยาว history ของ knn_* benchmarks")
+    parser.add_argument("--train-repeat", type=int, default=5)
+    parser.add_argument("--typhoon-latency", type=float, default=0.0, help="latency ของ fake Typhoon (วินาที)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help=f"ขนาดเล็ก: {QUICK}")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS)
+    parser.add_argument("--out", help="เขียน JSON ลงไฟล์ (ไม่ใส่ = พิมพ์ลง stdout)")
+    parser.add_argument("--compare", help="JSON ของ run ก่อนหน้า")
+    parser.add_argument("--max-regression", type=float, help="exit 1 ถ้า p50 ช้ากว่า baseline เกินสัดส่วนนี้")
+    args = parser.parse_args()
+    if args.quick:
+        for key, value in QUICK.items():
+            setattr(args, key, value)
+    configure_logging("CRITICAL")  # log เป็น I/O ที่ไม่ได้อยากวัด และไม่ให้ปนกับ JSON บน stdout
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "max_regression")},
+        },
+        "results": run_suite(args),
+    }
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report["results"], json.load(f), args.max_regression)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
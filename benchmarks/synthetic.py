@@ -0,0 +1,55 @@
+"""
+Synthetic catalog generator for offline benchmarks (no DB / Next server needed)
+"""
+import itertools
+import random
+import string
+
+THAI_DISHES = ["ข้าวผัด", "ผัดกะเพรา", "ต้มยำกุ้ง", "แกงเขียวหวาน", "ส้มตำ", "ก๋วยเตี๋ยวเรือ", "ข้าวมันไก่", "ผัดไทย"]
+
+
+def make_catalog(n_items=1000, n_tags=200, tags_per_item=(1, 6), price_range=(20, 300), seed=0, realistic=False,
+                 tag_distribution="uniform", zipf_s=1.1):
+    """
+    สร้างเมนูปลอมแบบ deterministic (seed เดิม = ข้อมูลเดิม)
+    realistic=True: id แบบ cuid (25 ตัวอักษรเหมือน Prisma) + ชื่อเมนูภาษาไทย (ใช้วัด prompt tokens)
+    tag_distribution: "uniform" ทุก tag โอกาสเท่ากัน | "zipf" tag ลำดับ r ถูกเลือกด้วยน้ำหนัก 1 / r^zipf_s
+    (ไม่กี่ tag ฮิตมาก เหมือน "ไทย" / "เผ็ด" ของจริง)
+    """
+    if tag_distribution not in ("uniform", "zipf"):
+        raise ValueError(f"Unknown tag_distribution: {tag_distribution}")
+    rng = random.Random(seed)
+    vocab = [f"tag{i}" for i in range(n_tags)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) ** zipf_s for rank in range(n_tags)))
+    lo, hi = tags_per_item
+    foods = []
+    for i in range(n_items):
+        if realistic:
+            food_id = "c" + "".join(rng.choices(string.ascii_lowercase + string.digits, k=24))
+            name = f"{rng.choice(THAI_DISHES)} สูตร {i}"
+        else:
+            food_id, name = f"item{i:07d}", f"Menu {i}"
+        foods.append({
+            "id": food_id,
+            "name": name,
+            "tags": (rng.sample(vocab, min(rng.randint(lo, hi), n_tags)) if tag_distribution == "uniform"
+                     else _weighted_sample(rng, vocab, cum_weights, min(rng.randint(lo, hi), n_tags))),
+            "price": float(rng.randint(*price_range)),
+        })
+    return foods
+
+
+def _weighted_sample(rng, vocab, cum_weights, k):
+    """k tags ไม่ซ้ำ ตามน้ำหนัก (สุ่มซ้ำจนได้ครบ)"""
+    chosen = []
+    while len(chosen) < k:
+        tag = rng.choices(vocab, cum_weights=cum_weights)[0]
+        if tag not in chosen:
+            chosen.append(tag)
+    return chosen
+
+
+def make_history(foods, n, seed=0, statuses=("EAT", "EAT", "LIKE", "DISLIKE")):
+    """History ปลอม n รายการ (payload ของ /api/recommend) item สุ่มจาก foods, status สุ่มจาก statuses"""
+    rng = random.Random(seed)
+    return [{"itemId": rng.choice(foods)["id"], "status": rng.choice(statuses)} for _ in range(n)]
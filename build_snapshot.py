@@ -0,0 +1,25 @@
+"""
+Build the on-disk catalog snapshot used for fast cold starts
+
+Usage:
+  MAIN_API_URL=https://your-next-app.vercel.app python build_snapshot.py [snapshot_dir]
+
+แล้ว deploy พร้อมตั้ง CATALOG_SNAPSHOT_PATH=<snapshot_dir>
+"""
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from api.index import catalog_sync, fetch_catalog
+from api.snapshot import build_snapshot, save_snapshot
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else "snapshot"
+    items = fetch_catalog()
+    if not items:
+        print("❌ No items fetched, snapshot not written")
+        sys.exit(1)
+
+    manifest = save_snapshot(build_snapshot(items, version=1), path, catalog_sync.state())
+    print(f"💾 Wrote snapshot to {path}: {manifest['n_items']} items, {manifest['n_tags']} tags")
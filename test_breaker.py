@@ -0,0 +1,79 @@
+"""
+CircuitBreaker tests (closed / open / half-open + adaptive timeout)
+
+Usage:
+  python -m pytest -q test_breaker.py
+"""
+from api.engines.breaker import CircuitBreaker
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_opens_on_error_rate_then_recovers_through_half_open():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, open_seconds=30, clock=clock)
+    for ok in (True, False, True, False):
+        breaker.record_success(0.1) if ok else breaker.record_failure(0.1)
+    assert breaker.state == "open"
+    assert not breaker.allow() and not breaker.available()
+
+    clock.now += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()  # probe
+    assert not breaker.allow()  # probe ตัวเดียวพอ
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.stats()["opened_count"] == 2
+
+    clock.now += 30
+    assert breaker.allow()
+    breaker.record_success(0.2)
+    assert breaker.state == "closed"
+    assert breaker.stats()["calls_in_window"] == 0
+
+
+def test_opens_when_p95_latency_is_too_slow():
+    breaker = CircuitBreaker(window=10, min_calls=5, slow_p95=3.0)
+    for latency in (0.5, 0.6, 0.7, 0.8):
+        breaker.record_success(latency)
+    assert breaker.state == "closed"
+    breaker.record_success(9.0)
+    assert breaker.state == "open"
+
+
+def test_cancelled_probe_is_released():
+    clock = FakeClock()
+    breaker = CircuitBreaker(min_calls=1, open_seconds=5, clock=clock)
+    breaker.record_failure()
+    clock.now += 5
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.available() and breaker.allow()
+
+
+def test_adaptive_timeout_follows_recent_p95():
+    breaker = CircuitBreaker(min_calls=5, min_timeout=2.0, max_timeout=12.0, multiplier=2.0)
+    assert breaker.timeout() == 12.0  # ยังไม่มีข้อมูลพอ
+    for _ in range(20):
+        breaker.record_success(1.5)
+    assert breaker.timeout() == 3.0
+    for _ in range(50):
+        breaker.record_success(0.1)
+    assert breaker.timeout() == 2.0
+
+
+def test_cancelled_calls_count_as_slow_not_failed():
+    breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5, slow_p95=3.0)
+    for _ in range(3):
+        breaker.record_cancelled(0.5)
+    breaker.record_failure(0.5)
+    assert breaker.state == "closed"  # error rate 1/4
+    assert breaker.stats()["calls_in_window"] == 4
+    breaker.record_cancelled(5.0)
+    assert breaker.state == "open"  # ถูก cancel หลังรอไป 5 วินาที = ช้า
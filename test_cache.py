@@ -0,0 +1,74 @@
+"""
+TTLCache tests (memory LRU + TTL + disk tier)
+
+Usage:
+  python -m pytest -q test_cache.py
+"""
+from api.engines.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    cache = TTLCache(max_entries=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a ถูกใช้ล่าสุด -> b โดนไล่
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = TTLCache(max_entries=10, ttl=60, clock=clock)
+    cache.set("k", ["x"], cost=2.5)
+    clock.now += 59
+    assert cache.get("k") == ["x"]
+    clock.now += 2
+    assert cache.get("k") is None
+    assert len(cache) == 0
+
+    stats = cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["saved_latency_s"] == 2.5
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    clock = FakeClock()
+    first = TTLCache(max_entries=10, ttl=60, disk_dir=str(tmp_path), clock=clock)
+    first.set("k", ["a", "b"], cost=1.0)
+
+    second = TTLCache(max_entries=10, ttl=60, disk_dir=str(tmp_path), clock=clock)
+    assert second.get("k") == ["a", "b"]
+    assert second.stats()["disk_hits"] == 1
+    assert len(second) == 1  # ดึงขึ้น memory แล้ว
+
+    clock.now += 61
+    third = TTLCache(max_entries=10, ttl=60, disk_dir=str(tmp_path), clock=clock)
+    assert third.get("k") is None
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    cache = TTLCache(max_entries=10, ttl=60, disk_dir=str(tmp_path), max_disk_entries=3)
+    for i in range(6):
+        cache.set(f"k{i}", i)
+    assert len(list(tmp_path.glob("*.json"))) == 3
+
+
+def test_clear_drops_both_tiers(tmp_path):
+    cache = TTLCache(max_entries=4, ttl=60, disk_dir=str(tmp_path))
+    cache.set("a", [1])
+    cache.set("b", [2])
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get("a") is None and cache.get("b") is None
+    assert TTLCache(disk_dir=str(tmp_path)).get("a") is None
@@ -0,0 +1,33 @@
+"""
+Rank fusion tests for the Hybrid strategy
+
+Usage:
+  python -m pytest -q test_fusion.py
+"""
+import pytest
+
+from api.fusion import hybrid_weights, reciprocal_rank_fusion
+
+
+def test_rrf_rewards_items_ranked_by_both_lists():
+    knn = ["a", "b", "c", "d"]
+    typhoon = ["c", "e", "a"]
+    fused = reciprocal_rank_fusion([knn, typhoon], k=60)
+    assert fused[:2] == ["a", "c"]
+    assert set(fused) == {"a", "b", "c", "d", "e"}
+
+
+def test_rrf_weights_and_ties():
+    # น้ำหนักเท่ากัน อันดับเท่ากัน -> เสมอกัน ใช้ลำดับที่เจอก่อน (list แรก)
+    assert reciprocal_rank_fusion([["x"], ["y"]]) == ["x", "y"]
+    assert reciprocal_rank_fusion([["x"], ["y"]], [0.3, 0.7]) == ["y", "x"]
+    # id ซ้ำใน list เดียวกันนับครั้งเดียว
+    assert reciprocal_rank_fusion([["x", "x", "y"], []], limit=1) == ["x"]
+
+
+def test_hybrid_weights_shift_towards_knn_with_history():
+    assert hybrid_weights(5, 5, 12, 0.6, 0.3) == pytest.approx((0.4, 0.6))
+    assert hybrid_weights(12, 5, 12, 0.6, 0.3) == pytest.approx((0.7, 0.3))
+    assert hybrid_weights(20, 5, 12, 0.6, 0.3) == pytest.approx((0.7, 0.3))
+    knn_weight, _ = hybrid_weights(8, 5, 12, 0.6, 0.3)
+    assert 0.4 < knn_weight < 0.7
@@ -0,0 +1,123 @@
+"""
+DeadlineExecutor tests (Typhoon vs KNN race with a latency budget)
+
+Usage:
+  python -m pytest -q test_hedging.py
+"""
+import asyncio
+import time
+
+from api.engines.breaker import CircuitBreaker
+from api.engines.typhoon import TyphoonEngine
+from api.hedging import DeadlineExecutor
+from benchmarks.stubs import FakeTyphoonServer
+from benchmarks.synthetic import make_catalog
+
+
+async def answer_after(seconds, value, events=None):
+    try:
+        await asyncio.sleep(seconds)
+    except asyncio.CancelledError:
+        if events is not None:
+            events.append("cancelled")
+        raise
+    if events is not None:
+        events.append("finished")
+    return value
+
+
+def test_fast_primary_wins():
+    executor = DeadlineExecutor(budget=0.5)
+    winner, result = asyncio.run(executor.run("typhoon", answer_after(0.01, ["t"]), "knn", lambda: ["k"]))
+    assert (winner, result) == ("typhoon", ["t"])
+    assert executor.stats.snapshot()["typhoon"]["wins"] == 1
+
+
+def test_slow_primary_loses_to_backup_and_keeps_running():
+    executor = DeadlineExecutor(budget=0.05, keep_late=True)
+    events = []
+
+    async def race():
+        started = time.perf_counter()
+        outcome = await executor.run("typhoon", answer_after(0.2, ["t"], events), "knn", lambda: ["k"])
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0.3)  # คำตอบที่มาช้ายังวิ่งจนจบ (warm cache)
+        return outcome, elapsed
+
+    (winner, result), elapsed = asyncio.run(race())
+    assert (winner, result) == ("knn", ["k"])
+    assert elapsed < 0.15
+    assert events == ["finished"]
+    stats = executor.stats.snapshot()
+    assert stats["knn"]["wins"] == 1 and stats["knn"]["win_rate"] == 1.0
+    assert stats["typhoon"]["late"] == 1 and stats["typhoon"]["wins"] == 0
+    assert stats["typhoon"]["p50_ms"] >= 200
+
+
+def test_slow_primary_is_cancelled_when_not_warming():
+    executor = DeadlineExecutor(budget=0.05, keep_late=False)
+    events = []
+
+    async def race():
+        outcome = await executor.run("typhoon", answer_after(0.2, ["t"], events), "knn", lambda: ["k"])
+        await asyncio.sleep(0.01)
+        return outcome
+
+    assert asyncio.run(race()) == ("knn", ["k"])
+    assert events == ["cancelled"]
+
+
+def test_failed_primary_falls_back_within_budget():
+    async def broken():
+        raise RuntimeError("boom")
+
+    executor = DeadlineExecutor(budget=1.0)
+    assert asyncio.run(executor.run("typhoon", broken(), "knn", lambda: ["k"])) == ("knn", ["k"])
+    assert executor.stats.snapshot()["typhoon"]["errors"] == 1
+
+
+def test_typhoon_error_counts_as_error_and_backup_wins():
+    # Typhoon ตอบ 500 -> ไม่ใช่ชัยชนะของ Typhoon: ต้องได้ KNN และนับเป็น error
+    foods = make_catalog(n_items=50, n_tags=10, seed=5)
+    server = FakeTyphoonServer(latency=0, status=500)
+    engine = TyphoonEngine(api_key="test", url=server.url)
+    executor = DeadlineExecutor(budget=1.0)
+
+    async def race():
+        try:
+            return await executor.run("typhoon", engine.predict(foods, [], [], [], ["tag1"]), "knn", lambda: ["k"])
+        finally:
+            await engine.aclose()
+
+    try:
+        assert asyncio.run(race()) == ("knn", ["k"])
+    finally:
+        server.close()
+    stats = executor.stats.snapshot()["typhoon"]
+    assert (stats["wins"], stats["errors"]) == (0, 1)
+
+
+def test_cancelled_late_typhoon_call_still_records_latency():
+    # TYPHOON_WARM_LATE=0: call ที่เกิน budget ถูก cancel -> breaker ต้องยังเห็น latency ที่รอไป
+    foods = make_catalog(n_items=50, n_tags=10, seed=6)
+    server = FakeTyphoonServer(latency=0.3)
+    breaker = CircuitBreaker(window=10, min_calls=1, slow_p95=0.05)
+    engine = TyphoonEngine(api_key="test", url=server.url, breaker=breaker)
+    executor = DeadlineExecutor(budget=0.1, keep_late=False)
+
+    async def race():
+        try:
+            outcome = await executor.run("typhoon", engine.predict(foods, [], [], [], ["tag1"]), "knn", lambda: ["k"])
+            await asyncio.sleep(0.05)
+            return outcome
+        finally:
+            await engine.aclose()
+
+    try:
+        assert asyncio.run(race()) == ("knn", ["k"])
+    finally:
+        server.close()
+    stats = breaker.stats()
+    assert stats["calls_in_window"] == 1
+    assert stats["p95_ms"] >= 50
+    assert stats["state"] == "open"  # p95 เกิน slow_p95
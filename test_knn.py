@@ -0,0 +1,206 @@
+"""
+KNNEngine unit tests (offline, no DB / Typhoon needed)
+
+Usage:
+  python -m pytest -q test_knn.py
+"""
+import random
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from api.engines import knn as knn_module
+from api.engines.knn import KNNEngine
+
+TAGS = [f"tag{i}" for i in range(30)]
+CATEGORIES = ["rice", "noodle", "drink"]
+
+
+def make_foods(n=200, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "id": f"food{i}",
+            "name": f"Food {i}",
+            "tags": rng.sample(TAGS, rng.randint(0, 5)),
+            "category": rng.choice(CATEGORIES),
+            "popularity": rng.choice([0, 10, 80, 300]),
+            "price": float(rng.randint(20, 300)),
+        }
+        for i in range(n)
+    ]
+
+
+def reference_ranking(engine, foods, candidates, eat, like, dislike, filter_tags):
+    """Per-item scoring loop แบบเดิม ใช้เทียบกับ vectorized path"""
+    by_id = {f["id"]: f for f in foods}
+    user_vector = dense(engine._build_user_vector(eat, like, dislike, filter_tags, False))
+    eat_categories = [f.get("category", "") for f in eat]
+    scored = []
+    for c in candidates:
+        food = by_id[c["id"]]
+        vec = dense(engine.food_vectors[engine.catalog.id_to_row[c["id"]]])
+        denom = np.linalg.norm(user_vector) * np.linalg.norm(vec)
+        score = float(np.dot(user_vector, vec) / denom) if denom else 0.0
+        if eat and food["category"] in eat_categories:
+            score += 0.1
+        if food["popularity"] > 0:
+            score += min(food["popularity"] / 1000, 0.05)
+        scored.append((c["id"], score))
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return [food_id for food_id, _ in scored[:15]]
+
+
+def dense(vector):
+    if sparse.issparse(vector):
+        vector = vector.toarray()
+    return np.asarray(vector, dtype=float).ravel()
+
+
+def trained_engine(foods, sparse_mode=True):
+    engine = KNNEngine(sparse=sparse_mode)
+    engine.train(foods)
+    return engine
+
+
+@pytest.mark.parametrize("sparse_mode", [True, False])
+def test_vectorized_scores_match_reference_ranking(sparse_mode):
+    foods = make_foods()
+    engine = trained_engine(foods, sparse_mode)
+    rng = random.Random(1)
+    for _ in range(20):
+        candidates = rng.sample(foods, 120)
+        eat, like, dislike = rng.sample(foods, 3), rng.sample(foods, 2), rng.sample(foods, 1)
+        filter_tags = rng.sample(TAGS, 1)
+        expected = reference_ranking(engine, foods, candidates, eat, like, dislike, filter_tags)
+        result = engine.predict(candidates, eat, like, dislike, filter_tags=filter_tags)
+        assert result[:10] == expected[:10]
+
+
+def test_predict_skips_unknown_candidates():
+    foods = make_foods(50)
+    engine = trained_engine(foods)
+    candidates = foods[:5] + [{"id": "not-in-catalog"}]
+    result = engine.predict(candidates, [], [], [])
+    assert "not-in-catalog" not in result
+    assert set(result) <= {f["id"] for f in foods[:5]}
+
+
+def test_top_k_is_stable_on_ties():
+    engine = KNNEngine()
+    scores = np.array([0.5, 0.9, 0.5, 0.9, 0.1, 0.5])
+    assert list(engine._top_k(scores, 4)) == [1, 3, 0, 2]
+
+
+def test_catalog_struct_of_arrays():
+    foods = make_foods(20)
+    foods[3]["category"] = "rice"
+    engine = trained_engine(foods)
+    catalog = engine.catalog
+    assert len(catalog) == 20
+    assert catalog.id_to_row["food3"] == 3
+    assert catalog.prices[3] == foods[3]["price"]
+    assert catalog.category_names[catalog.category_codes[3]] == "rice"
+    assert catalog.tags.shape[0] == 20
+    assert list(catalog.rows_for(["food5", "missing", "food1"])) == [5, 1]
+
+
+def test_sparse_and_dense_modes_agree():
+    foods = make_foods(300, seed=2)
+    sparse_engine = trained_engine(foods, sparse_mode=True)
+    dense_engine = trained_engine(foods, sparse_mode=False)
+    rng = random.Random(3)
+    for _ in range(20):
+        candidates = rng.sample(foods, 150)
+        eat, like, dislike = rng.sample(foods, 4), rng.sample(foods, 3), rng.sample(foods, 2)
+        filter_tags = rng.sample(TAGS, 2) + ["unknown-tag"]
+        args = (candidates, eat, like, dislike)
+        assert sparse_engine.predict(*args, filter_tags=filter_tags, boost_recent=True) == \
+            dense_engine.predict(*args, filter_tags=filter_tags, boost_recent=True)
+    assert sparse.issparse(sparse_engine._build_user_vector(eat, like, dislike, filter_tags, True))
+
+
+def test_neighbor_index_searches_inside_subset():
+    from api.engines.neighbors import BruteForceIndex, LSHIndex
+    foods = make_foods(400, seed=4)
+    engine = trained_engine(foods)
+    query = engine._build_user_vector(foods[:3], [], [], None, False)
+    subset = np.arange(100, 140)
+    brute = BruteForceIndex().fit(engine.catalog.tags)
+    lsh = LSHIndex(exact_below=0).fit(engine.catalog.tags)
+    for index in (brute, lsh):
+        rows = index.search(query, 10, subset=subset)
+        assert len(rows) == 10
+        assert set(rows) <= set(subset)
+    full = brute.search(query, 10)
+    assert np.all(np.diff(brute.score(query, full)) <= 1e-12)
+
+
+def test_knn_engine_with_lsh_index():
+    foods = make_foods(300, seed=5)
+    engine = KNNEngine(index="lsh")
+    engine.train(foods)
+    result = engine.predict(foods[:8], foods[10:12], [], [])
+    assert set(result) == {f["id"] for f in foods[:8]}
+
+
+def test_budget_mask_matches_linear_scan():
+    foods = make_foods(200, seed=6)
+    engine = trained_engine(foods)
+    for lo, hi in [(0, 999999), (50, 120), (120, 50), (301, 400), (100, 100)]:
+        expected = [lo <= f["price"] <= hi for f in foods]
+        assert list(engine.catalog.budget_mask(lo, hi)) == expected
+
+
+def test_predict_accepts_row_indices():
+    foods = make_foods(120, seed=8)
+    engine = trained_engine(foods)
+    rows = np.arange(20, 60)
+    by_dicts = engine.predict(foods[20:60], foods[:2], foods[2:4], [], filter_tags=["tag3"])
+    by_rows = engine.predict(rows, foods[:2], foods[2:4], [], filter_tags=["tag3"])
+    assert by_rows == by_dicts
+
+
+@pytest.mark.parametrize("sparse_mode", [True, False])
+def test_predict_batch_matches_per_user_predict(sparse_mode):
+    foods = make_foods(300, seed=4)
+    engine = trained_engine(foods, sparse_mode)
+    rng = random.Random(2)
+    users = []
+    for _ in range(40):
+        rows = np.array(sorted(rng.sample(range(300), rng.choice([4, 60, 250]))), dtype=np.intp)
+        users.append((rows, rng.sample(foods, rng.randint(0, 3)), rng.sample(foods, rng.randint(0, 2)),
+                      rng.sample(foods, rng.randint(0, 1)), rng.sample(TAGS + ["unknown-tag"], rng.randint(0, 2))))
+
+    batch = engine.predict_batch(*(list(column) for column in zip(*users)), chunk_size=16)
+    for (rows, eat, like, dislike, filter_tags), ids in zip(users, batch):
+        assert ids == engine.predict(rows, eat, like, dislike, filter_tags=filter_tags)
+    assert len(batch[0]) <= 10
+
+
+def test_predict_batch_chunks_by_memory_budget(monkeypatch):
+    foods = make_foods(300, seed=5)
+    engine = trained_engine(foods, True)
+    rng = random.Random(3)
+    users = [(np.array(sorted(rng.sample(range(300), 80)), dtype=np.intp), rng.sample(foods, 2), [], [], None)
+             for _ in range(10)]
+    columns = [list(column) for column in zip(*users)]
+    expected = engine.predict_batch(*columns, chunk_size=len(users))
+
+    # งบพอแค่ 3 users ต่อ chunk (score matrix 3 x 300 float64) -> ผลต้องไม่เปลี่ยน
+    monkeypatch.setattr(knn_module, "BATCH_SCORE_BYTES", 3 * 300 * 8)
+    scored = []
+    top_k_batch = engine._top_k_batch
+
+    def counting_top_k_batch(matrix, *args):
+        scored.append(matrix.shape[0])
+        return top_k_batch(matrix, *args)
+
+    monkeypatch.setattr(engine, "_top_k_batch", counting_top_k_batch)
+    assert engine.predict_batch(*columns) == expected
+    assert scored == [3, 3, 3, 1]
+
+    # rows ซ้ำ / ไม่เรียง ใน candidates ไม่ทำให้ได้ id ซ้ำ
+    rows, eat = users[0][0], users[0][1]
+    assert engine.predict_batch([np.concatenate([rows[::-1], rows])], [eat], [[]], [[]]) == [expected[0]]
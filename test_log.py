@@ -0,0 +1,85 @@
+"""
+Structured logging tests (JSON records, level gating, one summary line per /api/recommend)
+
+Usage:
+  python -m pytest -q test_log.py
+"""
+import json
+import logging
+
+from fastapi.testclient import TestClient
+
+import api.index as service
+from api.log import JsonFormatter
+from benchmarks.synthetic import make_catalog
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_json_formatter_includes_fields():
+    record = logging.LogRecord("api.test", logging.INFO, __file__, 1, "hello %s", ("ไทย",), None)
+    record.fields = {"request_id": "r1", "stages_ms": {"scoring": 0.5}}
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["msg"] == "hello ไทย"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "api.test"
+    assert entry["request_id"] == "r1"
+    assert entry["stages_ms"] == {"scoring": 0.5}
+
+
+def test_disabled_levels_are_not_formatted():
+    formatted = []
+
+    class Expensive:
+        def __str__(self):
+            formatted.append(1)
+            return "expensive"
+
+    logger = logging.getLogger("api")
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        logging.getLogger("api.engines.knn").debug("🔍 %s", Expensive())
+    finally:
+        logger.setLevel(level)
+    assert formatted == []
+
+
+def test_recommend_logs_one_summary_line():
+    service.typhoon_bot = None
+    foods = make_catalog(n_items=200, n_tags=30, seed=4)
+    service.load_catalog(foods)
+    handler = ListHandler()
+    logger = logging.getLogger("api.index")
+    logger.addHandler(handler)
+    level = logging.getLogger("api").level
+    logging.getLogger("api").setLevel(logging.INFO)
+    try:
+        history = [{"itemId": f["id"], "status": "EAT"} for f in foods[:5]]
+        res = TestClient(service.app).post(
+            "/api/recommend",
+            json={"filter": {"tags": ["tag1"], "priceMin": 0, "priceMax": 120}, "history": history},
+            headers={"x-request-id": "req-42"},
+        )
+        assert res.status_code == 200
+    finally:
+        logger.removeHandler(handler)
+        logging.getLogger("api").setLevel(level)
+
+    summaries = [r for r in handler.records if r.getMessage() == "recommend"]
+    assert len(summaries) == 1
+    fields = summaries[0].fields
+    assert fields["request_id"] == "req-42"
+    assert fields["strategy"] == "knn"
+    assert fields["history"] == 5
+    assert fields["candidates_in_budget"] + fields["candidates_out_of_budget"] == 195
+    assert fields["returned"] == 10
+    assert {"catalog_load", "history_resolution", "budget_partition", "user_vector", "scoring", "padding"} <= set(fields["stages_ms"])
+    assert fields["total_ms"] >= max(fields["stages_ms"].values())
@@ -0,0 +1,72 @@
+"""
+Metrics registry + /api/metrics tests (Prometheus text format, per-stage histograms)
+
+Usage:
+  python -m pytest -q test_metrics.py
+"""
+import time
+
+from fastapi.testclient import TestClient
+
+import api.index as service
+from api.metrics import Histogram, Metrics
+from benchmarks.synthetic import make_catalog
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1.0), fold_at=2)
+    for value in (0.05, 0.1, 0.5, 3.0, 1.0):
+        histogram.observe(value)
+    # ค่าที่เท่ากับขอบนับใน bucket นั้น (le = less or equal)
+    assert histogram.cumulative() == [(0.1, 2), (1.0, 4), (float("inf"), 5)]
+    assert histogram.count == 5
+    assert abs(histogram.sum - 4.65) < 1e-9
+
+
+def test_render_prometheus_text():
+    m = Metrics()
+    m.describe("requests_total", "Requests")
+    m.inc("requests_total", strategy="knn", cache="miss")
+    m.inc("requests_total", cache="miss", strategy="knn")  # ลำดับ labels ต่างกัน = series เดียวกัน
+    with m.span("scoring"):
+        pass
+    m.add_collector(lambda: [("cache_entries", "gauge", "Entries", {"cache": 'a"b'}, 3)])
+    m.add_collector(lambda: 1 / 0)  # collector พังต้องไม่ทำให้ทั้ง scrape พัง
+
+    text = m.render()
+    assert "# HELP requests_total Requests\n# TYPE requests_total counter\n" in text
+    assert 'requests_total{cache="miss",strategy="knn"} 2\n' in text
+    assert "# TYPE recommend_stage_seconds histogram" in text
+    assert 'recommend_stage_seconds_bucket{stage="scoring",le="+Inf"} 1\n' in text
+    assert 'recommend_stage_seconds_count{stage="scoring"} 1\n' in text
+    assert 'cache_entries{cache="a\\"b"} 3\n' in text
+
+
+def test_span_overhead_is_small():
+    m = Metrics()
+    n = 20000
+    start = time.perf_counter()
+    for _ in range(n):
+        with m.span("noop"):
+            pass
+    per_span = (time.perf_counter() - start) / n
+    assert per_span < 20e-6  # วัดได้ ~0.5µs เผื่อเครื่อง CI ช้า
+
+
+def test_metrics_endpoint_reports_stages():
+    service.typhoon_bot = None
+    foods = make_catalog(n_items=200, n_tags=30, seed=3)
+    service.load_catalog(foods)
+    client = TestClient(service.app)
+    history = [{"itemId": f["id"], "status": "EAT"} for f in foods[:5]]
+    res = client.post("/api/recommend", json={"filter": {"tags": [], "priceMin": 0, "priceMax": 999999}, "history": history})
+    assert res.status_code == 200
+
+    res = client.get("/api/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    for stage in ("catalog_load", "history_resolution", "budget_partition", "analyze_preferences",
+                  "user_vector", "scoring", "padding"):
+        assert f'recommend_stage_seconds_count{{stage="{stage}"}}' in res.text
+    assert 'recommend_requests_total{cache="miss",strategy="knn"}' in res.text
+    assert 'catalog_items 200' in res.text
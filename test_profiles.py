@@ -0,0 +1,80 @@
+"""
+User profile cache tests (history prefix hash + incremental updates)
+
+Usage:
+  python -m pytest -q test_profiles.py
+"""
+import random
+
+import numpy as np
+
+from api.index import HistoryItem, analyze_user_preferences, history_objs
+from api.profiles import ProfileCache, UserProfile
+from api.snapshot import build_snapshot
+from benchmarks.synthetic import make_catalog
+
+
+def make_history(foods, n, seed=0):
+    rng = random.Random(seed)
+    history = [HistoryItem(itemId=rng.choice(foods)["id"], status=rng.choice(["EAT", "LIKE", "DISLIKE"]))
+               for _ in range(n)]
+    history.insert(n // 2, HistoryItem(itemId="missing", status="EAT"))
+    return history
+
+
+def assert_same_profile(profile, expected):
+    assert profile.rows == expected.rows
+    assert (profile.vector != expected.vector).nnz == 0
+    assert list(profile.tag_frequency.items()) == list(expected.tag_frequency.items())
+    assert profile.length == expected.length
+
+
+def test_incremental_profile_matches_full_rebuild():
+    foods = make_catalog(n_items=200, n_tags=30, seed=1)
+    snapshot = build_snapshot(foods, version=1)
+    history = make_history(foods, 60)
+    cache = ProfileCache(max_entries=16)
+
+    for n in range(1, len(history) + 1):
+        profile = cache.get(history[:n], snapshot)
+        assert_same_profile(profile, UserProfile.build(history[:n], snapshot))
+    assert cache.get(history, snapshot) is profile
+    assert cache.stats()["rebuilds"] == 1
+    assert cache.stats()["extended"] == len(history) - 1
+    assert cache.stats()["hits"] == 1
+
+    # ของเดิมที่ endpoint ใช้: tags คะแนนสูงสุด, objs ตามลำดับ cache
+    assert analyze_user_preferences(history, snapshot, profile) == analyze_user_preferences(history, snapshot)
+    eat_ids = [h.itemId for h in history if h.status == "EAT"]
+    assert profile.objs("EAT", snapshot) == history_objs(snapshot, eat_ids)
+
+
+def test_profile_rebuilds_when_prefix_does_not_match():
+    foods = make_catalog(n_items=100, n_tags=20, seed=2)
+    snapshot = build_snapshot(foods, version=1)
+    history = make_history(foods, 30, seed=3)
+    cache = ProfileCache(max_entries=16, max_append=4)
+    cache.get(history, snapshot)
+
+    edited = list(history)
+    edited[5] = HistoryItem(itemId=foods[0]["id"], status="DISLIKE")
+    assert_same_profile(cache.get(edited, snapshot), UserProfile.build(edited, snapshot))
+    # ต่อท้ายเกิน max_append -> สร้างใหม่
+    longer = history + make_history(foods, 6, seed=4)
+    cache.get(longer, snapshot)
+    # snapshot ใหม่ -> rows / tag columns อาจเปลี่ยน ต้องสร้างใหม่
+    cache.get(history, build_snapshot(foods, version=2))
+    assert cache.stats()["rebuilds"] == 4
+    assert cache.stats()["extended"] == 0
+
+
+def test_knn_predict_with_cached_history_vector():
+    foods = make_catalog(n_items=300, n_tags=40, seed=5)
+    snapshot = build_snapshot(foods, version=1)
+    history = make_history(foods, 25, seed=6)
+    profile = UserProfile.build(history, snapshot)
+    objs = [profile.objs(status, snapshot) for status in ("EAT", "LIKE", "DISLIKE")]
+    candidates = np.setdiff1d(np.arange(len(foods)), profile.seen_rows())
+
+    expected = snapshot.knn.predict(candidates, *objs, filter_tags=["tag3"])
+    assert snapshot.knn.predict(candidates, *objs, filter_tags=["tag3"], history_vector=profile.vector) == expected
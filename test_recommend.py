@@ -0,0 +1,287 @@
+"""
+/api/recommend tests against an in-process app with a synthetic catalog
+(offline: no Next server, no Typhoon key)
+
+Usage:
+  python -m pytest -q test_recommend.py
+"""
+import asyncio
+import random
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api.index as service
+from api.engines.typhoon import TyphoonEngine
+from benchmarks.stubs import FakeTyphoonServer
+from benchmarks.synthetic import make_catalog
+
+client = TestClient(service.app)
+
+
+@pytest.fixture(autouse=True)
+def catalog():
+    foods = make_catalog(n_items=300, n_tags=40, seed=7)
+    service.load_catalog(foods)
+    return foods
+
+
+def post(payload):
+    res = client.post("/api/recommend", json=payload)
+    assert res.status_code == 200
+    return res.json()["itemIds"]
+
+
+def test_recommend_returns_ten_unseen_items(catalog):
+    history = [{"itemId": f["id"], "status": s} for f, s in zip(catalog[:15], ["EAT", "LIKE", "DISLIKE"] * 5)]
+    ids = post({"filter": {"tags": ["tag1"], "priceMin": 50, "priceMax": 150}, "history": history})
+    assert len(ids) == 10
+    assert len(set(ids)) == 10
+    assert not set(ids) & {h["itemId"] for h in history}
+
+
+def test_history_resolution_ignores_unknown_ids(catalog):
+    history = [{"itemId": "missing", "status": "EAT"}] + [
+        {"itemId": f["id"], "status": "EAT"} for f in catalog[:3]
+    ]
+    prefs = service.analyze_user_preferences([service.HistoryItem(**h) for h in history])
+    assert prefs["engagement_level"] == 4
+    assert set(prefs["favorite_tags"]) <= {t for f in catalog[:3] for t in f["tags"]}
+
+
+def test_analyze_user_preferences_weights():
+    service.load_catalog([
+        {"id": "a", "name": "A", "tags": ["spicy", "thai"], "price": 50.0},
+        {"id": "b", "name": "B", "tags": ["thai"], "price": 60.0},
+        {"id": "c", "name": "C", "tags": ["sweet"], "price": 70.0},
+    ])
+    history = [
+        service.HistoryItem(itemId="a", status="EAT"),
+        service.HistoryItem(itemId="b", status="LIKE"),
+        service.HistoryItem(itemId="c", status="DISLIKE"),
+    ]
+    assert service.analyze_user_preferences(history)["favorite_tags"] == ["thai", "spicy"]
+
+
+def test_health_reports_snapshot_version():
+    before = client.get("/api/health").json()
+    service.load_catalog(make_catalog(n_items=50, n_tags=10, seed=1))
+    after = client.get("/api/health").json()
+    assert after["status"] == "ok"
+    assert after["items_loaded"] == 50
+    assert after["snapshot_version"] == before["snapshot_version"] + 1
+    assert after["snapshot_age_s"] >= 0
+
+
+def test_background_refresher_swaps_snapshot(monkeypatch):
+    foods = make_catalog(n_items=80, n_tags=10, seed=2)
+    monkeypatch.setattr(service, "sync_catalog", lambda delta=False: service.SyncResult("full", foods))
+    version = service.SNAPSHOT.version
+    with TestClient(service.app) as lifespan_client:
+        for _ in range(100):
+            if service.SNAPSHOT.version > version:
+                break
+            time.sleep(0.01)
+        body = lifespan_client.get("/api/health").json()
+    assert body["snapshot_version"] > version
+    assert body["items_loaded"] == 80
+    assert service.SNAPSHOT.items is foods
+
+
+def test_in_flight_request_keeps_its_snapshot(catalog):
+    snapshot = service.SNAPSHOT
+    service.load_catalog(make_catalog(n_items=10, n_tags=5, seed=3))
+    assert snapshot.catalog is not service.SNAPSHOT.catalog
+    assert len(snapshot.items) == len(catalog)
+
+
+def test_slow_typhoon_loses_to_knn_within_budget(monkeypatch, catalog):
+    class SlowTyphoon:
+        def is_available(self):
+            return True
+
+        async def predict(self, *args, **kwargs):
+            await asyncio.sleep(2)
+            return ["never"]
+
+    monkeypatch.setattr(service, "typhoon_bot", SlowTyphoon())
+    monkeypatch.setattr(service.strategy_executor, "budget", 0.05)
+    monkeypatch.setattr(service.strategy_executor, "keep_late", False)
+
+    started = time.perf_counter()
+    ids = post({"filter": {"tags": ["tag1"]}, "history": []})
+    assert time.perf_counter() - started < 1
+    assert len(ids) == 10 and "never" not in ids
+    assert service.strategy_executor.stats.snapshot()["knn"]["wins"] >= 1
+
+
+def test_open_circuit_skips_typhoon(monkeypatch, catalog):
+    class DownTyphoon:
+        def is_available(self):
+            return False
+
+        async def predict(self, *args, **kwargs):
+            raise AssertionError("should not be called while the circuit is open")
+
+    monkeypatch.setattr(service, "typhoon_bot", DownTyphoon())
+    ids = post({"filter": {"tags": ["tag1"]}, "history": []})
+    assert len(ids) == 10
+
+
+def test_hybrid_runs_knn_and_typhoon_concurrently(monkeypatch, catalog):
+    typhoon_pick = [f["id"] for f in catalog[200:203]]
+
+    class SlowTyphoon:
+        def is_available(self):
+            return True
+
+        async def predict(self, *args, **kwargs):
+            await asyncio.sleep(0.3)
+            return typhoon_pick
+
+    knn = service.SNAPSHOT.knn
+    knn_predict = knn.predict
+
+    def slow_knn(*args, **kwargs):
+        time.sleep(0.3)
+        return knn_predict(*args, **kwargs)
+
+    monkeypatch.setattr(service, "typhoon_bot", SlowTyphoon())
+    monkeypatch.setattr(knn, "predict", slow_knn)
+
+    history = [{"itemId": f["id"], "status": "EAT"} for f in catalog[:6]]
+    started = time.perf_counter()
+    ids = post({"filter": {"priceMin": 0, "priceMax": 999999}, "history": history})
+    assert time.perf_counter() - started < 0.55  # max(0.3, 0.3) ไม่ใช่ 0.6
+    assert len(ids) == 10
+    assert typhoon_pick[0] in ids[:3]  # history = 6 ยังให้ weight Typhoon มากกว่า KNN
+
+
+def test_batch_matches_single_requests(catalog):
+    rng = random.Random(4)
+    requests = []
+    for i in range(25):
+        history = [{"itemId": f["id"], "status": rng.choice(["EAT", "LIKE", "DISLIKE"])}
+                   for f in rng.sample(catalog, rng.randint(0, 8))]
+        price_min = rng.choice([0, 50, 290])
+        requests.append({"filter": {"tags": rng.sample(["tag1", "tag2", "tag3"], i % 2),
+                                    "priceMin": price_min, "priceMax": price_min + 100}, "history": history})
+
+    res = client.post("/api/recommend/batch", json={"requests": requests})
+    assert res.status_code == 200
+    results = [r["itemIds"] for r in res.json()["results"]]
+    assert results == [post(payload) for payload in requests]
+
+
+def test_batch_rejects_too_many_users(monkeypatch):
+    monkeypatch.setattr(service, "BATCH_MAX_USERS", 2)
+    res = client.post("/api/recommend/batch", json={"requests": [{}, {}, {}]})
+    assert res.status_code == 413
+
+
+def test_repeat_poll_is_served_from_response_cache(monkeypatch, catalog):
+    calls = []
+    knn = service.SNAPSHOT.knn
+    knn_predict = knn.predict
+    monkeypatch.setattr(knn, "predict", lambda *args, **kwargs: calls.append(1) or knn_predict(*args, **kwargs))
+
+    history = [{"itemId": f["id"], "status": s} for f, s in zip(catalog[:14], ["EAT", "LIKE"] * 7)]
+    payload = {"filter": {"tags": ["tag2", "tag1"], "priceMin": 40, "priceMax": 200}, "history": history}
+    first = post(payload)
+    # history / tags คนละลำดับแต่ความหมายเดียวกัน -> key เดียวกัน
+    again = post({"filter": {"tags": ["tag1", "tag2"], "priceMin": 40, "priceMax": 200}, "history": history[::-1]})
+    assert again == first
+    assert len(calls) == 1
+
+    # catalog retrain -> cache ถูกล้าง คำนวณใหม่บน snapshot ใหม่
+    service.load_catalog(catalog)
+    assert len(service.response_cache) == 0
+    assert post(payload) == first
+    assert len(service.response_cache) == 1
+
+
+def test_knn_backup_answer_is_not_cached(monkeypatch, catalog):
+    class SlowTyphoon:
+        def is_available(self):
+            return True
+
+        async def predict(self, *args, **kwargs):
+            await asyncio.sleep(1)
+            return ["never"]
+
+    monkeypatch.setattr(service, "typhoon_bot", SlowTyphoon())
+    monkeypatch.setattr(service.strategy_executor, "budget", 0.05)
+    monkeypatch.setattr(service.strategy_executor, "keep_late", False)
+    post({"filter": {"tags": ["tag1"]}, "history": []})
+    assert len(service.response_cache) == 0
+
+
+def test_typhoon_error_is_not_cached_and_retry_asks_again(monkeypatch, catalog):
+    server = FakeTyphoonServer(latency=0, status=500)
+    monkeypatch.setattr(service, "typhoon_bot", TyphoonEngine(api_key="test", url=server.url))
+    monkeypatch.setattr(service.strategy_executor, "budget", 1.0)
+    payload = {"filter": {"tags": ["tag1"]}, "history": []}
+    try:
+        assert len(post(payload)) == 10
+        assert len(service.response_cache) == 0  # คำตอบสำรอง (KNN) ไม่ถูก cache
+
+        # upstream กลับมาแล้ว: poll รอบถัดไปต้องถาม Typhoon ใหม่ ไม่ใช่ได้คำตอบสำรองเดิมจาก cache
+        server.status = 200
+        assert len(post(payload)) == 10
+        assert server.requests == 2
+        assert len(service.response_cache) == 1
+    finally:
+        server.close()
+
+
+def test_hybrid_ignores_failed_typhoon(monkeypatch, catalog):
+    history = [{"itemId": f["id"], "status": "EAT"} for f in catalog[:6]]
+    payload = {"filter": {"priceMin": 0, "priceMax": 999999}, "history": history}
+    monkeypatch.setattr(service, "typhoon_bot", None)
+    knn_only = post(payload)
+    service.response_cache.clear()
+
+    server = FakeTyphoonServer(latency=0, status=500)
+    monkeypatch.setattr(service, "typhoon_bot", TyphoonEngine(api_key="test", url=server.url))
+    try:
+        # Typhoon พัง -> fuse แค่ KNN และไม่ cache
+        assert post(payload) == knn_only
+        assert server.requests == 1
+        assert len(service.response_cache) == 0
+    finally:
+        server.close()
+
+
+def test_partial_stream_answer_is_padded_with_knn_and_not_cached(monkeypatch, catalog):
+    payload = {"filter": {"tags": ["tag1"]}, "history": []}
+    monkeypatch.setattr(service, "typhoon_bot", None)
+    knn_only = post(payload)
+    service.response_cache.clear()
+
+    # ~1 token ทุก 0.1s: ถึง deadline 0.35s ได้มาแค่ไม่กี่ ids -> ตอบด้วยผลบางส่วน
+    server = FakeTyphoonServer(latency=0, per_output_token=0.1)
+    engine = TyphoonEngine(api_key="test", url=server.url, stream=True)
+    answers = []
+    predict = engine.predict
+
+    async def recording_predict(*args, **kwargs):
+        answers.append(await predict(*args, **kwargs))
+        return answers[-1]
+
+    monkeypatch.setattr(engine, "predict", recording_predict)
+    monkeypatch.setattr(service, "typhoon_bot", engine)
+    monkeypatch.setattr(service, "TYPHOON_STREAM_DEADLINE", 0.35)
+    monkeypatch.setattr(service.strategy_executor, "budget", 1.0)
+    try:
+        ids = post(payload)
+        partial = answers[0]
+        assert partial.partial and 3 <= len(partial) < 10
+        assert ids[:len(partial)] == partial  # ids จาก Typhoon มาก่อน
+        assert ids[len(partial):] == [i for i in knn_only if i not in partial][:10 - len(partial)]
+        assert len(service.response_cache) == 0
+
+        post(payload)
+        assert server.requests == 2  # poll ซ้ำต้องถาม Typhoon ใหม่ ไม่ใช่ได้ผลบางส่วนจาก cache
+    finally:
+        server.close()
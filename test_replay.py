@@ -0,0 +1,78 @@
+"""
+Traffic replay harness tests (JSONL parsing, in-process replay, metrics breakdown)
+
+Usage:
+  python -m pytest -q test_replay.py
+"""
+import asyncio
+import json
+
+import httpx
+
+import api.index as service
+from benchmarks import replay
+from benchmarks.synthetic import make_catalog
+
+
+def test_load_requests_accepts_bare_and_wrapped_bodies(tmp_path):
+    body = {"filter": {"tags": ["tag1"], "priceMin": 0, "priceMax": 100}, "history": [{"itemId": "a", "status": "EAT"}]}
+    lines = [
+        json.dumps(body),
+        json.dumps({"body": body}),
+        json.dumps({"request_id": "r1", "body": json.dumps(body)}),
+        "",
+        "not json",
+        json.dumps({"request_id": "user-001", "title": "Backlog entry", "body": "free text"}),
+        json.dumps({"history": "not a list"}),
+        json.dumps([1, 2]),
+    ]
+    path = tmp_path / "traffic.jsonl"
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+    bodies, skipped = replay.load_requests(path)
+    assert bodies == [body, body, body]
+    assert skipped == 4
+
+
+def test_in_process_replay_reports_strategies(monkeypatch):
+    foods = make_catalog(n_items=300, n_tags=30, seed=2)
+    service.load_catalog(foods)
+    monkeypatch.setattr(service, "typhoon_bot", None)
+    monkeypatch.setattr(service, "response_cache", None)
+    bodies = replay.generate_requests(foods, 10, seed=1)
+
+    async def main(rate):
+        transport = httpx.ASGITransport(app=service.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://replay") as client:
+            before = replay.parse_metrics((await client.get("/api/metrics")).text)
+            result = await replay.replay(client, bodies, 25, concurrency=4, rate=rate)
+            after = replay.parse_metrics((await client.get("/api/metrics")).text)
+        return replay.report(*result, before, after)
+
+    for rate in (None, 500.0):
+        result = asyncio.run(main(rate))
+        assert result["requests"] == 25
+        assert result["errors"] == 0
+        assert result["throughput_rps"] > 0
+        assert result["latency_ms"]["p50"] <= result["latency_ms"]["p99"] <= result["latency_ms"]["max"]
+        # ไม่มี Typhoon: ทุก request เป็น knn
+        assert result["strategies"] == {"knn": 25}
+        assert result["response_cache"] == {"off": 25}
+        assert result["fallbacks"]["knn_backup_wins"] == 0
+
+
+def test_parse_metrics_and_breakdown():
+    before = replay.parse_metrics('recommend_requests_total{cache="miss",strategy="knn"} 3\n')
+    after = replay.parse_metrics(
+        "# TYPE recommend_requests_total counter\n"
+        'recommend_requests_total{cache="miss",strategy="knn"} 5\n'
+        'recommend_requests_total{cache="hit",strategy="typhoon"} 2\n'
+        'strategy_wins_total{strategy="knn"} 1\n'
+        'typhoon_failures_total{reason="status"} 4.0\n'
+        'typhoon_failures_total{reason="timeout"} 1.0\n'
+    )
+    result = replay.breakdown(before, after)
+    assert result["strategies"] == {"knn": 2, "typhoon": 2}
+    assert result["response_cache"] == {"hit": 2, "miss": 2}
+    assert result["fallbacks"]["knn_backup_wins"] == 1
+    assert result["typhoon_failures"] == {"status": 4, "timeout": 1}
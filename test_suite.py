@@ -0,0 +1,45 @@
+"""
+Synthetic data generator + benchmark suite tests (offline, tiny sizes)
+
+Usage:
+  python -m pytest -q test_suite.py
+"""
+import argparse
+from collections import Counter
+
+import pytest
+
+from benchmarks import suite
+from benchmarks.synthetic import make_catalog, make_history
+
+
+def test_generator_is_deterministic():
+    assert make_catalog(n_items=50, n_tags=20, seed=3) == make_catalog(n_items=50, n_tags=20, seed=3)
+    assert make_catalog(n_items=50, n_tags=20, seed=3) != make_catalog(n_items=50, n_tags=20, seed=4)
+    foods = make_catalog(n_items=50, n_tags=20, seed=3, tag_distribution="zipf")
+    assert make_history(foods, 10, seed=1) == make_history(foods, 10, seed=1)
+    assert {h["itemId"] for h in make_history(foods, 10, seed=1)} <= {f["id"] for f in foods}
+
+
+def test_zipf_tags_are_skewed_and_in_price_range():
+    foods = make_catalog(n_items=500, n_tags=50, price_range=(40, 60), seed=1, tag_distribution="zipf")
+    counts = Counter(tag for food in foods for tag in food["tags"])
+    assert counts["tag0"] > 10 * counts.get("tag49", 1)
+    assert all(len(set(food["tags"])) == len(food["tags"]) for food in foods)
+    assert all(40 <= food["price"] <= 60 for food in foods)
+    with pytest.raises(ValueError):
+        make_catalog(tag_distribution="normal")
+
+
+def test_suite_runs_offline_and_compares():
+    args = argparse.Namespace(items=200, tags=30, price_range=[20, 300], seed=0, tag_distribution="uniform",
+                              users=5, history=20, train_repeat=1, typhoon_latency=0.0, only=None)
+    results = suite.run_suite(args)
+    assert set(results) == set(suite.BENCHMARKS)
+    for stats in results.values():
+        assert stats["n"] >= 1
+        assert 0 <= stats["min_ms"] <= stats["p50_ms"] <= stats["p99_ms"]
+
+    baseline = {"results": {name: dict(stats, p50_ms=stats["p50_ms"] / 2) for name, stats in results.items()}}
+    assert suite.compare(results, baseline, max_regression=0.5) == [name for name in results if results[name]["p50_ms"]]
+    assert suite.compare(results, {"results": results}, max_regression=0.5) == []
@@ -0,0 +1,130 @@
+"""
+Catalog sync tests against a local stand-in for the Next.js /api/items/data endpoint
+
+Usage:
+  python -m pytest -q test_sync.py
+"""
+import os
+
+import numpy as np
+import pytest
+
+from api.snapshot import build_snapshot, load_snapshot, save_snapshot
+from api.sync import CatalogSync
+from benchmarks.stubs import FakeNextServer
+
+
+def make_items(n):
+    return [{"id": f"m{i:04d}", "name": f"Menu {i}", "tags": [f"t{i % 7}", f"t{i % 3}"], "price": 10 + i} for i in range(n)]
+
+
+def encoded_tags(engine):
+    """tags ของแต่ละ row ที่ decode กลับจาก CSR"""
+    tags = engine.catalog.tags
+    return [set(engine.encoder.classes_[tags[row].indices]) for row in range(tags.shape[0])]
+
+
+@pytest.fixture
+def server():
+    fake = FakeNextServer(make_items(1234))
+    yield fake
+    fake.close()
+
+
+def test_full_sync_pages_past_1000_items(server):
+    sync = CatalogSync(server.url, page_size=100)
+    result = sync.fetch()
+    assert result.kind == "full"
+    assert len(result.items) == 1234
+    assert len({i["id"] for i in result.items}) == 1234
+    assert len(server.requests) == 13
+
+
+def test_conditional_request_returns_unchanged(server):
+    sync = CatalogSync(server.url, page_size=100)
+    sync.fetch()
+    assert sync.fetch().kind == "unchanged"
+    assert server.requests[-1][1].get("If-None-Match") == sync.etag
+    server.upsert({"id": "new", "name": "New", "tags": ["t1"], "price": 5})
+    assert sync.fetch().kind == "full"
+
+
+def test_delta_sync_applies_to_snapshot(server):
+    sync = CatalogSync(server.url, page_size=100)
+    snapshot = build_snapshot(sync.fetch().items, version=1)
+
+    server.upsert({"id": "m0005", "name": "Menu 5 v2", "tags": ["brand-new-tag"], "price": 99})
+    server.upsert({"id": "zz01", "name": "Fresh", "tags": ["t2", "another-new-tag"], "price": 42})
+    server.delete("m0010")
+    sync.synced_at = "2"  # fake server นับเวลาเป็น clock
+    result = sync.fetch(delta=True)
+    assert result.kind == "delta"
+    assert {i["id"] for i in result.items} == {"m0005", "zz01"}
+    assert result.removed_ids == ["m0010"]
+
+    updated = snapshot.with_delta(result.items, result.removed_ids, version=2)
+    assert len(updated.items) == 1234
+    assert "m0010" not in updated.item_by_id
+    assert updated.item_by_id["m0005"]["name"] == "Menu 5 v2"
+    assert updated.items[-1]["id"] == "zz01"
+    # snapshot เดิมไม่ถูกแก้
+    assert "m0010" in snapshot.item_by_id
+    assert len(snapshot.knn.encoder.classes_) == 7
+
+    # ผล encode แบบ delta ต้องเท่ากับ train ใหม่ทั้งก้อน (เทียบผ่านชื่อ tag)
+    full = build_snapshot(updated.items)
+    assert encoded_tags(updated.knn) == encoded_tags(full.knn)
+    candidates = np.arange(len(updated.items))
+    history = updated.items[:3]
+    assert updated.knn.predict(candidates, history, [], [], filter_tags=["brand-new-tag"])[0] == "m0005"
+
+
+def test_snapshot_round_trip_on_disk(server, tmp_path):
+    sync = CatalogSync(server.url, page_size=100)
+    snapshot = build_snapshot(sync.fetch().items, version=3)
+    path = str(tmp_path / "snapshot")
+    save_snapshot(snapshot, path, sync.state())
+
+    loaded, manifest = load_snapshot(path)
+    assert loaded.version == 3
+    assert list(loaded.items) == snapshot.items
+    assert loaded.items[-1] == snapshot.items[-1] and loaded.items[:2] == snapshot.items[:2]
+    assert loaded.item_by_id["m0005"] == snapshot.item_by_id["m0005"] and "nope" not in loaded.item_by_id
+    assert loaded.item_tags["m0005"] == snapshot.item_tags["m0005"]
+    assert isinstance(loaded.catalog.prices, np.memmap)
+    assert manifest["sync"]["etag"] == sync.etag
+
+    candidates = np.arange(len(loaded.items))
+    history = loaded.items[:3]
+    expected = snapshot.knn.predict(candidates, history, [], [], filter_tags=["t1"])
+    assert loaded.knn.predict(candidates, history, [], [], filter_tags=["t1"]) == expected
+
+    # state ที่ restore แล้วทำให้รอบแรกหลัง cold start เป็น 304
+    fresh = CatalogSync(server.url, page_size=100)
+    fresh.restore(manifest["sync"])
+    assert fresh.fetch().kind == "unchanged"
+
+
+def test_save_snapshot_swaps_current_pointer(tmp_path):
+    path = str(tmp_path / "snapshot")
+    items = [{"id": f"m{i}", "name": f"Menu {i}", "tags": ["t1"], "price": 10.0} for i in range(5)]
+    # layout เดิม (ไฟล์อยู่ใน path ตรงๆ) ยังโหลดได้
+    os.makedirs(path)
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        f.write("{}")
+
+    for version in (1, 2, 3):
+        save_snapshot(build_snapshot(items, version=version), path)
+    # ตัวปัจจุบัน + ตัวก่อนหน้า (เผื่อคนที่กำลังโหลดอยู่) ที่เหลือถูกลบ รวมถึงไฟล์ของ layout เดิม
+    entries = sorted(os.listdir(path))
+    assert entries[0] == "CURRENT"
+    assert [entry.split("-")[0] for entry in entries[1:]] == ["v2", "v3"]
+
+    # เขียนรอบใหม่พังกลางทาง (tmp ค้าง, CURRENT ยังไม่ถูกสลับ) -> ยังโหลดตัวเดิมได้ครบ
+    os.makedirs(os.path.join(path, "v4-0.tmp"))
+    loaded, manifest = load_snapshot(path)
+    assert manifest["version"] == 3 and len(loaded.items) == 5
+
+
+def test_load_snapshot_missing_dir(tmp_path):
+    assert load_snapshot(str(tmp_path / "nope")) == (None, None)
@@ -0,0 +1,442 @@
+"""
+TyphoonEngine unit tests (offline: no real Typhoon API calls)
+
+Usage:
+  python -m pytest -q test_typhoon.py
+"""
+import asyncio
+import random
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from api.engines.breaker import CircuitBreaker, CircuitOpenError
+from api.engines.cache import TTLCache
+from api.engines.catalog import FoodCatalog
+from api.engines.typhoon import COMPACT_SYSTEM_PROMPT, MIN_ANSWER_TOKENS, TyphoonEngine, TyphoonError, estimate_tokens
+from api.metrics import metrics
+from benchmarks.stubs import FakeTyphoonServer
+from benchmarks.synthetic import make_catalog
+
+
+async def failure_reason(call):
+    """Typhoon พัง -> predict ต้อง raise TyphoonError (caller ใช้ KNN แทน) คืน reason"""
+    with pytest.raises(TyphoonError) as exc:
+        await call
+    return exc.value.reason
+
+
+def test_smart_sample_rows_matches_dict_path():
+    foods = make_catalog(n_items=200, n_tags=30, seed=11)
+    catalog = FoodCatalog(foods)
+    engine = TyphoonEngine(api_key="test")
+    favorite_tags = ["tag1", "tag2", "tag3"]
+    rows = np.arange(40, 140)
+
+    random.seed(5)
+    by_dicts = engine._smart_sample(foods[40:140], favorite_tags, size=20)
+    random.seed(5)
+    by_rows = engine._smart_sample(rows, favorite_tags, size=20, catalog=catalog)
+    assert [f["id"] for f in by_rows] == [f["id"] for f in by_dicts]
+
+
+def test_smart_sample_prefers_matching_tags():
+    foods = make_catalog(n_items=300, n_tags=50, seed=12)
+    catalog = FoodCatalog(foods)
+    engine = TyphoonEngine(api_key="test")
+    shortlist = engine._smart_sample(np.arange(300), ["tag7"], size=20, catalog=catalog)
+    matching = [f for f in shortlist if "tag7" in f["tags"]]
+    assert len(shortlist) == 20
+    assert len(matching) == min(14, len(catalog.tag_postings["tag7"]))
+
+
+def test_parse_ai_response_keeps_only_shortlist_ids():
+    engine = TyphoonEngine(api_key="test")
+    shortlist = [{"id": "a1"}, {"id": "b2"}, {"id": "c3"}]
+    content = '```json\n["b2", "zz", "a1", "b2"]\n```'
+    assert engine._parse_ai_response(content, shortlist) == ["b2", "a1"]
+    assert engine._parse_ai_response("Sure: [b2, 'c3']", shortlist) == ["b2", "c3"]
+
+
+def test_predict_shares_pooled_connections_under_load():
+    catalog = FoodCatalog(make_catalog(n_items=200, n_tags=30, seed=13))
+    server = FakeTyphoonServer(latency=0.02)
+    engine = TyphoonEngine(api_key="test", url=server.url, max_concurrency=4)
+
+    async def burst():
+        await engine.start()
+        try:
+            # history ต่างกันทุก call -> ไม่ถูก single-flight รวม
+            return await asyncio.gather(*(
+                engine.predict(np.arange(200), [f"Menu {i}"], [], [], ["tag1"], catalog=catalog) for i in range(60)
+            ))
+        finally:
+            await engine.aclose()
+
+    try:
+        results = asyncio.run(burst())
+    finally:
+        server.close()
+    assert all(len(ids) == 10 for ids in results)
+    assert server.requests == 60
+    assert server.max_in_flight <= 4
+    assert server.connections <= 4
+
+
+def test_start_on_new_loop_retires_the_old_client():
+    engine = TyphoonEngine(api_key="test", url="http://127.0.0.1:9/v1/chat/completions")
+    other = asyncio.new_event_loop()
+    thread = threading.Thread(target=other.run_forever, daemon=True)
+    thread.start()
+    try:
+        # loop เดิมยังวิ่งอยู่ -> client เดิมถูก aclose บน loop ของมันเอง
+        asyncio.run_coroutine_threadsafe(engine.start(), other).result(timeout=5)
+        old = engine.client
+        asyncio.run(engine.start())
+        for _ in range(100):
+            if old.is_closed:
+                break
+            time.sleep(0.01)
+        assert old.is_closed
+        assert engine.client is not old
+    finally:
+        other.call_soon_threadsafe(other.stop)
+        thread.join(timeout=5)
+        other.close()
+
+    # loop เดิมปิดไปแล้ว (asyncio.run จบ) -> ทิ้ง client เดิม เปิดใหม่บน loop ปัจจุบัน
+    stale = engine.client
+    asyncio.run(engine.start())
+    assert engine.client is not stale
+    asyncio.run(engine.aclose())
+    assert engine.client is None
+
+
+def test_predict_raises_typhoon_error_when_api_errors():
+    foods = make_catalog(n_items=50, n_tags=10, seed=14)
+    server = FakeTyphoonServer(latency=0, status=500)
+    engine = TyphoonEngine(api_key="test", url=server.url)
+    failures = metrics.counter("typhoon_failures_total", reason="status")
+    before = failures.value
+
+    async def call():
+        # ไม่ได้ start(): client ต้องเปิดเองตอนเรียกครั้งแรก
+        try:
+            return await failure_reason(engine.predict(foods, [], [], [], ["tag1"]))
+        finally:
+            await engine.aclose()
+
+    try:
+        assert asyncio.run(call()) == "status"
+    finally:
+        server.close()
+    assert failures.value == before + 1
+
+
+def test_predict_serves_repeat_inputs_from_cache():
+    foods = make_catalog(n_items=100, n_tags=20, seed=15)
+    catalog = FoodCatalog(foods)
+    server = FakeTyphoonServer(latency=0)
+    engine = TyphoonEngine(api_key="test", url=server.url, cache=TTLCache(max_entries=16, ttl=60))
+    rows = np.arange(50)
+
+    async def calls():
+        try:
+            first = await engine.predict(rows, ["A"], [], [], ["tag2", "tag1"], catalog=catalog)
+            # ลำดับ tags / candidates ต่างกันแต่ normalize แล้วเหมือนกัน -> hit
+            second = await engine.predict(rows[::-1].copy(), ["A"], [], [], ["tag1", "tag2"], catalog=catalog)
+            # candidates ชุดอื่น -> key อื่น -> ถาม LLM ใหม่
+            other = await engine.predict(rows[:40], ["A"], [], [], ["tag1", "tag2"], catalog=catalog)
+            return first, second, other
+        finally:
+            await engine.aclose()
+
+    try:
+        first, second, other = asyncio.run(calls())
+    finally:
+        server.close()
+    assert second == first
+    assert server.requests == 2
+    assert set(other) <= set(catalog.ids[:40])
+    stats = engine.cache.stats()
+    assert stats["hits"] == 1 and stats["misses"] == 2
+
+    # ตอน hit ต้องตรวจ ids กับ candidates ปัจจุบันเสมอ: เมนูที่หายไปแล้วถูกตัดทิ้ง
+    key = engine._request_key(rows, ["A"], [], [], ["tag1", "tag2"], catalog)
+    engine.cache.set(key, ["gone1", first[0], first[1], first[2], "gone2"])
+    assert engine._cached_recommendation(key, rows, catalog) == first[:3]
+    engine.cache.set(key, ["gone1", first[0]])
+    assert engine._cached_recommendation(key, rows, catalog) is None
+    assert engine.cache.get(key) is None
+
+
+def test_identical_concurrent_calls_share_one_upstream_request():
+    catalog = FoodCatalog(make_catalog(n_items=100, n_tags=20, seed=16))
+    server = FakeTyphoonServer(latency=0.05)
+    engine = TyphoonEngine(api_key="test", url=server.url)
+
+    async def burst():
+        try:
+            same = [engine.predict(np.arange(100), [], [], [], ["tag1"], catalog=catalog) for _ in range(30)]
+            different = engine.predict(np.arange(100), ["Menu 1"], [], [], ["tag1"], catalog=catalog)
+            return await asyncio.gather(*same, different)
+        finally:
+            await engine.aclose()
+
+    try:
+        *same, different = asyncio.run(burst())
+    finally:
+        server.close()
+    assert server.requests == 2
+    assert all(ids == same[0] for ids in same)
+    assert len(different) == 10
+    assert engine.stats() == {"upstream_calls": 2, "coalesced": 29, "in_flight": 0}
+
+
+def test_waiters_share_the_error_when_upstream_fails():
+    foods = make_catalog(n_items=60, n_tags=10, seed=17)
+    server = FakeTyphoonServer(latency=0.02, status=500)
+    engine = TyphoonEngine(api_key="test", url=server.url)
+
+    async def burst():
+        try:
+            return await asyncio.gather(*(failure_reason(engine.predict(foods, [], [], [], ["tag1"])) for _ in range(10)))
+        finally:
+            await engine.aclose()
+
+    try:
+        results = asyncio.run(burst())
+    finally:
+        server.close()
+    assert server.requests == 1
+    assert results == ["status"] * 10
+
+
+def test_cancelled_last_waiter_cancels_upstream_call():
+    catalog = FoodCatalog(make_catalog(n_items=50, n_tags=10, seed=18))
+    server = FakeTyphoonServer(latency=0.3)
+    engine = TyphoonEngine(api_key="test", url=server.url, cache=TTLCache(max_entries=4, ttl=60))
+
+    async def give_up():
+        try:
+            call = engine.predict(np.arange(50), [], [], [], ["tag1"], catalog=catalog)
+            try:
+                await asyncio.wait_for(call, timeout=0.05)
+            except asyncio.TimeoutError:
+                pass
+            await asyncio.sleep(0.4)
+        finally:
+            await engine.aclose()
+
+    try:
+        asyncio.run(give_up())
+    finally:
+        server.close()
+    # ไม่มีใครรอแล้ว -> upstream ถูก cancel คำตอบไม่ถูกเก็บลง cache
+    assert engine.stats()["in_flight"] == 0
+    assert len(engine.cache) == 0
+
+
+def test_breaker_opens_and_short_circuits_upstream():
+    foods = make_catalog(n_items=60, n_tags=10, seed=19)
+    server = FakeTyphoonServer(latency=0, status=503)
+    breaker = CircuitBreaker(window=10, min_calls=3, error_rate=0.5, open_seconds=60)
+    engine = TyphoonEngine(api_key="test", url=server.url, breaker=breaker)
+
+    async def calls():
+        try:
+            results = []
+            for i in range(3):
+                results.append(await failure_reason(engine.predict(foods, [f"Menu {i}"], [], [], ["tag1"])))
+            assert not engine.is_available()
+            with pytest.raises(CircuitOpenError):
+                await engine.predict(foods, ["Menu 9"], [], [], ["tag1"])
+            return results
+        finally:
+            await engine.aclose()
+
+    try:
+        results = asyncio.run(calls())
+    finally:
+        server.close()
+    assert results == ["status"] * 3  # 3 ครั้งแรก: ยิงจริงแล้วพัง
+    assert server.requests == 3
+    assert breaker.stats()["state"] == "open"
+
+
+def test_compact_prompt_uses_aliases_and_token_budget():
+    foods = make_catalog(n_items=20, n_tags=10, seed=20, realistic=True)
+    engine = TyphoonEngine(api_key="test", prompt_token_budget=10_000)
+    prompt, options, aliases = engine._build_compact_prompt(foods, ["ผัดไทย สูตร 1"], [], [], ["tag1"])
+    assert len(options) == 20
+    assert aliases["1"] == foods[0]["id"] and aliases["20"] == foods[19]["id"]
+    assert foods[0]["id"] not in prompt  # ไม่ส่ง id ยาวๆ
+    full_prompt = engine._build_smart_prompt(foods, ["ผัดไทย สูตร 1"], [], [], ["tag1"])
+    assert estimate_tokens(prompt) < estimate_tokens(full_prompt) * 0.7
+
+    # alias -> id (ตัวเลขจาก JSON, string, alias ที่ไม่มีจริงถูกตัดทิ้ง)
+    assert engine._parse_ai_response("[3, \"1\", 99, 3]", options, aliases) == [foods[2]["id"], foods[0]["id"]]
+
+    # budget ต่ำ -> ตัด options เหลืออย่างน้อย 10 ตัว
+    engine.prompt_token_budget = 50
+    _, options, aliases = engine._build_compact_prompt(foods, [], [], [], None)
+    assert len(options) == len(aliases) == 10
+
+    payload = engine._build_payload(prompt, options, aliases)
+    assert payload["max_tokens"] == MIN_ANSWER_TOKENS  # ยังต่ำกว่า 2048 เดิมมาก
+    assert payload["messages"][0]["content"] == COMPACT_SYSTEM_PROMPT
+
+
+def test_max_tokens_leaves_room_for_a_verbose_reply():
+    foods = make_catalog(n_items=20, n_tags=10, seed=20, realistic=True)
+    engine = TyphoonEngine(api_key="test")
+    _, options, aliases = engine._build_compact_prompt(foods, [], [], [], ["tag1"])
+    payload = engine._build_payload("prompt", options, aliases)
+    # คำเกริ่น + ```json + array แบบขึ้นบรรทัดละตัว: เกิน cap เดิม (3 x expected + 16 ~ 55 tokens)
+    reply = ("Sure! Based on the user's recent meals (Pad Thai, Som Tam) and their favorite tags, here are the ten "
+             "best matches from the list, ranked from most to least relevant:\n```json\n[\n"
+             + ",\n".join(f"  {n}" for n in range(1, 11)) + "\n]\n```")
+    assert 55 < estimate_tokens(reply) <= payload["max_tokens"]
+    # model ตอบได้ไม่เกิน max_tokens (~4 ตัวอักษร/token): ตัดที่ cap แล้วยังได้ครบ 10 ids
+    truncated = reply[:payload["max_tokens"] * 4]
+    assert engine._parse_ai_response(truncated, options, aliases) == [f["id"] for f in foods[:10]]
+
+
+def run_stream(server, deadline=None, cache=None, **engine_kwargs):
+    """เรียก predict ครั้งเดียวใน stream mode -> (ids, วินาทีที่ใช้, engine)"""
+    catalog = FoodCatalog(make_catalog(n_items=60, n_tags=10, seed=21))
+    engine = TyphoonEngine(api_key="test", url=server.url, stream=True, cache=cache,
+                           prompt_token_budget=10_000, **engine_kwargs)
+
+    async def call():
+        try:
+            started = asyncio.get_running_loop().time()
+            ids = await engine.predict(np.arange(60), [], [], [], ["tag1"], catalog=catalog, deadline=deadline)
+            return ids, asyncio.get_running_loop().time() - started
+        finally:
+            await engine.aclose()
+
+    ids, elapsed = asyncio.run(call())
+    return ids, elapsed, engine
+
+
+def test_stream_matches_non_stream_answer():
+    foods = make_catalog(n_items=60, n_tags=10, seed=22)
+    server = FakeTyphoonServer(latency=0)
+
+    async def both():
+        results = []
+        for stream in (False, True):
+            engine = TyphoonEngine(api_key="test", url=server.url, stream=stream)
+            try:
+                random.seed(3)
+                results.append(await engine.predict(foods, [], [], [], ["tag1"]))
+            finally:
+                await engine.aclose()
+        return results
+
+    try:
+        plain, streamed = asyncio.run(both())
+    finally:
+        server.close()
+    assert streamed == plain and len(streamed) == 10
+
+
+@pytest.mark.parametrize("tail", [
+    ['{"choices": [], "usage": {"total_tokens": 42}}'],  # usage chunk แบบ OpenAI
+    ['{"usage": {"total_tokens": 42}}', "{not json", '{"choices": [{"delta": {"content": "[1]"}}]}'],
+])
+def test_stream_skips_empty_choices_and_stops_at_malformed_chunk(tail):
+    # ตอบ 5 ids (ไม่ถึง 10): อ่านจนจบ stream ผ่าน chunk ท้ายพวกนี้ ต้องไม่กลายเป็น TyphoonError
+    server = FakeTyphoonServer(latency=0, answer_size=5, stream_tail=tail)
+    try:
+        ids, _, _ = run_stream(server)
+    finally:
+        server.close()
+    assert len(ids) == 5 and not ids.partial
+
+
+def test_breaker_timeout_bounds_the_whole_stream():
+    # token มาทุก 0.1s (ไม่เกิน timeout ต่อ read) แต่ทั้ง stream ~1s > timeout ของ breaker 0.3s
+    server = FakeTyphoonServer(latency=0, per_output_token=0.1)
+    breaker = CircuitBreaker(min_calls=5, min_timeout=0.1, max_timeout=0.3)
+    engine = TyphoonEngine(api_key="test", url=server.url, stream=True, breaker=breaker)
+    catalog = FoodCatalog(make_catalog(n_items=60, n_tags=10, seed=21))
+
+    async def call():
+        try:
+            started = time.perf_counter()
+            reason = await failure_reason(engine.predict(np.arange(60), [], [], [], ["tag1"], catalog=catalog))
+            return reason, time.perf_counter() - started
+        finally:
+            await engine.aclose()
+
+    try:
+        reason, elapsed = asyncio.run(call())
+    finally:
+        server.close()
+    assert reason == "timeout"
+    assert elapsed < 0.6
+    assert breaker.stats()["error_rate"] == 1.0
+
+
+def test_stream_closes_early_after_ten_ids():
+    # ตอบ 20 ids ช้าๆ ทีละ token: ได้ครบ 10 แล้วต้องตัดจบ ไม่รอครึ่งหลัง
+    server = FakeTyphoonServer(latency=0, per_output_token=0.05, answer_size=20)
+    try:
+        ids, elapsed, _ = run_stream(server, cache=TTLCache(max_entries=4, ttl=60))
+        full_time = 0.05 * estimate_tokens(str(list(range(1, 21))))
+        time.sleep(0.3)  # server รู้ว่าถูกตัดตอนเขียน chunk ถัดไป
+        stats = server.stats()
+    finally:
+        server.close()
+    assert len(ids) == 10
+    assert elapsed < full_time * 0.8
+    assert stats["aborted_streams"] == 1
+
+
+def test_stream_deadline_returns_partial_ids_without_caching():
+    server = FakeTyphoonServer(latency=0, per_output_token=0.1)
+    cache = TTLCache(max_entries=4, ttl=60)
+    try:
+        ids, elapsed, _ = run_stream(server, deadline=0.6, cache=cache)
+    finally:
+        server.close()
+    assert 3 <= len(ids) < 10 and ids.partial
+    assert elapsed < 0.9
+    assert len(cache) == 0
+
+
+def test_stream_deadline_keeps_reading_until_three_ids():
+    # ถึง deadline แล้วยังได้ไม่ถึง 3 ids -> อ่านต่อจนจบ ได้คำตอบเต็ม
+    server = FakeTyphoonServer(latency=0.2, per_output_token=0.01)
+    try:
+        ids, elapsed, engine = run_stream(server, deadline=0.05, cache=TTLCache(max_entries=4, ttl=60))
+    finally:
+        server.close()
+    assert len(ids) == 10 and not ids.partial
+    assert elapsed >= 0.2
+    assert len(engine.cache) == 1
+
+
+def test_sampling_is_seeded_from_request_key():
+    # ไม่มี favorite tags -> shortlist แบบสุ่ม (fake server ตอบตาม shortlist); input เดิมต้องได้คำตอบเดิมเสมอ
+    catalog = FoodCatalog(make_catalog(n_items=200, n_tags=20, seed=23))
+    server = FakeTyphoonServer(latency=0)
+    engine = TyphoonEngine(api_key="test", url=server.url)
+
+    async def calls():
+        try:
+            return [await engine.predict(np.arange(200), names, [], [], [], catalog=catalog)
+                    for names in ([], [], ["Menu 1"])]
+        finally:
+            await engine.aclose()
+
+    try:
+        first, second, other = asyncio.run(calls())
+    finally:
+        server.close()
+    assert first == second
+    assert other != first